@@ -1,20 +1,25 @@
 """Aplicación Flask principal con webhook de Telegram y web app"""
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, send_file
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, send_file, g
 from functools import wraps
 import logging
+import base64
 import json
 import asyncio
-import threading
-from concurrent.futures import ThreadPoolExecutor
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 import config
 import database
+import data_export
+import db_backup
+import job_queue
+import live_events
 import telegram_bot
+import telegram_runtime
+import telegram_sender
+import web_responses
+from utils import parse_task_date
 import os
-import shutil
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, timedelta, timezone
 
 # Configurar logging
 logging.basicConfig(
@@ -46,67 +51,25 @@ def format_date_filter(value):
     """Formatea fecha a dd/mm/yyyy"""
     if not value:
         return ''
-    try:
-        from datetime import datetime
-        # Intentar parsear diferentes formatos
-        if isinstance(value, str):
-            # Si tiene formato ISO con hora
-            if 'T' in value or ' ' in value:
-                try:
-                    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                    return dt.strftime('%d/%m/%Y')
-                except:
-                    try:
-                        dt = datetime.strptime(value[:10], '%Y-%m-%d')
-                        return dt.strftime('%d/%m/%Y')
-                    except:
-                        return value[:10] if len(value) >= 10 else value
-            else:
-                # Solo fecha
-                try:
-                    dt = datetime.strptime(value[:10], '%Y-%m-%d')
-                    return dt.strftime('%d/%m/%Y')
-                except:
-                    return value
-        elif isinstance(value, datetime):
-            return value.strftime('%d/%m/%Y')
-        return str(value)
-    except Exception:
-        return str(value) if value else ''
+    dt = parse_task_date(value)
+    if dt:
+        return dt.strftime('%d/%m/%Y')
+    return str(value)
 
 @app.template_filter('date_weekday')
 def date_weekday_filter(value):
     """Obtiene el día de la semana de una fecha"""
-    if not value:
-        return ''
-    try:
-        from datetime import datetime
-        if isinstance(value, str):
-            try:
-                dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                return dt.strftime('%A')
-            except:
-                try:
-                    dt = datetime.strptime(value[:10], '%Y-%m-%d')
-                    return dt.strftime('%A')
-                except:
-                    return ''
-        elif isinstance(value, datetime):
-            return value.strftime('%A')
-        return ''
-    except Exception:
-        return ''
+    dt = parse_task_date(value)
+    return dt.strftime('%A') if dt else ''
 
 # Inicializar bot de Telegram
 bot_handler = telegram_bot.TelegramBotHandler()
 telegram_app = None
-telegram_loop = None  # Event loop compartido del Application
-telegram_loop_thread = None  # Thread que mantiene el loop vivo
-executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="telegram_bot")
-telegram_initialized = False
+rate_limiter = telegram_sender.OutboundRateLimiter()
 
 if config.TELEGRAM_BOT_TOKEN:
-    telegram_app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    # Todas las llamadas del bot pasan por el planificador de envíos (límites, 429, coalescencia)
+    telegram_app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).rate_limiter(rate_limiter).build()
     
     # Handlers
     telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handler.handle_text_message))
@@ -124,7 +87,7 @@ if config.TELEGRAM_BOT_TOKEN:
     # Inicializar el Application
     # En producción usa webhook, en local usa polling
     if config.TELEGRAM_WEBHOOK_URL:
-        logger.info("Bot de Telegram configurado (modo webhook - inicialización lazy)")
+        logger.info("Bot de Telegram configurado (modo webhook)")
     else:
         logger.info("Bot de Telegram configurado (modo polling para desarrollo local)")
 else:
@@ -181,6 +144,11 @@ def ensure_master_user():
     if not _master_user_initialized:
         init_master_user()
 
+@app.before_request
+def load_current_user():
+    """Carga una vez por request el usuario de la sesión con sus categorías (caché con TTL en Database)"""
+    g.current_user = database.db.get_web_user_identity(session['user_id']) if 'user_id' in session else None
+
 # Inicializar usuario maestro al importar el módulo (para desarrollo local)
 try:
     logger.info("🔧 Inicializando usuario maestro al arrancar aplicación...")
@@ -203,19 +171,21 @@ def master_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        db = database.db
-        user = db.get_web_user_by_id(session['user_id'])
+        user = get_current_user()
         if not user or not user.get('is_master'):
             return redirect(url_for('tasks'))
         return f(*args, **kwargs)
     return decorated_function
 
 def get_current_user():
-    """Obtiene el usuario actual desde la sesión"""
-    if 'user_id' not in session:
-        return None
-    db = database.db
-    return db.get_web_user_by_id(session['user_id'])
+    """Obtiene el usuario actual (cargado en load_current_user) con sus categorías en 'categories'"""
+    if 'current_user' not in g:
+        load_current_user()
+    return g.current_user
+
+def has_category_access(user, category_name):
+    """Verifica si el usuario actual tiene acceso a una categoría sin consultar la BD"""
+    return bool(user.get('is_master')) or category_name in user['categories']
 
 @app.route('/admin/login', methods=['GET', 'POST'])
 def login():
@@ -268,76 +238,45 @@ def logout():
 
 # ========== WEBHOOK TELEGRAM ==========
 
-def _ensure_telegram_loop():
-    """Asegura que existe un loop compartido para el Application"""
-    global telegram_loop, telegram_loop_thread, telegram_initialized
-    
-    if telegram_loop is not None and not telegram_loop.is_closed():
-        return telegram_loop
-    
-    def run_loop():
-        """Ejecuta el loop en un thread separado"""
-        global telegram_loop, telegram_initialized
-        import asyncio
-        
-        # Crear nuevo loop para este thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        telegram_loop = loop
-        
-        # Inicializar Application en este loop
-        try:
-            logger.info("[LOOP] Inicializando Application en loop compartido...")
-            loop.run_until_complete(telegram_app.initialize())
-            telegram_initialized = True
-            logger.info("[LOOP] ✅ Application inicializado en loop compartido")
-        except Exception as e:
-            logger.error(f"[LOOP] Error inicializando Application: {e}", exc_info=True)
-            telegram_initialized = False
-            return
-        
-        # Mantener el loop corriendo
-        try:
-            loop.run_forever()
-        except Exception as e:
-            logger.error(f"[LOOP] Error en loop: {e}", exc_info=True)
-        finally:
-            loop.close()
-    
-    # Iniciar thread con el loop
-    telegram_loop_thread = threading.Thread(target=run_loop, daemon=True, name="telegram_loop")
-    telegram_loop_thread.start()
-    
-    # Esperar a que el loop esté listo
-    import time
-    max_wait = 5
-    waited = 0
-    while (telegram_loop is None or telegram_loop.is_closed() or not telegram_initialized) and waited < max_wait:
-        time.sleep(0.1)
-        waited += 0.1
-    
-    if telegram_loop is None or telegram_loop.is_closed():
-        raise RuntimeError("No se pudo crear el loop compartido")
+def _start_job_workers():
+    """Arranca los workers de la cola de trabajos (solo en el proceso líder)"""
+    if not config.JOB_QUEUE_ENABLED:
+        return
+    if telegram_app:
+        job_queue.set_notifier(_send_job_notification)
+    job_queue.start_workers()
+
+
+def _send_job_notification(chat_id: int, text: str, message_id: int = None):
+    """Envía (o edita) el mensaje de seguimiento de un trabajo terminado (thread del worker)"""
+    if message_id:
+        coro = telegram_app.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    else:
+        coro = telegram_app.bot.send_message(chat_id=chat_id, text=text)
+    runtime.run_coroutine(coro, timeout=30)
+
+
+# Runtime del bot: lo mantiene un único worker (el líder); los demás le reenvían los updates
+runtime = telegram_runtime.TelegramRuntime(telegram_app, on_leader=_start_job_workers)
+
+
+def start_background_services(polling: bool = False):
+    """
+    Elige el proceso líder y arranca en él el runtime de Telegram y la cola de trabajos.
     
-    return telegram_loop
+    Se llama desde el hook post_worker_init de gunicorn (gunicorn.conf.py) para que
+    el primer webhook no pague la inicialización, o al arrancar con python app.py.
+    """
+    runtime.start(polling=polling)
 
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook para recibir actualizaciones de Telegram"""
-    global telegram_initialized, telegram_loop
-    
     if not telegram_app:
         logger.error("Webhook recibido pero bot no configurado")
         return jsonify({'error': 'Bot no configurado'}), 503
     
-    # Asegurar que existe el loop compartido
-    try:
-        _ensure_telegram_loop()
-    except Exception as e:
-        logger.error(f"[WEBHOOK] Error asegurando loop: {e}", exc_info=True)
-        return jsonify({'error': 'Error inicializando bot'}), 500
-    
     # Verificar secreto si está configurado
     if config.TELEGRAM_WEBHOOK_SECRET:
         secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
@@ -345,39 +284,25 @@ def webhook():
             logger.warning("Intento de webhook con secreto incorrecto")
             return jsonify({'error': 'Unauthorized'}), 401
     
+    update_data = request.get_json(silent=True)
+    if not update_data:
+        logger.warning("Webhook recibido sin datos")
+        return jsonify({'error': 'No data'}), 400
+    
+    update_type = 'message' if 'message' in update_data else 'callback_query' if 'callback_query' in update_data else 'other'
+    logger.info(f"[WEBHOOK] Recibida actualización {update_data.get('update_id')}, tipo: {update_type}")
+    
+    # El runtime procesa el update en segundo plano (o lo reenvía al líder) y se responde ya
     try:
-        update_data = request.get_json()
-        if not update_data:
-            logger.warning("Webhook recibido sin datos")
-            return jsonify({'error': 'No data'}), 400
-        
-        # Crear el Update
-        update = Update.de_json(update_data, telegram_app.bot if telegram_app._initialized else None)
-        update_type = 'message' if update.message else 'callback_query' if update.callback_query else 'other'
-        logger.info(f"[WEBHOOK] Recibida actualización {update.update_id}, tipo: {update_type}")
-        
-        # Procesar actualización en el loop compartido
-        def process_update_async():
-            """Ejecuta process_update en el loop compartido"""
-            import asyncio
-            try:
-                # Usar run_coroutine_threadsafe para ejecutar en el loop compartido
-                future = asyncio.run_coroutine_threadsafe(
-                    telegram_app.process_update(update),
-                    telegram_loop
-                )
-                # Esperar a que termine (con timeout)
-                future.result(timeout=30)
-                logger.info(f"[WEBHOOK] Actualización {update.update_id} procesada")
-            except Exception as e:
-                logger.error(f"[WEBHOOK] Error procesando actualización {update.update_id}: {e}", exc_info=True)
-        
-        executor.submit(process_update_async)
-        
-        return jsonify({'ok': True})
+        runtime.submit_update(update_data)
+    except RuntimeError as e:
+        logger.error(f"[WEBHOOK] {e}")
+        return jsonify({'error': 'Bot no disponible'}), 503
     except Exception as e:
         logger.error(f"[WEBHOOK] Error procesando webhook: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
+    
+    return jsonify({'ok': True})
 
 
 @app.route('/webhook/set', methods=['POST'])
@@ -420,12 +345,104 @@ def index():
     return redirect(url_for('tasks'))
 
 
+# Días de la semana (lunes a domingo) con las claves que usa la vista de calendario
+WEEK_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _week_start(week_offset: int):
+    """Lunes de la semana actual desplazada week_offset semanas"""
+    today = datetime.now().date()
+    return today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
+
+
+def _week_tasks(week_start, args, current_user):
+    """
+    Tareas de la semana que empieza en week_start con los filtros de /admin/tasks
+    (rango indexado sobre task_day más las condiciones de _task_list_filters)
+    """
+    return database.db.get_tasks_by_day_range(
+        week_start, week_start + timedelta(days=6), **_task_list_filters(args, current_user)
+    )
+
+
+def _task_list_filters(args, current_user) -> dict:
+    """Filtros de /admin/tasks (query string) -> argumentos de Database.get_tasks_list_page"""
+    status = args.get('status', 'open')
+    priority = args.get('priority', 'all')
+    category = args.get('category', 'all')
+    task_day = None
+    if args.get('task_date'):
+        try:
+            task_day = datetime.strptime(args['task_date'], '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            # Si la fecha no es válida, ignorar el filtro
+            pass
+    return {
+        'status': status if status not in ('all', '') else None,
+        'priority': priority if priority != 'all' else None,
+        'category': category if category != 'all' else None,
+        'user_id': args.get('user_id', type=int),
+        'task_day': task_day,
+        'search': args.get('search', '').strip() or None,
+        # Los usuarios que no son maestros solo ven sus categorías (y las tareas sin categoría)
+        'allowed_categories': None if current_user.get('is_master') else current_user['categories'],
+        'include_archive': args.get('archive') == '1',
+    }
+
+
+def _task_list_page(section: str, after: tuple, filters: dict):
+    """
+    Una página de tarjetas de /admin/tasks ('dated' o 'undated') con sus imágenes
+    y su última ampliación, leídas en una consulta para toda la página.
+    
+    Returns:
+        (tareas, cursor de la página siguiente o None)
+    """
+    tasks_list, next_key = database.db.get_tasks_list_page(
+        dated=section == 'dated', after=after, limit=config.TASKS_PAGE_SIZE, **filters
+    )
+    _add_card_data(tasks_list, include_archive=filters.get('include_archive', False))
+    return tasks_list, _encode_cursor(next_key) if next_key else None
+
+
+def _add_card_data(tasks_list, include_archive=False):
+    """Añade a cada tarea sus imágenes y su última ampliación (una consulta de cada para todas)"""
+    db = database.db
+    task_ids = [task['id'] for task in tasks_list]
+    images = db.get_task_images_for_tasks(task_ids, include_archive=include_archive)
+    ampliaciones = db.get_last_ampliaciones(task_ids, include_archive=include_archive)
+    for task in tasks_list:
+        # Las imágenes se piden al abrir el modal: en la tarjeta solo van sus ids
+        task['images'] = [{'id': image['id']} for image in images[task['id']]]
+        last_ampliacion = ampliaciones.get(task['id'])
+        if last_ampliacion:
+            task['last_ampliacion'] = {
+                'text': last_ampliacion.get('ampliacion_text', ''),
+                'user_name': last_ampliacion.get('user_name', ''),
+                'created_at': last_ampliacion.get('created_at', '')
+            }
+        else:
+            task['last_ampliacion'] = None
+
+
+def _visible_categories(current_user):
+    """Categorías que puede ver el usuario (todas si es maestro)"""
+    categories_list = database.db.get_all_categories()
+    if current_user.get('is_master'):
+        return categories_list
+    allowed_category_names = current_user['categories']
+    return [cat for cat in categories_list if cat.get('name') in allowed_category_names]
+
+
 @app.route('/admin/tasks')
 @login_required
 def tasks():
-    """Vista de tareas"""
-    from datetime import datetime
+    """
+    Vista de tareas.
     
+    Solo se pinta la primera página de cada sección (TASKS_PAGE_SIZE tarjetas);
+    el resto lo pide el navegador a /admin/tasks/page al llegar al final.
+    """
     current_user = get_current_user()
     if not current_user:
         return redirect(url_for('login'))
@@ -437,203 +454,146 @@ def tasks():
     task_date = request.args.get('task_date', '')
     view_mode = request.args.get('view_mode', 'list')
     search_query_raw = request.args.get('search', '').strip()
-    search_query = search_query_raw.lower()
     week_offset = request.args.get('week_offset', type=int, default=0)  # Offset de semanas (0 = semana actual)
-    
-    db = database.db
-    tasks_list = db.get_tasks()
-    
-    # Obtener categorías según permisos del usuario
-    if current_user.get('is_master'):
-        categories_list = db.get_all_categories()  # Master ve todas las categorías
-    else:
-        # Usuarios normales solo ven sus categorías asignadas
-        allowed_category_names = db.get_user_categories(current_user['id'])
-        all_categories = db.get_all_categories()
-        categories_list = [cat for cat in all_categories if cat.get('name') in allowed_category_names]
-    
-    # Filtrar tareas por categorías permitidas si no es maestro
-    if not current_user.get('is_master'):
-        allowed_categories = db.get_user_categories(current_user['id'])
-        tasks_list = [t for t in tasks_list if not t.get('category') or t.get('category') in allowed_categories]
-    
-    # Filtrar
-    if status != 'all':
-        tasks_list = [t for t in tasks_list if t['status'] == status]
-    if priority != 'all':
-        tasks_list = [t for t in tasks_list if t['priority'] == priority]
-    if category != 'all':
-        tasks_list = [t for t in tasks_list if t.get('category') == category]
-    if user_id:
-        tasks_list = [t for t in tasks_list if t['user_id'] == user_id]
-    
-    # Búsqueda en todos los campos
-    if search_query:
-        search_results = []
-        for task in tasks_list:
-            # Buscar en todos los campos relevantes
-            searchable_fields = [
-                task.get('title', '') or '',
-                task.get('description', '') or '',
-                task.get('client_name_raw', '') or '',
-                task.get('solution', '') or '',
-                task.get('ampliacion', '') or '',
-                task.get('category', '') or '',
-                task.get('user_name', '') or '',
-            ]
-            # Concatenar todos los campos y buscar
-            searchable_text = ' '.join(str(field) for field in searchable_fields).lower()
-            if search_query in searchable_text:
-                search_results.append(task)
-        tasks_list = search_results
-    
-    if task_date:
-        # Filtrar por fecha de tarea (comparar solo la fecha, sin hora)
-        try:
-            filter_date = datetime.strptime(task_date, '%Y-%m-%d').date()
-            filtered_tasks = []
-            for t in tasks_list:
-                if t.get('task_date'):
-                    try:
-                        task_dt = datetime.fromisoformat(t['task_date'].replace('Z', '+00:00'))
-                        if task_dt.date() == filter_date:
-                            filtered_tasks.append(t)
-                    except (ValueError, AttributeError):
-                        # Si hay error al parsear la fecha, intentar formato alternativo
-                        try:
-                            task_dt = datetime.strptime(t['task_date'][:10], '%Y-%m-%d')
-                            if task_dt.date() == filter_date:
-                                filtered_tasks.append(t)
-                        except (ValueError, AttributeError):
-                            continue
-            tasks_list = filtered_tasks
-        except ValueError:
-            # Si la fecha no es válida, ignorar el filtro
-            pass
-    
-    # Obtener clientes para filtro
-    clients = db.get_all_clients()
-    
-    # Obtener usuarios únicos
-    users = {}
-    for task in tasks_list:
-        user_id = task['user_id']
-        if user_id not in users:
-            users[user_id] = task.get('user_name', f'Usuario {user_id}')
+    include_archive = request.args.get('archive') == '1'  # Buscar también en las tareas archivadas
     
     # Asegurar que current_status tenga un valor válido
     if not status or status == '':
         status = 'open'
     
-    # Separar tareas con fecha y sin fecha
-    tasks_with_date = []
-    tasks_without_date = []
-    
-    for task in tasks_list:
-        if task.get('task_date'):
-            tasks_with_date.append(task)
-        else:
-            tasks_without_date.append(task)
-    
-    # Ordenar tareas con fecha por fecha más reciente primero (descendente)
-    tasks_with_date.sort(key=lambda x: x.get('task_date', '') or '', reverse=True)
-    
-    # Obtener imágenes y última ampliación para cada tarea
-    for task in tasks_with_date:
-        task['images'] = db.get_task_images(task['id'])
-        # Obtener última ampliación del historial
-        last_ampliacion = db.get_last_ampliacion(task['id'])
-        if last_ampliacion:
-            task['last_ampliacion'] = {
-                'text': last_ampliacion.get('ampliacion_text', ''),
-                'user_name': last_ampliacion.get('user_name', ''),
-                'created_at': last_ampliacion.get('created_at', '')
-            }
-        else:
-            task['last_ampliacion'] = None
-    for task in tasks_without_date:
-        task['images'] = db.get_task_images(task['id'])
-        # Obtener última ampliación del historial
-        last_ampliacion = db.get_last_ampliacion(task['id'])
-        if last_ampliacion:
-            task['last_ampliacion'] = {
-                'text': last_ampliacion.get('ampliacion_text', ''),
-                'user_name': last_ampliacion.get('user_name', ''),
-                'created_at': last_ampliacion.get('created_at', '')
-            }
-        else:
-            task['last_ampliacion'] = None
+    filters = _task_list_filters(request.args, current_user)
+    tasks_without_date, undated_cursor = _task_list_page('undated', None, filters)
     
-    # Para vista de calendario, calcular la semana y organizar tareas por día
+    tasks_with_date = []
+    dated_cursor = None
     tasks_by_weekday = {}
     week_dates = {}  # Fechas exactas de cada día de la semana
     if view_mode == 'calendar':
-        from datetime import timedelta
-        
-        # Calcular el lunes de la semana seleccionada
-        today = datetime.now().date()
-        days_since_monday = today.weekday()  # 0 = lunes, 6 = domingo
-        monday_of_week = today - timedelta(days=days_since_monday)
-        monday_of_selected_week = monday_of_week + timedelta(weeks=week_offset)
-        
-        # Calcular las fechas de cada día de la semana (lunes a domingo)
-        week_days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        for i, day_name in enumerate(week_days_order):
-            day_date = monday_of_selected_week + timedelta(days=i)
-            week_dates[day_name] = day_date
-        
-        # Filtrar tareas que pertenecen a la semana seleccionada
-        week_start = monday_of_selected_week
-        week_end = week_start + timedelta(days=6)
-        
-        for task in tasks_with_date:
-            try:
-                task_dt = datetime.fromisoformat(task['task_date'].replace('Z', '+00:00'))
-                task_date_only = task_dt.date()
-                
-                # Verificar si la tarea está en la semana seleccionada
-                if week_start <= task_date_only <= week_end:
-                    weekday = task_dt.strftime('%A')  # Monday, Tuesday, etc.
-                    if weekday not in tasks_by_weekday:
-                        tasks_by_weekday[weekday] = []
-                    tasks_by_weekday[weekday].append(task)
-            except (ValueError, AttributeError):
-                try:
-                    task_dt = datetime.strptime(task['task_date'][:10], '%Y-%m-%d')
-                    task_date_only = task_dt.date()
-                    
-                    # Verificar si la tarea está en la semana seleccionada
-                    if week_start <= task_date_only <= week_end:
-                        weekday = task_dt.strftime('%A')
-                        if weekday not in tasks_by_weekday:
-                            tasks_by_weekday[weekday] = []
-                        tasks_by_weekday[weekday].append(task)
-                except (ValueError, AttributeError):
-                    pass
-        
-        # Ordenar tareas dentro de cada día por fecha/hora
-        for weekday in tasks_by_weekday:
-            tasks_by_weekday[weekday].sort(key=lambda t: t.get('task_date', '') or '')
+        # La vista de calendario solo necesita las tareas de la semana seleccionada
+        week_start = _week_start(week_offset)
+        for i, day_name in enumerate(WEEK_DAYS):
+            week_dates[day_name] = week_start + timedelta(days=i)
+        for task in _week_tasks(week_start, request.args, current_user):
+            weekday = datetime.strptime(task['task_day'], '%Y-%m-%d').strftime('%A')  # Monday, Tuesday, etc.
+            tasks_by_weekday.setdefault(weekday, []).append(task)
+    else:
+        tasks_with_date, dated_cursor = _task_list_page('dated', None, filters)
     
     return render_template(
         'tasks.html',
         tasks_with_date=tasks_with_date,
         tasks_without_date=tasks_without_date,
+        dated_cursor=dated_cursor,
+        undated_cursor=undated_cursor,
         tasks_by_weekday=tasks_by_weekday,
         week_dates=week_dates,
         week_offset=week_offset,
-        clients=clients,
-        users=users,
+        users=database.db.get_task_users(),
         current_status=status,
         current_priority=priority,
         current_category=category,
         current_user_id=user_id,
         current_task_date=task_date,
         current_search=search_query_raw,
+        current_archive=include_archive,
         view_mode=view_mode,
-        categories=categories_list,
+        categories=_visible_categories(current_user),
+        current_user=current_user
+    )
+
+
+@app.route('/admin/tasks/page')
+@login_required
+def tasks_page():
+    """
+    Siguiente página de tarjetas de /admin/tasks en HTML, para el scroll infinito.
+    
+    Parámetros: section ('dated' o 'undated'), cursor (el de la página anterior)
+    y los filtros de /admin/tasks. El cursor de la página siguiente va en la
+    cabecera X-Next-Cursor (ausente si no hay más).
+    """
+    current_user = get_current_user()
+    section = request.args.get('section', 'dated')
+    try:
+        if section not in ('dated', 'undated'):
+            raise ValueError(f"sección desconocida: {section}")
+        cursor = request.args.get('cursor')
+        after = _decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+    
+    tasks_list, next_cursor = _task_list_page(section, after, _task_list_filters(request.args, current_user))
+    html = render_template(
+        'task_cards.html',
+        tasks=tasks_list,
+        section=section,
+        categories=_visible_categories(current_user),
         current_user=current_user
     )
+    response = Response(html, mimetype='text/html')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return web_responses.compress_response(response, request.accept_encodings)
+
+
+@app.route('/admin/tasks/<int:task_id>/card')
+@login_required
+def task_card(task_id):
+    """Tarjeta de una tarea en HTML (el panel la pide al recibir un cambio en directo)"""
+    db = database.db
+    current_user = get_current_user()
+    task = db.get_task_by_id(task_id)
+    if not task:
+        return jsonify({'error': 'Tarea no encontrada'}), 404
+    if task.get('category') and not has_category_access(current_user, task['category']):
+        return jsonify({'error': 'No tienes acceso a esta categoría'}), 403
+    
+    client = db.get_client_by_id(task['client_id']) if task.get('client_id') else None
+    task['client_name'] = client['name'] if client else None
+    _add_card_data([task])
+    return render_template(
+        'task_cards.html',
+        tasks=[task],
+        section='dated' if task.get('task_date') else 'undated',
+        categories=_visible_categories(current_user),
+        current_user=current_user
+    )
+
+
+@app.route('/admin/events')
+@login_required
+def admin_events():
+    """
+    Cambios de tareas en directo (Server-Sent Events) para el panel.
+    
+    Eventos task.created, task.updated, task.completed y task.deleted con el id
+    del registro de cambios; al reconectar, el navegador envía Last-Event-ID y
+    recibe lo que se ha perdido (o 'reset' si ya no está disponible).
+    """
+    current_user = get_current_user()
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after = None
+    
+    try:
+        stream = live_events.broadcaster.stream(
+            after=after,
+            allowed_categories=None if current_user.get('is_master') else current_user['categories'],
+        )
+    except live_events.StreamLimitError as e:
+        # Sin plazas: el hilo queda libre para webhooks y páginas; el panel reintenta más tarde
+        logger.warning(f"[EVENTS] {e}")
+        return (jsonify({'error': 'Demasiadas conexiones en directo, se reintentará más tarde'}), 503,
+                {'Retry-After': str(config.LIVE_EVENTS_BUSY_RETRY_SECONDS)})
+    # Response cierra el stream al terminar la petición (también si no se llega a leer): libera la plaza
+    return Response(
+        stream,
+        mimetype='text/event-stream',
+        # Sin caché ni buffer en proxies: cada evento tiene que llegar en cuanto se genera
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
 @app.route('/admin/clients')
@@ -695,18 +655,10 @@ def categories():
     db = database.db
     categories_list = db.get_all_categories()
     
-    # Si es maestro, obtener usuarios para gestión (excluyendo el master)
+    # Si es maestro, obtener usuarios para gestión (excluyendo el master), con sus categorías en una consulta
     users_with_categories = []
     if get_current_user() and get_current_user().get('is_master'):
-        users_list = db.get_all_web_users()
-        for user in users_list:
-            # Excluir usuarios master de la lista
-            if not user.get('is_master'):
-                user_categories = db.get_user_categories(user['id'])
-                users_with_categories.append({
-                    **user,
-                    'categories': user_categories
-                })
+        users_with_categories = db.get_users_with_categories(include_master=False)
     
     return render_template('categories.html', 
                           categories=categories_list,
@@ -727,6 +679,28 @@ def database_management():
     return render_template('database.html')
 
 
+@app.route('/admin/jobs')
+@master_required
+def jobs_status():
+    """Estado de la cola de trabajos en segundo plano (JSON para el panel)"""
+    db = database.db
+    status = request.args.get('status') or None
+    queue = request.args.get('queue') or None
+    return jsonify({
+        'stats': db.get_job_stats(),
+        'jobs': db.get_jobs(status=status, queue=queue, limit=50)
+    })
+
+
+@app.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@master_required
+def retry_job(job_id):
+    """Reintenta un trabajo fallido"""
+    if not database.db.retry_job(job_id):
+        return jsonify({'error': 'Solo se pueden reintentar trabajos fallidos'}), 400
+    return jsonify({'success': True})
+
+
 # ========== GESTIÓN DE USUARIOS (dentro de categorías) ==========
 
 @app.route('/admin/categories/users/create', methods=['POST'])
@@ -768,16 +742,13 @@ def get_user(user_id):
     """Obtiene los datos de un usuario para editar"""
     try:
         db = database.db
-        user = db.get_web_user_by_id(user_id)
+        # Usuario y categorías en una sola consulta
+        users = db.get_users_with_categories(user_id=user_id)
         
-        if not user:
+        if not users:
             return jsonify({'error': 'Usuario no encontrado'}), 404
         
-        # Obtener categorías del usuario
-        categories = db.get_user_categories(user_id)
-        user['categories'] = categories
-        
-        return jsonify(user)
+        return jsonify(users[0])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -795,10 +766,11 @@ def update_user(user_id):
         
         db = database.db
         
-        # Verificar que el usuario existe
-        user = db.get_web_user_by_id(user_id)
-        if not user:
+        # Verificar que el usuario existe (con sus categorías actuales)
+        users = db.get_users_with_categories(user_id=user_id)
+        if not users:
             return jsonify({'error': 'Usuario no encontrado'}), 404
+        user = users[0]
         
         # No permitir modificar al usuario maestro
         if user.get('is_master'):
@@ -822,8 +794,8 @@ def update_user(user_id):
         
         db.update_web_user(user_id, **update_data)
         
-        # Actualizar categorías
-        if category_names is not None:
+        # Actualizar categorías solo si han cambiado
+        if category_names is not None and sorted(category_names) != user['categories']:
             db.set_user_categories(user_id, category_names)
         
         return jsonify({'success': True})
@@ -982,7 +954,7 @@ def complete_task(task_id):
     # Verificar acceso a la categoría si no es master
     if not current_user.get('is_master'):
         task_category = task.get('category')
-        if task_category and not db.user_has_category_access(current_user['id'], task_category):
+        if task_category and not has_category_access(current_user, task_category):
             return redirect(url_for('tasks'))
     
     if current_user.get('is_master'):
@@ -1026,7 +998,7 @@ def ampliar_task(task_id):
         # Verificar acceso a la categoría si no es master
         if not current_user.get('is_master'):
             task_category = task.get('category')
-            if task_category and not db.user_has_category_access(current_user['id'], task_category):
+            if task_category and not has_category_access(current_user, task_category):
                 return jsonify({'error': 'No tienes acceso a esta categoría'}), 403
         
         # Guardar en historial con fecha y hora
@@ -1060,18 +1032,18 @@ def get_task_ampliaciones_history(task_id):
         db = database.db
         current_user = get_current_user()
         
-        # Verificar que la tarea existe
-        task = db.get_task_by_id(task_id)
+        # Verificar que la tarea existe (el historial también se consulta en tareas archivadas)
+        task = db.get_task_by_id(task_id, include_archive=True)
         if not task:
             return jsonify({'error': 'Tarea no encontrada'}), 404
         
         # Verificar acceso a la categoría si no es master
         if not current_user.get('is_master'):
             task_category = task.get('category')
-            if task_category and not db.user_has_category_access(current_user['id'], task_category):
+            if task_category and not has_category_access(current_user, task_category):
                 return jsonify({'error': 'No tienes acceso a esta categoría'}), 403
         
-        history = db.get_task_ampliaciones_history(task_id)
+        history = db.get_task_ampliaciones_history(task_id, include_archive=bool(task.get('archived')))
         return jsonify({'success': True, 'history': history})
     except Exception as e:
         logger.error(f"Error al obtener historial de ampliaciones: {e}", exc_info=True)
@@ -1143,16 +1115,22 @@ def get_task_image(task_id, image_id):
     import tempfile
     
     db = database.db
-    images = db.get_task_images(task_id)
+    image = db.get_task_image(image_id, include_archive=True)
     
-    # Buscar la imagen específica
-    image = next((img for img in images if img['id'] == image_id), None)
-    
-    if not image or not image.get('file_path'):
+    if not image or image['task_id'] != task_id or not image.get('file_path'):
         return jsonify({'error': 'Imagen no encontrada'}), 404
     
     file_path = image['file_path']
     
+    # Subida a SFTP en curso: se sirve la copia local. Si la subida acaba de
+    # terminar (copia local ya borrada), se relee la ruta remota
+    if image.get('upload_state') == 'pending' and not os.path.exists(file_path):
+        image = db.get_task_image(image_id, include_archive=True) or image
+        file_path = image['file_path']
+    
+    if image.get('upload_state') in ('pending', 'local') and os.path.exists(file_path):
+        return send_file(file_path, mimetype='image/jpeg')
+    
     # Verificar si es una ruta remota de SFTP o local
     is_remote_path = False
     if file_path.startswith('/') and not os.path.exists(file_path):
@@ -1239,30 +1217,71 @@ def get_task_image(task_id, image_id):
         return jsonify({'error': 'Archivo no encontrado'}), 404
 
 
+# ========== EXPORTACIÓN CSV/XLSX ==========
+
+@app.route('/admin/export/<kind>.<fmt>')
+@login_required
+def export_data(kind, fmt):
+    """
+    Exporta tareas o clientes en CSV o XLSX (/admin/export/tasks.csv, clients.xlsx...).
+    
+    Las tareas admiten los mismos filtros que /admin/tasks y respetan las
+    categorías del usuario. Se envía en streaming según se lee de la BD.
+    """
+    if kind not in data_export.COLUMNS or fmt not in data_export.FORMATS:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+    
+    filters = {}
+    if kind == 'tasks':
+        filters = _task_list_filters(request.args, get_current_user())
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'{"tareas" if kind == "tasks" else "clientes"}_{timestamp}.{fmt}'
+    return Response(
+        data_export.iter_export(kind, fmt, **filters),
+        mimetype=data_export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 # ========== IMPORTAR/EXPORTAR BASE DE DATOS ==========
 
 @app.route('/descargar_db')
 @login_required
 def descargar_db():
-    """Descarga una copia de la base de datos"""
+    """
+    Descarga una copia consistente de la base de datos.
+    
+    La copia se hace con la API de backup de SQLite (incluye lo que aún está en
+    el WAL) y se envía comprimida por bloques (?format=gzip|zstd|raw).
+    """
     try:
         db_path = config.SQLITE_PATH
+        fmt = request.args.get('format', 'gzip')
         
         # Verificar que el archivo existe
         if not os.path.exists(db_path):
             return jsonify({'error': 'Base de datos no encontrada'}), 404
         
+        if fmt not in db_backup.available_formats():
+            return jsonify({'error': f'Formato no soportado: {fmt}'}), 400
+        
+        snapshot = db_backup.create_snapshot()
+        
         # Generar nombre de archivo con timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'app_db_{timestamp}.db'
-        
-        # Enviar el archivo
-        return send_file(
-            db_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/x-sqlite3'
+        extension, mimetype = db_backup.FORMATS[fmt]
+        filename = f'app_db_{timestamp}{extension}'
+        
+        response = Response(
+            db_backup.iter_compressed(snapshot, fmt),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
         )
+        # El snapshot se borra al cerrar la respuesta: al terminar o cortarse la descarga,
+        # y también si el cuerpo no llega a leerse
+        response.call_on_close(lambda: db_backup.discard(snapshot))
+        return response
     except Exception as e:
         logger.error(f"Error descargando base de datos: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -1271,7 +1290,15 @@ def descargar_db():
 @app.route('/importar_db', methods=['POST'])
 @login_required
 def importar_db():
-    """Importa una base de datos desde un archivo"""
+    """
+    Importa una base de datos desde un archivo (.db, .db.gz o .db.zst).
+    
+    El archivo se guarda en un temporal y se valida antes de tocar la base de
+    datos activa; la copia se hace en una sola transacción. Con la cola de
+    trabajos activa se procesa en segundo plano y se responde con el id del
+    trabajo para consultar el progreso en /importar_db/<job_id>.
+    Form: mode='replace' (por defecto) o 'merge' (solo añade filas nuevas).
+    """
     try:
         # Verificar que se haya enviado un archivo
         if 'db_file' not in request.files:
@@ -1283,58 +1310,181 @@ def importar_db():
         if file.filename == '':
             return jsonify({'error': 'Archivo vacío'}), 400
         
-        # Verificar que sea un archivo .db
-        if not file.filename.endswith('.db'):
-            return jsonify({'error': 'El archivo debe ser una base de datos SQLite (.db)'}), 400
-        
-        db_path = config.SQLITE_PATH
-        db_dir = Path(db_path).parent
-        db_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Crear respaldo de la base de datos actual si existe
-        backup_created = False
-        if os.path.exists(db_path):
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_path = db_dir / f'app_db_backup_{timestamp}.db'
-            shutil.copy2(db_path, backup_path)
-            backup_created = True
-            logger.info(f"Respaldo creado: {backup_path}")
+        mode = request.form.get('mode', 'replace')
+        if mode not in ('replace', 'merge'):
+            return jsonify({'error': f'Modo de importación no válido: {mode}'}), 400
         
-        # Guardar el archivo importado
-        file.save(db_path)
+        path = db_backup.save_upload(file.stream, file.filename)
         
-        # Reinicializar la conexión de la base de datos
-        database.db.init_db()
+        if config.JOB_QUEUE_ENABLED:
+            job_id = job_queue.enqueue('db.import', {'path': path, 'mode': mode, 'filename': file.filename})
+            logger.info(f"Importación de {file.filename} encolada (trabajo {job_id}, modo {mode})")
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': url_for('importar_db_status', job_id=job_id),
+                'message': 'Importación en curso'
+            }), 202
         
+        result = db_backup.import_database(path, mode)
         logger.info(f"Base de datos importada exitosamente desde {file.filename}")
-        
         return jsonify({
             'success': True,
             'message': 'Base de datos importada exitosamente',
-            'backup_created': backup_created
+            'backup_created': True,
+            **result
         })
         
+    except db_backup.ImportValidationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error importando base de datos: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/importar_db/<int:job_id>')
+@login_required
+def importar_db_status(job_id):
+    """Estado y progreso de una importación en segundo plano"""
+    job = database.db.get_job(job_id)
+    if not job or job['job_type'] != 'db.import':
+        return jsonify({'error': 'Importación no encontrada'}), 404
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': job['progress'],
+        'result': job['result'],
+        'error': job['last_error'] if job['status'] == 'failed' else None
+    })
+
+
 # ========== API JSON ==========
 
+def _encode_cursor(key: tuple) -> str:
+    """Cursor opaco de paginación a partir de la clave de orden de la última tarea de la página"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(value: str) -> tuple:
+    created_at, task_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    return str(created_at), int(task_id)
+
+
+def _parse_updated_since(value: str) -> str:
+    """Instante ISO 8601 (con zona o en UTC) -> formato de updated_at en SQLite (UTC)"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
 @app.route('/api/tasks', methods=['GET'])
 def api_tasks():
-    """API JSON para obtener tareas"""
-    status = request.args.get('status')
-    client_id = request.args.get('client_id', type=int)
-    user_id = request.args.get('user_id', type=int)
-    
+    """
+    API JSON para obtener tareas, paginada por cursor.
+    
+    Parámetros: status, client_id, user_id, limit, cursor (next_cursor de la
+    página anterior), fields (columnas separadas por comas), updated_since
+    (ISO 8601; solo tareas modificadas desde entonces) y format=jsonl para
+    recibir todas las tareas desde el cursor como JSON lines en streaming.
+    El ETag se deriva de la versión de la tabla (registro de cambios): si no
+    ha cambiado nada se responde 304.
+    """
     db = database.db
-    tasks_list = db.get_tasks(status=status, client_id=client_id)
-    
-    if user_id:
-        tasks_list = [t for t in tasks_list if t['user_id'] == user_id]
+    try:
+        filters = {
+            'status': request.args.get('status'),
+            'client_id': request.args.get('client_id', type=int),
+            'user_id': request.args.get('user_id', type=int),
+        }
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+        unknown = [f for f in fields or [] if f not in db.task_columns]
+        if unknown:
+            raise ValueError(f"campos desconocidos: {', '.join(unknown)}")
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            filters['updated_since'] = _parse_updated_since(updated_since)
+        cursor = request.args.get('cursor')
+        after = _decode_cursor(cursor) if cursor else None
+        limit = min(max(request.args.get('limit', type=int) or config.API_PAGE_SIZE, 1), config.API_MAX_PAGE_SIZE)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+    
+    etag = web_responses.make_etag(db.latest_change_seq(), request.path, sorted(request.args.items(multi=True)))
+    if web_responses.etag_matches(request.if_none_match, etag):
+        return web_responses.not_modified(etag)
+    
+    if request.args.get('format') == 'jsonl':
+        def generate(after):
+            # Se lee por páginas: nunca hay más de una página en memoria
+            while True:
+                page = db.get_tasks_after(after, limit=config.API_MAX_PAGE_SIZE, fields=fields, **filters)
+                if not page:
+                    return
+                yield ''.join(json.dumps(task, ensure_ascii=False, default=str) + '\n' for task in page).encode('utf-8')
+                after = (page[-1]['created_at'], page[-1]['id'])
+        
+        return web_responses.streamed_response(generate(after), 'application/x-ndjson',
+                                               request.accept_encodings, etag=etag)
+    
+    # Se pide una de más para saber si hay página siguiente
+    tasks_list = db.get_tasks_after(after, limit=limit + 1, fields=fields, **filters)
+    next_cursor = None
+    if len(tasks_list) > limit:
+        tasks_list = tasks_list[:limit]
+        next_cursor = _encode_cursor((tasks_list[-1]['created_at'], tasks_list[-1]['id']))
+    
+    response = jsonify({'tasks': tasks_list, 'next_cursor': next_cursor})
+    return web_responses.compress_response(response, request.accept_encodings, etag=etag)
+
+
+@app.route('/api/calendar/week', methods=['GET'])
+@login_required
+def api_calendar_week():
+    """
+    Tareas de una semana para la vista de calendario (la pinta el navegador).
     
-    return jsonify({'tasks': tasks_list})
+    Acepta week_offset y los filtros de /admin/tasks; solo lee las tareas de
+    esa semana con un rango indexado sobre task_day.
+    """
+    current_user = get_current_user()
+    week_offset = request.args.get('week_offset', type=int, default=0)
+    week_start = _week_start(week_offset)
+    db = database.db
+    week_tasks = _week_tasks(week_start, request.args, current_user)
+    
+    days = [
+        {'key': day_key, 'date': (week_start + timedelta(days=i)).isoformat(), 'tasks': []}
+        for i, day_key in enumerate(WEEK_DAYS)
+    ]
+    categories = {}
+    for task in week_tasks:
+        day_index = (datetime.strptime(task['task_day'], '%Y-%m-%d').date() - week_start).days
+        days[day_index]['tasks'].append({
+            'id': task['id'],
+            'title': task['title'],
+            'client_name_raw': task.get('client_name_raw'),
+            'priority': task['priority'],
+            'category': task.get('category'),
+            'task_date': task['task_date'],
+        })
+        if task.get('category') and task['category'] not in categories:
+            category_obj = db.get_category(task['category'])
+            if category_obj:
+                categories[task['category']] = {
+                    'icon': category_obj['icon'],
+                    'color': category_obj['color'],
+                    'display_name': category_obj['display_name'] or category_obj['name'],
+                }
+    
+    response = jsonify({
+        'week_offset': week_offset,
+        'week_start': week_start.isoformat(),
+        'days': days,
+        'categories': categories,
+    })
+    return web_responses.compress_response(response, request.accept_encodings)
 
 
 @app.route('/api/clients', methods=['GET'])
@@ -1378,20 +1528,33 @@ def health():
         # Verificar usuario maestro
         master_user = db.get_web_user_by_username('master')
         master_status = 'exists' if master_user else 'missing'
+        
+        # Métricas de la caché de transcripciones y de la cola de trabajos
+        transcript_cache = db.get_transcript_cache_stats()
+        jobs = db.get_job_stats()
+        tasks_archive = db.get_archive_stats()
     except Exception as e:
         logger.error(f"Error verificando base de datos: {e}")
         db_status = f'error: {str(e)}'
         master_status = 'unknown'
+        transcript_cache = None
+        jobs = None
+        tasks_archive = None
     
     return jsonify({
         'status': 'ok',
         'telegram_configured': bool(config.TELEGRAM_BOT_TOKEN),
-        'telegram_initialized': telegram_initialized,
+        'telegram_initialized': runtime.initialized,
+        'telegram_runtime': runtime.status(),
+        'telegram_sender': rate_limiter.stats(),
         'calendar_configured': config.GOOGLE_CALENDAR_ENABLED,
         'database_path': config.SQLITE_PATH,
         'database_status': db_status,
         'master_user_status': master_status,
-        'admin_password_configured': bool(config.ADMIN_PASSWORD)
+        'admin_password_configured': bool(config.ADMIN_PASSWORD),
+        'transcript_cache': transcript_cache,
+        'jobs': jobs,
+        'tasks_archive': tasks_archive
     })
 
 @app.route('/admin/reset-master', methods=['POST'])
@@ -1490,7 +1653,7 @@ def webhook_status():
             webhook_info = loop.run_until_complete(telegram_app.bot.get_webhook_info())
             return jsonify({
                 'bot_configured': True,
-                'bot_initialized': telegram_initialized,
+                'bot_initialized': runtime.initialized,
                 'webhook_info': {
                     'url': webhook_info.url or 'No configurado',
                     'has_custom_certificate': webhook_info.has_custom_certificate,
@@ -1508,7 +1671,7 @@ def webhook_status():
         logger.error(f"Error obteniendo estado del webhook: {e}", exc_info=True)
         return jsonify({
             'bot_configured': True,
-            'bot_initialized': telegram_initialized,
+            'bot_initialized': runtime.initialized,
             'error': str(e)
         }), 500
 
@@ -1535,24 +1698,12 @@ if __name__ == '__main__':
             loop.close()
         except Exception as e:
             logger.debug(f"No se pudo verificar webhook: {e}")
-    elif telegram_app and not config.TELEGRAM_WEBHOOK_URL:
-        # Solo usar polling si NO hay webhook configurado (desarrollo local)
-        def start_polling():
-            """Inicia el bot en modo polling en un thread separado"""
-            try:
-                logger.info("🤖 Iniciando bot de Telegram en modo polling (desarrollo local)...")
-                telegram_app.run_polling(
-                    allowed_updates=Update.ALL_TYPES,
-                    drop_pending_updates=True,
-                    stop_signals=None  # No manejar señales en thread
-                )
-            except Exception as e:
-                logger.error(f"Error en polling: {e}", exc_info=True)
-        
-        # Iniciar polling en un thread separado para no bloquear Flask
-        polling_thread = threading.Thread(target=start_polling, daemon=True, name="telegram_polling")
-        polling_thread.start()
-        logger.info("✅ Bot de Telegram iniciado en modo polling (desarrollo local)")
+    
+    # Solo usar polling si NO hay webhook configurado (desarrollo local)
+    polling = bool(telegram_app) and not config.TELEGRAM_WEBHOOK_URL
+    if polling:
+        logger.info("🤖 Iniciando bot de Telegram en modo polling (desarrollo local)...")
+    start_background_services(polling=polling)
     
     # Iniciar aplicación Flask
     app.run(
@@ -4,19 +4,27 @@ import subprocess
 from pathlib import Path
 from typing import Optional
 import config
+from job_queue import job_handler, PermanentJobError
 from utils import clean_temp_files
 
+# Identificación del backend de transcripción (forma parte de la clave de la caché)
+TRANSCRIPTION_BACKEND = 'openai'
+TRANSCRIPTION_MODEL = 'whisper-1'
+TRANSCRIPTION_LANGUAGE = 'es'
+
 
 def download_telegram_audio(file_path: str, output_path: str) -> bool:
     """Descarga archivo de audio de Telegram usando el bot token"""
-    import requests
+    from http_clients import get_requests_session
+    
+    session = get_requests_session()
     
     bot_token = config.TELEGRAM_BOT_TOKEN
     if not bot_token:
         raise ValueError("TELEGRAM_BOT_TOKEN no configurado")
     
     url = f"https://api.telegram.org/bot{bot_token}/getFile?file_path={file_path}"
-    response = requests.get(url)
+    response = session.get(url)
     
     if not response.ok:
         raise ValueError(f"Error al obtener info del archivo: {response.text}")
@@ -26,13 +34,13 @@ def download_telegram_audio(file_path: str, output_path: str) -> bool:
         raise ValueError(f"Error en respuesta de Telegram: {file_info}")
     
     download_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-    file_response = requests.get(download_url, stream=True)
+    file_response = session.get(download_url, stream=True)
     
     if not file_response.ok:
         raise ValueError(f"Error al descargar archivo: {file_response.status_code}")
     
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'wb') as f:
+    with file_response, open(output_path, 'wb') as f:
         for chunk in file_response.iter_content(chunk_size=8192):
             f.write(chunk)
     
@@ -130,7 +138,7 @@ def convert_to_wav(input_path: str, output_path: str) -> bool:
         raise RuntimeError("Timeout al convertir audio")
 
 
-def transcribe_audio(audio_path: str, language: str = "es") -> str:
+def transcribe_audio(audio_path: str, language: str = TRANSCRIPTION_LANGUAGE) -> str:
     """Transcribe audio usando OpenAI Whisper API"""
     import logging
     logger = logging.getLogger(__name__)
@@ -146,12 +154,12 @@ def transcribe_audio(audio_path: str, language: str = "es") -> str:
     logger.info(f"[OPENAI] Iniciando transcripción de {audio_path} con Whisper API")
     
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=config.OPENAI_API_KEY)
+        from http_clients import get_openai_client
+        client = get_openai_client()
         
         with open(audio_path, 'rb') as audio_file:
             transcript_response = client.audio.transcriptions.create(
-                model="whisper-1",
+                model=TRANSCRIPTION_MODEL,
                 file=audio_file,
                 language=language,
                 response_format="text"
@@ -166,13 +174,57 @@ def transcribe_audio(audio_path: str, language: str = "es") -> str:
         return transcript
         
     except Exception as e:
-        error_str = str(e)
-        if "insufficient_quota" in error_str or "429" in error_str:
-            raise RuntimeError(
-                "Cuota de OpenAI agotada. Por favor, verifica tu plan y detalles de facturación en "
-                "https://platform.openai.com/account/billing. Necesitas agregar crédito a tu cuenta."
+        raise _transcription_error(e)
+
+
+async def transcribe_audio_async(audio_path: str, language: str = TRANSCRIPTION_LANGUAGE) -> str:
+    """Transcribe audio con Whisper API usando el cliente asíncrono (event loop del bot)"""
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Archivo de audio no existe: {audio_path}")
+    
+    if not config.OPENAI_ENABLED:
+        raise RuntimeError(
+            "OpenAI no está configurado. Configura OPENAI_API_KEY en tu archivo .env"
+        )
+    
+    logger.info(f"[OPENAI] Iniciando transcripción asíncrona de {audio_path} con Whisper API")
+    
+    try:
+        from http_clients import get_async_openai_client
+        client = get_async_openai_client()
+        
+        with open(audio_path, 'rb') as audio_file:
+            transcript_response = await client.audio.transcriptions.create(
+                model=TRANSCRIPTION_MODEL,
+                file=audio_file,
+                language=language,
+                response_format="text"
             )
-        raise RuntimeError(f"Error al transcribir audio con OpenAI: {error_str}")
+        
+        transcript = str(transcript_response).strip()
+        
+        if not transcript:
+            raise ValueError("No se pudo transcribir audio (audio vacío o sin voz)")
+        
+        logger.info(f"[OPENAI] Transcripción completada: {len(transcript)} caracteres")
+        return transcript
+        
+    except Exception as e:
+        raise _transcription_error(e)
+
+
+def _transcription_error(e: Exception) -> RuntimeError:
+    """Traduce errores de OpenAI a mensajes comprensibles para el usuario"""
+    error_str = str(e)
+    if "insufficient_quota" in error_str or "429" in error_str:
+        return RuntimeError(
+            "Cuota de OpenAI agotada. Por favor, verifica tu plan y detalles de facturación en "
+            "https://platform.openai.com/account/billing. Necesitas agregar crédito a tu cuenta."
+        )
+    return RuntimeError(f"Error al transcribir audio con OpenAI: {error_str}")
 
 
 def process_audio_from_file(input_file: str) -> str:
@@ -204,3 +256,74 @@ def process_audio_from_file(input_file: str) -> str:
         if input_file and os.path.exists(input_file):
             clean_temp_files(input_file)
 
+
+async def process_audio_from_file_async(input_file: str) -> str:
+    """
+    Pipeline completo para el event loop del bot: la conversión con ffmpeg se
+    ejecuta en un thread y la transcripción usa el cliente HTTP asíncrono.
+    """
+    import asyncio
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    temp_wav = None
+    
+    try:
+        # 1. Convertir a WAV (nombre único: puede haber varios audios a la vez en el loop)
+        logger.info(f"[AUDIO_PIPELINE] Iniciando conversión de {input_file} a WAV...")
+        temp_wav = os.path.join(config.TEMP_DIR, f"{Path(input_file).stem}.wav")
+        await asyncio.to_thread(convert_to_wav, input_file, temp_wav)
+        logger.info(f"[AUDIO_PIPELINE] Conversión completada: {temp_wav}")
+        
+        # 2. Transcribir
+        logger.info(f"[AUDIO_PIPELINE] Iniciando transcripción...")
+        transcript = await transcribe_audio_async(temp_wav)
+        logger.info(f"[AUDIO_PIPELINE] Transcripción completada: {len(transcript)} caracteres")
+        
+        return transcript
+        
+    finally:
+        # Limpiar archivos temporales
+        if temp_wav:
+            clean_temp_files(temp_wav)
+        if input_file and os.path.exists(input_file):
+            clean_temp_files(input_file)
+
+
+def _transcription_job_failed(payload: dict, error: str):
+    """Limpia el audio descargado cuando la transcripción falla definitivamente"""
+    clean_temp_files(payload['file_path'])
+
+
+@job_handler('audio.transcribe', queue='audio', priority=10, max_attempts=3,
+             on_failure=_transcription_job_failed)
+def transcription_job(payload: dict) -> dict:
+    """
+    Trabajo de la cola: convierte y transcribe un audio ya descargado y guarda
+    la transcripción en la caché. El archivo de entrada solo se borra al terminar
+    bien, para que los reintentos puedan volver a procesarlo.
+    """
+    import database
+    
+    input_file = payload['file_path']
+    if not os.path.exists(input_file):
+        raise PermanentJobError("El archivo de audio ya no está disponible")
+    
+    temp_wav = os.path.join(config.TEMP_DIR, f"{Path(input_file).stem}.wav")
+    try:
+        convert_to_wav(input_file, temp_wav)
+        transcript = transcribe_audio(temp_wav, language=payload.get('language', TRANSCRIPTION_LANGUAGE))
+    finally:
+        clean_temp_files(temp_wav)
+    
+    if payload.get('file_unique_id'):
+        database.db.save_cached_transcript(
+            payload['file_unique_id'],
+            TRANSCRIPTION_BACKEND,
+            TRANSCRIPTION_MODEL,
+            payload.get('language', TRANSCRIPTION_LANGUAGE),
+            transcript
+        )
+    
+    clean_temp_files(input_file)
+    return {'transcript': transcript}
@@ -1,12 +1,333 @@
-"""Integración con Google Calendar"""
+"""
+Integración con Google Calendar: sincronización incremental en los dos sentidos.
+
+- Subida: las tareas con evento que han cambiado (según el registro de
+  cambios) se comparan con lo último enviado y solo se envían las que
+  difieren, agrupando altas, modificaciones y borrados en llamadas batch.
+- Bajada: los eventos modificados en Google Calendar desde la última lectura
+  (syncToken) actualizan el título y la fecha de su tarea.
+
+El estado de cada tarea (evento, etag, hash de lo enviado) está en calendar_sync_state.
+"""
+import hashlib
+import json
+import logging
+import threading
+import urllib.parse
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
 import config
 import database
+from job_queue import job_handler, PermanentJobError
+from utils import normalize_task_date
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_TIMEZONE = 'Europe/Madrid'
+
+# Consumidor del registro de cambios (tabla changes) que usa la sincronización
+CHANGES_CONSUMER = 'calendar'
+
+# Estados HTTP con los que el evento ya no existe en Google Calendar
+GONE_STATUSES = (404, 410)
+
+# Una sola sincronización a la vez en el proceso (el periódico y el botón del bot)
+_sync_lock = threading.Lock()
+
+
+def build_event_body(task: Dict, client_name: str = None) -> Dict:
+    """Evento de Google Calendar para una tarea"""
+    if task.get('task_date'):
+        start_dt = datetime.fromisoformat(task['task_date'])
+    else:
+        # Si no hay fecha, el día siguiente a la creación a las 9:00 (estable entre sincronizaciones)
+        created = datetime.fromisoformat(task['created_at']) if task.get('created_at') else datetime.now()
+        start_dt = (created + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    
+    end_dt = start_dt + timedelta(hours=1)  # Duración 1 hora por defecto
+    
+    description = task.get('description') or task['title']
+    if client_name:
+        description += f"\n\nCliente: {client_name}"
+    
+    return {
+        'summary': task['title'],
+        'description': description,
+        'start': {
+            'dateTime': start_dt.isoformat(),
+            'timeZone': CALENDAR_TIMEZONE,
+        },
+        'end': {
+            'dateTime': end_dt.isoformat(),
+            'timeZone': CALENDAR_TIMEZONE,
+        },
+    }
+
+
+def _event_hash(body: Dict) -> str:
+    return hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _task_date_from_event(start: Dict) -> Optional[str]:
+    """task_date canónico (hora local de CALENDAR_TIMEZONE) a partir del 'start' de un evento"""
+    if start.get('dateTime'):
+        dt = datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00'))
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(ZoneInfo(start.get('timeZone') or CALENDAR_TIMEZONE)).replace(tzinfo=None)
+        return normalize_task_date(dt)
+    if start.get('date'):
+        # Evento de día completo
+        return normalize_task_date(f"{start['date']}T09:00:00")
+    return None
+
+
+class CalendarSyncEngine:
+    """
+    Sincroniza las tareas que tienen evento con un calendario de Google.
+    
+    Por defecto usa el servicio compartido de http_clients; los tests le pasan
+    uno construido contra un servidor local que imita la API.
+    """
+    
+    def __init__(self, service=None, calendar_id: str = None, db: database.Database = None):
+        if service is None:
+            from http_clients import get_calendar_service
+            service = get_calendar_service()
+        self.service = service
+        self.calendar_id = calendar_id or config.GOOGLE_CALENDAR_ID
+        self.db = db or database.db
+        # El endpoint batch cuelga de la raíz del servicio (https://www.googleapis.com/batch/calendar/v3)
+        self.batch_uri = urllib.parse.urljoin(service._baseUrl, '/batch/calendar/v3')
+        self.http_calls = 0  # Llamadas HTTP de la última sincronización
+    
+    def track(self, task_id: int):
+        """Empieza a sincronizar una tarea: su evento se crea en la siguiente subida"""
+        if not self.db.get_calendar_sync_states([task_id]):
+            self.db.save_calendar_sync_states([{'task_id': task_id}])
+    
+    def sync(self) -> Dict:
+        """Subida de los cambios locales y después bajada de los remotos"""
+        with _sync_lock:
+            self.http_calls = 0
+            pushed = self._push()
+            pulled = self._pull()
+        return {**pushed, **pulled, 'http_calls': self.http_calls}
+    
+    def push(self, task_ids: List[int] = None) -> Dict:
+        """Sube los cambios pendientes (de todas las tareas o solo de las indicadas)"""
+        with _sync_lock:
+            self.http_calls = 0
+            return self._push(task_ids)
+    
+    # ---------- Subida ----------
+    
+    def _collect_changes(self):
+        """Marca como pendientes las tareas que han cambiado desde la última sincronización"""
+        cursor = self.db.get_change_cursor(CHANGES_CONSUMER)
+        if cursor is None:
+            # Primera vez: lo anterior ya lo cubren los estados pendientes iniciales
+            self.db.ack_changes(CHANGES_CONSUMER, self.db.latest_change_seq())
+            return
+        try:
+            while True:
+                changes = self.db.changes_since(cursor, limit=1000, tables=['tasks'])
+                if not changes:
+                    return
+                self.db.mark_calendar_sync_pending({change['row_id'] for change in changes})
+                cursor = changes[-1]['seq']
+                self.db.ack_changes(CHANGES_CONSUMER, cursor)
+        except database.ChangesCompactedError:
+            # Se han perdido cambios: se revisan todas (solo se envían las que difieran)
+            logger.warning("[CALENDAR] Registro de cambios compactado, revisando todas las tareas")
+            self.db.mark_calendar_sync_pending()
+            self.db.ack_changes(CHANGES_CONSUMER, self.db.latest_change_seq())
+    
+    def _push(self, task_ids: List[int] = None) -> Dict:
+        if task_ids is None:
+            self._collect_changes()
+        states = self.db.get_calendar_sync_states(task_ids, status='pending')
+        
+        now = datetime.now().isoformat(timespec='seconds')
+        operations = []
+        saved, dropped = [], []
+        client_names = {}
+        for state in states:
+            task = self.db.get_task_by_id(state['task_id'], include_archive=True)
+            if task is None or task['status'] == 'cancelled':
+                if state['event_id']:
+                    operations.append(('delete', state, task, None))
+                else:
+                    dropped.append(state['task_id'])
+                continue
+            
+            client_id = task.get('client_id')
+            if client_id and client_id not in client_names:
+                client = self.db.get_client_by_id(client_id)
+                client_names[client_id] = client['name'] if client else None
+            body = build_event_body(task, client_names.get(client_id))
+            
+            if not state['event_id']:
+                operations.append(('insert', state, task, body))
+            elif state['event_hash'] != _event_hash(body):
+                operations.append(('patch', state, task, body))
+            else:
+                saved.append({**state, 'status': 'synced', 'last_error': None, 'synced_at': now})
+        
+        counts = {'inserted': 0, 'patched': 0, 'deleted': 0, 'errors': 0}
+        for start in range(0, len(operations), config.CALENDAR_BATCH_SIZE):
+            batch = operations[start:start + config.CALENDAR_BATCH_SIZE]
+            for (kind, state, task, body), (response, error) in zip(batch, self._execute_batch(batch)):
+                if error is not None:
+                    status = getattr(getattr(error, 'resp', None), 'status', None)
+                    if kind == 'delete' and status in GONE_STATUSES:
+                        error = None
+                    elif kind == 'patch' and status in GONE_STATUSES:
+                        # Borrado en el calendario: se vuelve a crear en la siguiente subida
+                        saved.append({**state, 'event_id': None, 'etag': None, 'event_hash': None,
+                                      'status': 'pending', 'last_error': str(error)})
+                        continue
+                    else:
+                        counts['errors'] += 1
+                        logger.warning(f"[CALENDAR] Error en {kind} de la tarea {state['task_id']}: {error}")
+                        saved.append({**state, 'status': 'pending', 'last_error': str(error)})
+                        continue
+                
+                if kind == 'delete':
+                    counts['deleted'] += 1
+                    dropped.append(state['task_id'])
+                    if task is not None:
+                        self.db.update_task(task['id'], google_event_id=None, google_event_link=None)
+                    continue
+                
+                counts['inserted' if kind == 'insert' else 'patched'] += 1
+                saved.append({
+                    **state,
+                    'event_id': response['id'],
+                    'etag': response.get('etag'),
+                    'event_hash': _event_hash(body),
+                    'status': 'synced',
+                    'last_error': None,
+                    'synced_at': now,
+                })
+                if kind == 'insert':
+                    self.db.update_task(task['id'], google_event_id=response['id'],
+                                        google_event_link=response.get('htmlLink'))
+        
+        self.db.save_calendar_sync_states(saved)
+        self.db.delete_calendar_sync_states(dropped)
+        if operations:
+            logger.info(f"[CALENDAR] Subida: {counts} en {self.http_calls} llamadas")
+        return counts
+    
+    def _execute_batch(self, operations: List[tuple]) -> List[tuple]:
+        """Envía las operaciones en una sola llamada batch; devuelve (respuesta, error) de cada una"""
+        from googleapiclient.http import BatchHttpRequest
+        
+        results = {}
+        
+        def _callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+        
+        batch = BatchHttpRequest(callback=_callback, batch_uri=self.batch_uri)
+        events = self.service.events()
+        for index, (kind, state, task, body) in enumerate(operations):
+            if kind == 'insert':
+                request = events.insert(calendarId=self.calendar_id, body=body)
+            elif kind == 'patch':
+                request = events.patch(calendarId=self.calendar_id, eventId=state['event_id'], body=body)
+            else:
+                request = events.delete(calendarId=self.calendar_id, eventId=state['event_id'])
+            batch.add(request, request_id=str(index))
+        
+        batch.execute()
+        self.http_calls += 1
+        return [results[str(index)] for index in range(len(operations))]
+    
+    # ---------- Bajada ----------
+    
+    def _pull(self) -> Dict:
+        """Aplica a las tareas los eventos modificados en el calendario desde el último syncToken"""
+        from googleapiclient.errors import HttpError
+        
+        sync_token = self.db.get_calendar_sync_token(self.calendar_id)
+        page_token = None
+        updated = 0
+        while True:
+            params = {'calendarId': self.calendar_id, 'showDeleted': True, 'maxResults': 250}
+            if sync_token:
+                params['syncToken'] = sync_token
+            if page_token:
+                params['pageToken'] = page_token
+            try:
+                response = self.service.events().list(**params).execute()
+                self.http_calls += 1
+            except HttpError as e:
+                if e.resp.status == 410 and sync_token:
+                    # syncToken caducado: lectura completa
+                    logger.info("[CALENDAR] syncToken caducado, lectura completa del calendario")
+                    self.http_calls += 1
+                    sync_token = page_token = None
+                    continue
+                raise
+            
+            updated += self._apply_remote_events(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                self.db.set_calendar_sync_token(self.calendar_id, response.get('nextSyncToken'))
+                return {'pulled': updated}
+    
+    def _apply_remote_events(self, events: List[Dict]) -> int:
+        states = self.db.get_calendar_sync_states_by_event([event['id'] for event in events])
+        now = datetime.now().isoformat(timespec='seconds')
+        saved, dropped = [], []
+        updated = 0
+        for event in events:
+            state = states.get(event['id'])
+            # Eventos ajenos a las tareas, o el eco de lo que acabamos de subir
+            if state is None or event.get('etag') == state['etag']:
+                continue
+            
+            task = self.db.get_task_by_id(state['task_id'])
+            if event.get('status') == 'cancelled':
+                # Borrado en el calendario: la tarea se queda sin evento
+                dropped.append(state['task_id'])
+                if task is not None:
+                    self.db.update_task(task['id'], google_event_id=None, google_event_link=None)
+                updated += 1
+                continue
+            if task is None:
+                continue
+            
+            changes = {}
+            if event.get('summary') and event['summary'] != task['title']:
+                changes['title'] = event['summary']
+            task_date = _task_date_from_event(event.get('start', {}))
+            if task_date and task_date != task.get('task_date'):
+                changes['task_date'] = task_date
+            if changes:
+                self.db.update_task(task['id'], **changes)
+                task = {**task, **changes}
+                updated += 1
+            
+            client = self.db.get_client_by_id(task['client_id']) if task.get('client_id') else None
+            body = build_event_body(task, client['name'] if client else None)
+            saved.append({
+                **state,
+                'etag': event.get('etag'),
+                'event_hash': _event_hash(body),
+                'status': 'synced',
+                'last_error': None,
+                'synced_at': now,
+            })
+        
+        self.db.save_calendar_sync_states(saved)
+        self.db.delete_calendar_sync_states(dropped)
+        return updated
 
 
 def create_calendar_event(task_id: int) -> Dict:
-    """Crea evento en Google Calendar para una tarea"""
+    """Crea evento en Google Calendar para una tarea (y la deja sincronizada desde entonces)"""
     if not config.GOOGLE_CALENDAR_ENABLED:
         return {
             'success': False,
@@ -14,13 +335,6 @@ def create_calendar_event(task_id: int) -> Dict:
         }
     
     try:
-        from google.oauth2.credentials import Credentials
-        from google_auth_oauthlib.flow import InstalledAppFlow
-        from google.auth.transport.requests import Request
-        from googleapiclient.discovery import build
-        import json
-        
-        # Obtener tarea
         db = database.db
         task = db.get_task_by_id(task_id)
         if not task:
@@ -33,76 +347,24 @@ def create_calendar_event(task_id: int) -> Dict:
                 'error': 'La tarea ya tiene un evento en Google Calendar'
             }
         
-        # Configurar credenciales
-        creds = Credentials(
-            token=None,
-            refresh_token=config.GOOGLE_REFRESH_TOKEN,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=config.GOOGLE_CLIENT_ID,
-            client_secret=config.GOOGLE_CLIENT_SECRET
-        )
-        
-        # Refrescar token si es necesario
-        if not creds.valid:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-        
-        # Construir servicio
-        service = build('calendar', 'v3', credentials=creds)
-        
-        # Preparar fecha/hora del evento
-        if task.get('task_date'):
-            start_dt = datetime.fromisoformat(task['task_date'])
-        else:
-            # Si no hay fecha, usar fecha de creación + 1 día a las 9:00 AM
-            start_dt = datetime.now() + timedelta(days=1)
-            start_dt = start_dt.replace(hour=9, minute=0, second=0, microsecond=0)
+        engine = CalendarSyncEngine()
+        engine.track(task_id)
+        engine.push([task_id])
         
-        end_dt = start_dt + timedelta(hours=1)  # Duración 1 hora por defecto
-        
-        # Preparar descripción
-        description_parts = [task.get('description', task['title'])]
-        
-        if task.get('client_id'):
-            client = db.get_client_by_id(task['client_id'])
-            if client:
-                description_parts.append(f"\nCliente: {client['name']}")
-        
-        description = '\n'.join(description_parts)
-        
-        # Crear evento
-        event = {
-            'summary': task['title'],
-            'description': description,
-            'start': {
-                'dateTime': start_dt.isoformat(),
-                'timeZone': 'Europe/Madrid',
-            },
-            'end': {
-                'dateTime': end_dt.isoformat(),
-                'timeZone': 'Europe/Madrid',
-            },
-        }
-        
-        # Insertar evento
-        created_event = service.events().insert(
-            calendarId=config.GOOGLE_CALENDAR_ID,
-            body=event
-        ).execute()
-        
-        # Actualizar tarea con información del evento
-        db.update_task(
-            task_id,
-            google_event_id=created_event.get('id'),
-            google_event_link=created_event.get('htmlLink')
-        )
+        task = db.get_task_by_id(task_id)
+        if not task.get('google_event_id'):
+            states = db.get_calendar_sync_states([task_id])
+            return {
+                'success': False,
+                'error': (states[0]['last_error'] if states else None) or 'Error desconocido'
+            }
         
         return {
             'success': True,
-            'event_id': created_event.get('id'),
-            'event_link': created_event.get('htmlLink')
+            'event_id': task['google_event_id'],
+            'event_link': task.get('google_event_link')
         }
-        
+    
     except ImportError:
         return {
             'success': False,
@@ -113,3 +375,42 @@ def create_calendar_event(task_id: int) -> Dict:
             'success': False,
             'error': str(e)
         }
+
+
+@job_handler('calendar.create_event', queue='default', priority=50, max_attempts=5)
+def calendar_event_job(payload: dict) -> dict:
+    """Trabajo de la cola: crea el evento de Google Calendar de una tarea"""
+    if not config.GOOGLE_CALENDAR_ENABLED:
+        raise PermanentJobError('Google Calendar no está configurado')
+    
+    task = database.db.get_task_by_id(payload['task_id'])
+    if not task:
+        raise PermanentJobError('Tarea no encontrada')
+    
+    # Idempotente: si un intento anterior ya creó el evento, no crear otro
+    if task.get('google_event_id'):
+        event_link = task.get('google_event_link') or ''
+        return {
+            'event_id': task['google_event_id'],
+            'event_link': event_link,
+            'message': f"✅ Evento creado en Google Calendar.\n\n🔗 {event_link}"
+        }
+    
+    result = create_calendar_event(payload['task_id'])
+    if not result.get('success'):
+        raise RuntimeError(result.get('error', 'Error desconocido'))
+    
+    return {
+        'event_id': result.get('event_id'),
+        'event_link': result.get('event_link'),
+        'message': f"✅ Evento creado en Google Calendar.\n\n🔗 {result.get('event_link', '')}"
+    }
+
+
+@job_handler('calendar.sync', queue='default', priority=150, max_attempts=3,
+             every_seconds=config.CALENDAR_SYNC_INTERVAL_MINUTES * 60)
+def calendar_sync_job(payload: dict) -> dict:
+    """Trabajo periódico: sincronización incremental de tareas y eventos en los dos sentidos"""
+    if not config.GOOGLE_CALENDAR_ENABLED:
+        return {'skipped': True}
+    return CalendarSyncEngine().sync()
@@ -26,9 +26,48 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
 TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
 
+# Runtime de Telegram: un solo worker de gunicorn (el líder, elegido con un lock de fichero)
+# mantiene el event loop del bot; el resto le reenvía los updates por un socket Unix
+TELEGRAM_LEADER_LOCK_PATH = os.getenv('TELEGRAM_LEADER_LOCK_PATH', str(DB_DIR / 'telegram_runtime.lock'))
+TELEGRAM_RUNTIME_SOCKET = os.getenv('TELEGRAM_RUNTIME_SOCKET', str(DB_DIR / 'telegram_runtime.sock'))
+TELEGRAM_RUNTIME_START_TIMEOUT_SECONDS = float(os.getenv('TELEGRAM_RUNTIME_START_TIMEOUT_SECONDS', 15))
+
+# Envíos a Telegram: límites de velocidad (mensajes/segundo) y reintentos tras un 429
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 25))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', 20 / 60))
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv('TELEGRAM_SEND_MAX_RETRIES', 3))
+
 # Admin Web App
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
 SECRET_KEY = os.getenv('SECRET_KEY', 'change-this-secret-key-in-production')
+# Segundos que se reutiliza el usuario web (y sus categorías) sin volver a leerlo de la BD
+AUTH_CACHE_TTL_SECONDS = float(os.getenv('AUTH_CACHE_TTL_SECONDS', 30))
+# Segundos entre comprobaciones de la versión de las categorías en la BD (cambios hechos por otro proceso)
+CATEGORIES_CHECK_SECONDS = float(os.getenv('CATEGORIES_CHECK_SECONDS', 5))
+
+# API JSON: tamaño de página de /api/tasks (por defecto y máximo) y compresión de respuestas
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 200))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+HTTP_COMPRESSION_LEVEL = int(os.getenv('HTTP_COMPRESSION_LEVEL', 6))
+HTTP_COMPRESSION_MIN_BYTES = int(os.getenv('HTTP_COMPRESSION_MIN_BYTES', 1024))
+# Panel de tareas: tarjetas por página (el resto se carga al hacer scroll)
+TASKS_PAGE_SIZE = int(os.getenv('TASKS_PAGE_SIZE', 30))
+
+# Cambios en directo del panel (SSE en /admin/events): lectura del registro de cambios,
+# eventos guardados para reconectar con Last-Event-ID, keep-alive y duración máxima
+# de cada conexión (después el navegador reconecta solo y libera el hilo de gunicorn)
+LIVE_EVENTS_POLL_SECONDS = float(os.getenv('LIVE_EVENTS_POLL_SECONDS', 1))
+LIVE_EVENTS_BUFFER_SIZE = int(os.getenv('LIVE_EVENTS_BUFFER_SIZE', 1000))
+LIVE_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('LIVE_EVENTS_HEARTBEAT_SECONDS', 15))
+LIVE_EVENTS_MAX_SECONDS = float(os.getenv('LIVE_EVENTS_MAX_SECONDS', 300))
+LIVE_EVENTS_RETRY_SECONDS = float(os.getenv('LIVE_EVENTS_RETRY_SECONDS', 3))
+# Streams abiertos a la vez por proceso: cada uno ocupa un hilo de gunicorn (GUNICORN_THREADS),
+# así que tiene que quedar muy por debajo para los webhooks de Telegram y las páginas del panel.
+# Por encima se responde 503 y el panel vuelve a intentarlo pasados LIVE_EVENTS_BUSY_RETRY_SECONDS
+LIVE_EVENTS_MAX_STREAMS = int(os.getenv('LIVE_EVENTS_MAX_STREAMS', 6))
+LIVE_EVENTS_BUSY_RETRY_SECONDS = int(os.getenv('LIVE_EVENTS_BUSY_RETRY_SECONDS', 30))
 
 # Google Calendar (opcional)
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '')
@@ -41,15 +80,74 @@ GOOGLE_CALENDAR_ENABLED = all([
     GOOGLE_REFRESH_TOKEN,
     GOOGLE_CALENDAR_ID
 ])
+# Margen con el que se renueva el token de acceso antes de que caduque (en segundo plano)
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS', 600))
+# Endpoint alternativo de la API (p. ej. un servidor de pruebas); vacío = el de Google
+GOOGLE_CALENDAR_API_URL = os.getenv('GOOGLE_CALENDAR_API_URL', '')
+# Sincronización incremental en los dos sentidos (tareas <-> eventos)
+CALENDAR_SYNC_INTERVAL_MINUTES = float(os.getenv('CALENDAR_SYNC_INTERVAL_MINUTES', 5))
+CALENDAR_BATCH_SIZE = int(os.getenv('CALENDAR_BATCH_SIZE', 50))  # Peticiones por llamada batch (máx. 50 en Calendar)
 
 # Audio Processing
 AUDIO_MAX_DURATION_SECONDS = 60
 TEMP_DIR = Path('/tmp') if Path('/tmp').exists() else Path(BASE_DIR / 'tmp')
 TEMP_DIR.mkdir(exist_ok=True)
 
+# Caché de transcripciones (por file_unique_id de Telegram)
+TRANSCRIPT_CACHE_TTL_DAYS = int(os.getenv('TRANSCRIPT_CACHE_TTL_DAYS', 30))
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv('TRANSCRIPT_CACHE_MAX_ENTRIES', 5000))
+
 # OpenAI API
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 OPENAI_ENABLED = bool(OPENAI_API_KEY)
+OPENAI_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT_SECONDS', 120))
+
+# Clientes HTTP compartidos (pool de conexiones, keep-alive y reintentos)
+HTTP_TIMEOUT_SECONDS = float(os.getenv('HTTP_TIMEOUT_SECONDS', 30))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECONDS', 5))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv('HTTP_KEEPALIVE_SECONDS', 60))
+
+# Cola de trabajos en segundo plano
+JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'True').lower() == 'true'
+JOB_WORKERS_DEFAULT = int(os.getenv('JOB_WORKERS_DEFAULT', 1))  # Calendario y otros
+JOB_WORKERS_AUDIO = int(os.getenv('JOB_WORKERS_AUDIO', 2))  # ffmpeg + transcripción
+JOB_WORKERS_UPLOADS = int(os.getenv('JOB_WORKERS_UPLOADS', 2))  # Subidas SFTP
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', 2))
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv('JOB_VISIBILITY_TIMEOUT_SECONDS', 600))
+JOB_RETRY_BASE_SECONDS = float(os.getenv('JOB_RETRY_BASE_SECONDS', 5))
+JOB_RETRY_MAX_SECONDS = float(os.getenv('JOB_RETRY_MAX_SECONDS', 600))
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', 7))
+
+# Archivo de tareas: completadas/canceladas sin cambios en N días pasan a las tablas *_archive (0 = desactivado)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', 24))
+
+# Registro de cambios (tabla changes): se compacta lo ya procesado por todos los consumidores
+# y, en cualquier caso, lo que tenga más de CHANGES_RETENTION_DAYS días
+CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', 7))
+CHANGES_COMPACT_INTERVAL_HOURS = float(os.getenv('CHANGES_COMPACT_INTERVAL_HOURS', 6))
+
+# Copias de seguridad: snapshots con la API de backup de SQLite (por bloques de páginas)
+BACKUP_DIR = os.getenv('BACKUP_DIR', str(DB_DIR / 'backups'))
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', 6))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 7))  # Snapshots rotativos que se conservan (0 = desactivado)
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', 256))
+BACKUP_STEP_SLEEP_SECONDS = float(os.getenv('BACKUP_STEP_SLEEP_SECONDS', 0.005))
+BACKUP_COMPRESSION_LEVEL = int(os.getenv('BACKUP_COMPRESSION_LEVEL', 6))
+
+# Réplica incremental en SFTP (SFTP_BACKUP_PATH): solo se suben los bloques de páginas cambiados
+REPLICATION_INTERVAL_MINUTES = float(os.getenv('REPLICATION_INTERVAL_MINUTES', 15))  # 0 = desactivado
+REPLICATION_PAGES_PER_CHUNK = int(os.getenv('REPLICATION_PAGES_PER_CHUNK', 4))
+REPLICATION_FULL_EVERY = int(os.getenv('REPLICATION_FULL_EVERY', 96))  # Deltas por generación antes de otra base completa
+REPLICATION_KEEP_GENERATIONS = int(os.getenv('REPLICATION_KEEP_GENERATIONS', 4))
+
+# Estado de conversación del bot: 'sqlite' (compartido entre workers) o 'memory' (un solo proceso)
+STATE_STORE_BACKEND = os.getenv('STATE_STORE_BACKEND', 'sqlite').lower()
+STATE_TTL_SECONDS = int(os.getenv('STATE_TTL_SECONDS', 24 * 3600))
+STATE_MEMORY_MAX_ENTRIES = int(os.getenv('STATE_MEMORY_MAX_ENTRIES', 10000))
 
 # Faster Whisper (deprecated - ahora se usa OpenAI)
 # Modelos disponibles: tiny, base, small, medium, large-v2, large-v3
@@ -0,0 +1,263 @@
+"""
+Exportación de tareas y clientes a CSV y XLSX en streaming.
+
+Las filas se leen de la base de datos con un cursor por bloques
+(Database.iter_tasks_export / iter_clients_export) y se escriben según llegan,
+así que la memoria no crece con el número de filas. El XLSX se genera a mano
+(un zip con la hoja en XML y cadenas en línea) para no depender de openpyxl,
+que además necesitaría el fichero completo para escribir el zip.
+
+Uso desde la línea de comandos:
+    python data_export.py tasks --format csv --output tareas.csv [--status open ...]
+    python data_export.py clients --format xlsx --output clientes.xlsx
+"""
+import argparse
+import csv
+import io
+import logging
+import re
+import sys
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Tuple
+from xml.sax.saxutils import escape
+import database
+
+logger = logging.getLogger(__name__)
+
+# Filas que se acumulan antes de entregar un bloque de bytes
+ROWS_PER_CHUNK = 500
+
+# Máximo de filas de una hoja de Excel (incluida la cabecera)
+XLSX_MAX_ROWS = 1048576
+
+# Columnas de cada exportación: clave de la fila -> cabecera
+COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    'tasks': [
+        ('id', 'ID'),
+        ('created_at', 'Creada'),
+        ('updated_at', 'Modificada'),
+        ('status', 'Estado'),
+        ('priority', 'Prioridad'),
+        ('category', 'Categoría'),
+        ('category_name', 'Nombre de categoría'),
+        ('title', 'Título'),
+        ('description', 'Descripción'),
+        ('client_id', 'ID cliente'),
+        ('client_name', 'Cliente'),
+        ('user_id', 'ID usuario'),
+        ('user_name', 'Usuario'),
+        ('task_date', 'Fecha de la tarea'),
+        ('ampliacion', 'Ampliación'),
+        ('ampliacion_user', 'Usuario ampliación'),
+        ('ampliaciones_history', 'Historial de ampliaciones'),
+        ('solution', 'Solución'),
+        ('solution_user', 'Usuario solución'),
+    ],
+    'clients': [
+        ('id', 'ID'),
+        ('name', 'Nombre'),
+        ('aliases', 'Alias'),
+        ('created_at', 'Creado'),
+        ('tasks_count', 'Tareas'),
+        ('open_tasks_count', 'Tareas abiertas'),
+    ],
+}
+
+# Formatos de exportación: formato -> mimetype
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Caracteres de control que XML 1.0 no admite
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Un texto que empieza por uno de estos caracteres Excel lo ejecuta como fórmula al abrir el CSV
+_CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def iter_rows(kind: str, **filters) -> Iterator[Dict]:
+    """Filas de la exportación 'tasks' (con los filtros de iter_tasks_export) o 'clients'"""
+    db = database.db
+    if kind == 'tasks':
+        return db.iter_tasks_export(**filters)
+    if kind == 'clients':
+        return db.iter_clients_export()
+    raise ValueError(f"Exportación no soportada: {kind}")
+
+
+def _csv_cell(value) -> object:
+    """Valor de una celda CSV; los textos que parecen fórmulas se anteponen con ' (inyección de fórmulas)"""
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(_CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows: Iterable[Dict], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """CSV en UTF-8 con BOM (para que Excel respete los acentos), por bloques de filas"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for _, header in columns])
+    for index, row in enumerate(rows, 1):
+        writer.writerow([_csv_cell(row.get(key)) for key, _ in columns])
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _StreamWriter:
+    """Destino de zipfile sin seek: guarda lo escrito hasta que se recoge con take()"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value) -> str:
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def iter_xlsx(rows: Iterable[Dict], columns: List[Tuple[str, str]], sheet_name: str = 'Datos') -> Iterator[bytes]:
+    """
+    Libro XLSX de una hoja generado en streaming.
+    
+    El zip se escribe sin seek (descriptores de datos tras cada fichero), y la
+    hoja se comprime según se escribe, así que se puede enviar por bloques.
+    Excel no admite más de XLSX_MAX_ROWS filas: las siguientes se descartan.
+    """
+    stream = _StreamWriter()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        yield stream.take()
+        
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            header = ''.join(_xlsx_cell(title) for _, title in columns)
+            sheet.write(f'<row>{header}</row>'.encode('utf-8'))
+            
+            lines = []
+            for index, row in enumerate(rows, 1):
+                if index >= XLSX_MAX_ROWS:
+                    logger.warning(f"[EXPORT] Exportación XLSX truncada a {XLSX_MAX_ROWS - 1} filas")
+                    break
+                lines.append('<row>' + ''.join(_xlsx_cell(row.get(key)) for key, _ in columns) + '</row>')
+                if index % ROWS_PER_CHUNK == 0:
+                    sheet.write(''.join(lines).encode('utf-8'))
+                    lines.clear()
+                    data = stream.take()
+                    if data:
+                        yield data
+            sheet.write(''.join(lines).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    yield stream.take()
+
+
+def iter_export(kind: str, fmt: str, **filters) -> Iterator[bytes]:
+    """Bytes de la exportación 'kind' ('tasks' o 'clients') en el formato 'fmt' ('csv' o 'xlsx')"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de exportación no soportado: {fmt}")
+    rows = iter_rows(kind, **filters)
+    if fmt == 'csv':
+        return iter_csv(rows, COLUMNS[kind])
+    return iter_xlsx(rows, COLUMNS[kind], sheet_name='Tareas' if kind == 'tasks' else 'Clientes')
+
+
+def main(argv=None):
+    """Exporta tareas o clientes a un fichero (o a la salida estándar)"""
+    parser = argparse.ArgumentParser(description='Exporta tareas o clientes a CSV o XLSX')
+    parser.add_argument('kind', choices=sorted(COLUMNS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--output', help='fichero de salida (por defecto, la salida estándar)')
+    parser.add_argument('--status')
+    parser.add_argument('--priority')
+    parser.add_argument('--category')
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--task-day', help="día de la tarea 'YYYY-MM-DD'")
+    parser.add_argument('--search')
+    parser.add_argument('--archive', action='store_true', help='incluir las tareas archivadas')
+    args = parser.parse_args(argv)
+    
+    filters = {}
+    if args.kind == 'tasks':
+        filters = {
+            'status': args.status, 'priority': args.priority, 'category': args.category,
+            'user_id': args.user_id, 'task_day': args.task_day, 'search': args.search,
+            'include_archive': args.archive,
+        }
+    
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_export(args.kind, args.format, **filters):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,21 +1,69 @@
 """Modelos de base de datos SQLite"""
 import sqlite3
 from datetime import datetime
-from typing import Optional, List, Dict, Callable
+from typing import Optional, List, Dict, Callable, Iterator, Tuple
 from pathlib import Path
 import json
 import logging
+import threading
 import time
 import config
+from utils import normalize_task_date
 
 logger = logging.getLogger(__name__)
 
+# Versión del esquema (PRAGMA user_version). Subirla al añadir migraciones que
+# una versión anterior de la app no sepa leer; las importaciones de BD la comprueban
+SCHEMA_VERSION = 3
+
+# Tablas que se archivan: tabla activa -> tabla de archivo. La vista '<tabla>_all'
+# une ambas para las consultas históricas
+ARCHIVE_TABLES = {
+    'tasks': 'tasks_archive',
+    'task_images': 'task_images_archive',
+    'task_ampliaciones_history': 'task_ampliaciones_history_archive',
+}
+
+# Separador de GROUP_CONCAT para listas de categorías (no aparece en los nombres)
+CATEGORY_SEPARATOR = '\x1f'
+
+# task_day de las tareas cuya task_date no se ha podido normalizar (no coincide con ningún día)
+UNRECOGNIZED_TASK_DAY = ''
+
+# Estados de tarea que pasan al archivo tras config.ARCHIVE_AFTER_DAYS sin cambios
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+# Tablas cuyos cambios registran los triggers en 'changes': tabla -> expresión de su tarea
+CHANGE_TRACKED_TABLES = {
+    'tasks': 'id',
+    'clients': None,
+    'task_images': 'task_id',
+    'task_ampliaciones_history': 'task_id',
+}
+
+
+class ChangesCompactedError(Exception):
+    """Los cambios pedidos ya se han compactado: el consumidor tiene que releer las tablas"""
+    pass
+
 
 class Database:
     """Gestor de base de datos SQLite"""
     
     def __init__(self, db_path: str = None):
         self.db_path = db_path or config.SQLITE_PATH
+        # Contadores de aciertos/fallos de la caché de transcripciones (por proceso)
+        self._transcript_cache_hits = 0
+        self._transcript_cache_misses = 0
+        self._stats_lock = threading.Lock()
+        # Caché de identidad de usuarios web (usuario + categorías): user_id -> (caduca, usuario)
+        self._identity_cache: Dict[int, Tuple[float, Optional[Dict]]] = {}
+        self._identity_lock = threading.Lock()
+        # Registro de categorías en memoria; se comprueba contra la versión guardada en la BD
+        self._categories: Optional[Dict] = None
+        self._categories_version = 0
+        self._categories_checked_at = 0.0
+        self._categories_lock = threading.Lock()
         self.init_db()
     
     def _retry_on_locked(self, func: Callable, max_retries: int = 3, delay: float = 0.1):
@@ -35,6 +83,9 @@ class Database:
         """Obtiene conexión a la base de datos con timeout y WAL mode"""
         conn = sqlite3.connect(self.db_path, timeout=30.0)
         conn.row_factory = sqlite3.Row
+        # lower() de SQLite solo convierte ASCII; las búsquedas de texto usan la de Python
+        conn.create_function('unicode_lower', 1, lambda value: value.lower() if isinstance(value, str) else value,
+                             deterministic=True)
         # Habilitar WAL mode para mejor concurrencia
         try:
             conn.execute('PRAGMA journal_mode=WAL')
@@ -137,6 +188,98 @@ class Database:
             )
         ''')
         
+        # Caché de transcripciones de audio (clave: file_unique_id + backend/modelo/idioma)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transcript_cache (
+                file_unique_id TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                language TEXT NOT NULL,
+                transcript TEXT NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (file_unique_id, backend, model, language)
+            )
+        ''')
+        
+        # Estado de conversación del bot (compartido entre workers)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                state_key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        
+        # Cola de trabajos en segundo plano (audio, imágenes, calendario)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL DEFAULT 'default',
+                job_type TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                priority INTEGER NOT NULL DEFAULT 100,
+                status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'running', 'done', 'failed')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                idempotency_key TEXT UNIQUE,
+                run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                locked_until TIMESTAMP,
+                locked_by TEXT,
+                result TEXT,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        
+        # Registro de cambios (outbox) de tareas, clientes, imágenes y ampliaciones,
+        # alimentado por triggers. AUTOINCREMENT: seq nunca se reutiliza, ni tras compactar
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                op TEXT NOT NULL CHECK(op IN ('insert', 'update', 'delete', 'archive')),
+                task_id INTEGER,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Último cambio procesado por cada consumidor del registro de cambios
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_consumers (
+                name TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Sincronización con Google Calendar: una fila por tarea con evento (o pendiente de crearlo)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS calendar_sync_state (
+                task_id INTEGER PRIMARY KEY,
+                event_id TEXT,
+                etag TEXT,
+                event_hash TEXT,
+                status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'synced')),
+                last_error TEXT,
+                synced_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # syncToken de la última lectura incremental de cada calendario
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS calendar_sync_tokens (
+                calendar_id TEXT PRIMARY KEY,
+                sync_token TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         # Tabla de tareas
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS tasks (
@@ -163,6 +306,19 @@ class Database:
             )
         ''')
         
+        # Migración: estado de subida de las imágenes ('pending' = subida a SFTP en cola,
+        # 'local' = solo copia local, 'remote' = en SFTP; NULL en imágenes antiguas)
+        try:
+            cursor.execute('ALTER TABLE task_images ADD COLUMN upload_state TEXT')
+        except sqlite3.OperationalError:
+            pass  # Columna ya existe
+        
+        # Migración: progreso de los trabajos largos (JSON, lo actualiza el propio handler)
+        try:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN progress TEXT')
+        except sqlite3.OperationalError:
+            pass  # Columna ya existe
+        
         # Migración: agregar campos ampliacion, ampliacion_user, solution, solution_user si no existen
         try:
             cursor.execute('ALTER TABLE tasks ADD COLUMN ampliacion TEXT')
@@ -239,32 +395,99 @@ class Database:
                     # Renombrar tabla nueva
                     cursor.execute('ALTER TABLE tasks_new RENAME TO tasks')
                     
-                    # Recrear índices
-                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks(user_id)')
-                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
-                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_client_id ON tasks(client_id)')
-                    
+                    # Los índices se recrean más abajo, en el bloque de índices
                     conn.commit()
                     logger.info("Tabla tasks migrada exitosamente con constraint actualizado para incluir 'pending_approval'")
         except Exception as e:
             logger.error(f"Error en migración de tabla tasks: {e}", exc_info=True)
             conn.rollback()
         
+        # Migración: task_date canónico ('YYYY-MM-DDTHH:MM:SS') y día de la tarea ('YYYY-MM-DD')
+        # para filtrar por fecha con rangos indexados en lugar de parsear cada fila
+        try:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN task_day TEXT')
+        except sqlite3.OperationalError:
+            pass  # Columna ya existe
+        self._normalize_task_dates(cursor)
+        conn.commit()
+        
+        # Archivo de tareas terminadas (después de las migraciones de las tablas activas)
+        self._init_archive(cursor)
+        
+        # Registro de cambios: los triggers se crean después de cualquier migración que
+        # reconstruya una tabla (al borrar la tabla se borran sus triggers)
+        self._init_changes(cursor)
+        
+        # Tareas con evento creado antes de la sincronización incremental (o importadas):
+        # se comprueban en la siguiente sincronización
+        cursor.execute('''
+            INSERT OR IGNORE INTO calendar_sync_state (task_id, event_id, status)
+            SELECT id, google_event_id, 'pending' FROM tasks WHERE google_event_id IS NOT NULL
+        ''')
+        conn.commit()
+        
         # Índices
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_client_id ON tasks(client_id)')
+        # Índices de una columna sustituidos por los compuestos de abajo (son prefijos suyos)
+        for old_index in ('idx_tasks_user_id', 'idx_tasks_status', 'idx_tasks_client_id', 'idx_task_images_task_id'):
+            cursor.execute(f'DROP INDEX IF EXISTS {old_index}')
+        # get_tasks(): filtros por igualdad + ORDER BY created_at DESC resueltos en el índice,
+        # sin ordenar en memoria (ver tests/test_query_plans.py)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_status_created ON tasks(user_id, status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_category_created ON tasks(status, category, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_client_created ON tasks(client_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)')
+        # Listados paginados del bot: keyset sobre (task_date, id); el rowid va implícito en el índice
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_status_date ON tasks(user_id, status, task_date)')
+        # Listados con varios estados: se recorre en orden (task_date, id) y se filtra el estado
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_date ON tasks(user_id, task_date)')
+        # Vista de tareas del panel: páginas por estado en orden de task_date (get_tasks_list_page)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_date ON tasks(status, task_date)')
+        # Parcial: que las tareas sin fecha sigan recorriéndose por created_at
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_dated ON tasks(task_date) WHERE task_date IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_task_day ON tasks(task_day, task_date)')
+        # Agenda del bot por días (get_tasks_by_day_range con usuario y estado)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_status_day ON tasks(user_id, status, task_day, task_date)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_clients_normalized_name ON clients(normalized_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_images_task_id ON task_images(task_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_images_task_created ON task_images(task_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ampliaciones_task_created ON task_ampliaciones_history(task_id, created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_categories_user_id ON user_categories(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_categories_category ON user_categories(category_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_web_users_username ON web_users(username)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transcript_cache_last_used ON transcript_cache(last_used_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(queue, status, priority, run_at)')
+        # Índice parcial para claim_job: solo los trabajos reservables, ya en el orden de reserva
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(queue, priority, run_at)
+            WHERE status IN ('pending', 'running')
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states(expires_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes(changed_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_calendar_sync_event ON calendar_sync_state(event_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_calendar_sync_status ON calendar_sync_state(status)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_archive_id ON tasks_archive(id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_archive_created ON tasks_archive(created_at)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_task_images_archive_id ON task_images_archive(id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_images_archive_task ON task_images_archive(task_id, created_at)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_ampliaciones_archive_id ON task_ampliaciones_history_archive(id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ampliaciones_archive_task ON task_ampliaciones_history_archive(task_id, created_at)')
         
         # Inicializar categorías por defecto si no existen
         self._init_default_categories(cursor)
+        self._init_categories_version(cursor)
+        
+        # Columnas de tasks (proyección de campos en get_tasks_after)
+        self.task_columns = tuple(self._table_columns(cursor, 'tasks'))
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         
         conn.commit()
         conn.close()
+        
+        # init_db también se llama tras importar una BD: lo cacheado ya no vale
+        self.invalidate_categories()
+        self.invalidate_web_user_identity()
     
     # ========== CLIENTES ==========
     
@@ -325,6 +548,18 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
+    def iter_clients_export(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Clientes para exportar, con su número de tareas (totales y abiertas), sin cargarlos en memoria"""
+        query = '''
+            SELECT clients.id, clients.name, clients.aliases, clients.created_at,
+                   (SELECT COUNT(*) FROM tasks WHERE tasks.client_id = clients.id) AS tasks_count,
+                   (SELECT COUNT(*) FROM tasks
+                    WHERE tasks.client_id = clients.id AND tasks.status = 'open') AS open_tasks_count
+            FROM clients
+            ORDER BY clients.name
+        '''
+        return self._iter_query(query, [], batch_size)
+    
     def update_client(self, client_id: int, name: str = None, aliases: List[str] = None):
         """Actualiza cliente"""
         from utils import normalize_text
@@ -366,6 +601,61 @@ class Database:
     
     # ========== TAREAS ==========
     
+    def _normalize_task_dates(self, cursor):
+        """
+        Pasa a formato canónico las fechas de tareas antiguas (las que aún no tienen task_day).
+        
+        Las fechas que no se reconocen se conservan y se marcan con task_day vacío
+        (UNRECOGNIZED_TASK_DAY) para no volver a procesarlas en cada init_db.
+        """
+        cursor.execute('SELECT id, task_date FROM tasks WHERE task_date IS NOT NULL AND task_day IS NULL')
+        rows = cursor.fetchall()
+        updated = 0
+        for row in rows:
+            canonical = normalize_task_date(row['task_date'])
+            if canonical:
+                cursor.execute(
+                    'UPDATE tasks SET task_date = ?, task_day = ? WHERE id = ?',
+                    (canonical, canonical[:10], row['id'])
+                )
+                updated += 1
+            else:
+                logger.warning(f"Tarea {row['id']}: fecha no reconocida {row['task_date']!r}")
+                cursor.execute('UPDATE tasks SET task_day = ? WHERE id = ?', (UNRECOGNIZED_TASK_DAY, row['id']))
+        if updated:
+            logger.info(f"Fechas de {updated} tareas normalizadas al formato canónico")
+    
+    @staticmethod
+    def _table_columns(cursor, table: str) -> Dict[str, str]:
+        """Columnas de una tabla (nombre -> tipo) en su orden"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        return {row[1]: row[2] for row in cursor.fetchall()}
+    
+    def _init_archive(self, cursor):
+        """
+        Crea las tablas de archivo y las vistas '<tabla>_all'.
+        
+        Las tablas de archivo copian las columnas de la activa (sin restricciones);
+        las columnas que añadan migraciones posteriores se añaden también aquí.
+        """
+        for table, archive in ARCHIVE_TABLES.items():
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {archive} AS SELECT * FROM {table} WHERE 0')
+            
+            columns = self._table_columns(cursor, table)
+            archive_columns = self._table_columns(cursor, archive)
+            for name, col_type in columns.items():
+                if name not in archive_columns:
+                    cursor.execute(f'ALTER TABLE {archive} ADD COLUMN {name} {col_type}')
+            
+            column_list = ', '.join(columns)
+            cursor.execute(f'DROP VIEW IF EXISTS {table}_all')
+            cursor.execute(f'''
+                CREATE VIEW {table}_all AS
+                SELECT {column_list}, 0 AS archived FROM {table}
+                UNION ALL
+                SELECT {column_list}, 1 AS archived FROM {archive}
+            ''')
+    
     def create_task(self, user_id: int, user_name: str, title: str,
                     description: str = None, priority: str = 'normal',
                     task_date: datetime = None, client_id: int = None,
@@ -377,16 +667,17 @@ class Database:
                 conn = self.get_connection()
                 cursor = conn.cursor()
                 
-                task_date_str = task_date.isoformat() if task_date else None
+                task_date_str = normalize_task_date(task_date)
+                task_day = task_date_str[:10] if task_date_str else None
                 
                 cursor.execute('''
                     INSERT INTO tasks (
                         user_id, user_name, title, description, priority,
-                        task_date, client_id, client_name_raw, category
+                        task_date, task_day, client_id, client_name_raw, category
                     )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (user_id, user_name, title, description, priority,
-                      task_date_str, client_id, client_name_raw, category))
+                      task_date_str, task_day, client_id, client_name_raw, category))
                 
                 task_id = cursor.lastrowid
                 conn.commit()
@@ -397,11 +688,11 @@ class Database:
         
         return self._retry_on_locked(_create)
     
-    def get_task_by_id(self, task_id: int) -> Optional[Dict]:
-        """Obtiene tarea por ID"""
+    def get_task_by_id(self, task_id: int, include_archive: bool = False) -> Optional[Dict]:
+        """Obtiene tarea por ID (con include_archive también las archivadas)"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
+        cursor.execute(f'SELECT * FROM {self._source("tasks", include_archive)} WHERE id = ?', (task_id,))
         row = cursor.fetchone()
         conn.close()
         
@@ -409,13 +700,25 @@ class Database:
             return dict(row)
         return None
     
+    def get_tasks_by_ids(self, task_ids: List[int]) -> Dict[int, Dict]:
+        """Tareas activas por ID en una consulta (task_id -> tarea; las que no existen no aparecen)"""
+        if not task_ids:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM tasks WHERE id IN ({', '.join('?' for _ in task_ids)})", list(task_ids))
+        rows = cursor.fetchall()
+        conn.close()
+        return {row['id']: dict(row) for row in rows}
+    
     def get_tasks(self, user_id: int = None, status: str = None,
-                  client_id: int = None, limit: int = None) -> List[Dict]:
-        """Obtiene tareas con filtros"""
+                  client_id: int = None, limit: int = None,
+                  category: str = None, include_archive: bool = False) -> List[Dict]:
+        """Obtiene tareas con filtros (con include_archive también las archivadas)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        query = 'SELECT * FROM tasks WHERE 1=1'
+        query = f'SELECT * FROM {self._source("tasks", include_archive)} WHERE 1=1'
         params = []
         
         if user_id:
@@ -430,6 +733,10 @@ class Database:
             query += ' AND client_id = ?'
             params.append(client_id)
         
+        if category:
+            query += ' AND category = ?'
+            params.append(category)
+        
         query += ' ORDER BY created_at DESC'
         
         if limit:
@@ -441,6 +748,313 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
+    def get_tasks_page(self, user_id: int, statuses: tuple = ('open',), after: tuple = None,
+                       limit: int = 10, date_from: str = None, date_to: str = None,
+                       no_date: bool = False) -> Tuple[List[Dict], Optional[tuple]]:
+        """
+        Obtiene una página de tareas de un usuario ordenadas por (task_date, id).
+        
+        Paginación por keyset: 'after' es el cursor (task_date, id) de la última
+        tarea de la página anterior, así cada página es una sola consulta sobre
+        idx_tasks_user_status_date sin importar cuántas tareas tenga el usuario.
+        Las tareas sin fecha van primero (NULL ordena antes en SQLite).
+        
+        Args:
+            date_from, date_to: rango [date_from, date_to) sobre task_date (ISO)
+            no_date: solo tareas sin fecha
+        
+        Returns:
+            (tareas, cursor de la página siguiente o None si no hay más)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        query = f'''
+            SELECT * FROM tasks
+            WHERE user_id = ? AND status IN ({', '.join('?' for _ in statuses)})
+        '''
+        params = [user_id, *statuses]
+        
+        if no_date:
+            query += ' AND task_date IS NULL'
+        if date_from:
+            query += ' AND task_date >= ?'
+            params.append(date_from)
+        if date_to:
+            query += ' AND task_date < ?'
+            params.append(date_to)
+        
+        if after:
+            after_date, after_id = after
+            if after_date is None:
+                query += ' AND ((task_date IS NULL AND id > ?) OR task_date IS NOT NULL)'
+                params.append(after_id)
+            else:
+                query += ' AND (task_date, id) > (?, ?)'
+                params.extend([after_date, after_id])
+        
+        query += ' ORDER BY task_date, id LIMIT ?'
+        params.append(limit + 1)
+        
+        cursor.execute(query, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1]['task_date'], rows[-1]['id'])
+        return rows, None
+    
+    def get_tasks_after(self, after: tuple = None, limit: int = 100, user_id: int = None,
+                        status: str = None, client_id: int = None, updated_since: str = None,
+                        fields: List[str] = None) -> List[Dict]:
+        """
+        Obtiene tareas ordenadas por (created_at, id) para la paginación de la API.
+        
+        Paginación por keyset como get_tasks_page: 'after' es el (created_at, id)
+        de la última tarea de la página anterior. El orden coincide con el de los
+        índices compuestos que terminan en created_at (el rowid va implícito).
+        
+        Args:
+            updated_since: solo tareas con updated_at >= este instante (UTC, 'YYYY-MM-DD HH:MM:SS')
+            fields: columnas a devolver (id y created_at van siempre); ValueError si alguna no existe
+        """
+        if fields:
+            unknown = [f for f in fields if f not in self.task_columns]
+            if unknown:
+                raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+            columns = ', '.join(['id', 'created_at'] + [f for f in fields if f not in ('id', 'created_at')])
+        else:
+            columns = '*'
+        
+        query = f'SELECT {columns} FROM tasks WHERE 1=1'
+        params = []
+        
+        if user_id:
+            query += ' AND user_id = ?'
+            params.append(user_id)
+        
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        
+        if client_id:
+            query += ' AND client_id = ?'
+            params.append(client_id)
+        
+        if updated_since:
+            query += ' AND updated_at >= ?'
+            params.append(updated_since)
+        
+        if after:
+            query += ' AND (created_at, id) > (?, ?)'
+            params.extend(after)
+        
+        query += ' ORDER BY created_at, id LIMIT ?'
+        params.append(limit)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
+    def _iter_query(self, query: str, params: list, batch_size: int) -> Iterator[Dict]:
+        """
+        Recorre el resultado de una consulta por bloques de batch_size filas.
+        
+        El cursor de SQLite va leyendo según se pide, así que la memoria no
+        depende del número de filas. La conexión se cierra al terminar o al
+        abandonar el iterador (p. ej. si se corta una descarga).
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _task_filters_sql(status: str = None, priority: str = None, category: str = None,
+                          user_id: int = None, task_day: str = None, search: str = None,
+                          allowed_categories: List[str] = None) -> Tuple[str, list]:
+        """
+        Condiciones WHERE (sobre el alias 't') de los filtros de la vista de tareas.
+        
+        Args:
+            task_day: día de la tarea ('YYYY-MM-DD')
+            search: texto a buscar en título, descripción, cliente, solución,
+                    ampliación, categoría y usuario (sin distinguir mayúsculas)
+            allowed_categories: si se indica, solo tareas sin categoría o de estas categorías
+        
+        Returns:
+            (' WHERE ...', parámetros)
+        """
+        conditions = []
+        params = []
+        
+        if status:
+            conditions.append('t.status = ?')
+            params.append(status)
+        
+        if priority:
+            conditions.append('t.priority = ?')
+            params.append(priority)
+        
+        if category:
+            conditions.append('t.category = ?')
+            params.append(category)
+        
+        if user_id:
+            conditions.append('t.user_id = ?')
+            params.append(user_id)
+        
+        if task_day:
+            conditions.append('t.task_day = ?')
+            params.append(task_day)
+        
+        if allowed_categories is not None:
+            placeholders = ', '.join('?' for _ in allowed_categories)
+            conditions.append(f"(t.category IS NULL OR t.category = '' OR t.category IN ({placeholders}))")
+            params.extend(allowed_categories)
+        
+        if search:
+            searchable = " || ' ' || ".join(
+                f"COALESCE({column}, '')" for column in (
+                    't.title', 't.description', 't.client_name_raw', 't.solution',
+                    't.ampliacion', 't.category', 't.user_name',
+                )
+            )
+            conditions.append(f'instr(unicode_lower({searchable}), ?) > 0')
+            params.append(search.lower())
+        
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+    
+    def iter_tasks_export(self, status: str = None, priority: str = None, category: str = None,
+                          user_id: int = None, task_day: str = None, search: str = None,
+                          allowed_categories: List[str] = None, include_archive: bool = False,
+                          batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Tareas para exportar, con los nombres de cliente y categoría y el historial
+        de ampliaciones resueltos en SQL, por orden de creación y sin cargarlas en memoria.
+        
+        Los filtros son los de _task_filters_sql.
+        """
+        tasks = self._source('tasks', include_archive)
+        history = self._source('task_ampliaciones_history', include_archive)
+        query = f'''
+            SELECT t.id, t.created_at, t.updated_at, t.status, t.priority,
+                   t.category, categories.display_name AS category_name,
+                   t.title, t.description, t.client_id,
+                   COALESCE(clients.name, t.client_name_raw) AS client_name,
+                   t.user_id, t.user_name, t.task_date,
+                   t.ampliacion, t.ampliacion_user, t.solution, t.solution_user,
+                   (SELECT GROUP_CONCAT(h.created_at || ' ' || h.user_name || ': ' || h.ampliacion_text, char(10))
+                    FROM (SELECT * FROM {history} WHERE task_id = t.id ORDER BY created_at) AS h
+                   ) AS ampliaciones_history
+            FROM {tasks} AS t
+            LEFT JOIN clients ON clients.id = t.client_id
+            LEFT JOIN categories ON categories.name = t.category
+        '''
+        where, params = self._task_filters_sql(
+            status=status, priority=priority, category=category, user_id=user_id,
+            task_day=task_day, search=search, allowed_categories=allowed_categories,
+        )
+        query += where
+        
+        # Mismo orden que los índices compuestos terminados en created_at: sin ordenar en memoria
+        query += ' ORDER BY t.created_at, t.id'
+        return self._iter_query(query, params, batch_size)
+    
+    def get_tasks_list_page(self, dated: bool = True, after: tuple = None, limit: int = 30,
+                            include_archive: bool = False, **filters) -> Tuple[List[Dict], Optional[tuple]]:
+        """
+        Obtiene una página de la vista de tareas del panel (filtros de _task_filters_sql),
+        con el nombre del cliente asociado en 'client_name'.
+        
+        Las tareas con fecha van por (task_date, id) descendente y las que no
+        tienen fecha por (created_at, id) descendente. Paginación por keyset:
+        'after' es el cursor de la última tarea de la página anterior.
+        
+        Returns:
+            (tareas, cursor de la página siguiente o None si no hay más)
+        """
+        order_column = 't.task_date' if dated else 't.created_at'
+        where, params = self._task_filters_sql(**filters)
+        conditions = [where[len(' WHERE '):]] if where else []
+        conditions.append('t.task_date IS NOT NULL' if dated else 't.task_date IS NULL')
+        if after:
+            conditions.append(f'({order_column}, t.id) < (?, ?)')
+            params.extend(after)
+        
+        query = f'''
+            SELECT t.*, clients.name AS client_name
+            FROM {self._source("tasks", include_archive)} AS t
+            LEFT JOIN clients ON clients.id = t.client_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order_column} DESC, t.id DESC
+            LIMIT ?
+        '''
+        params.append(limit + 1)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            return rows, (last['task_date'] if dated else last['created_at'], last['id'])
+        return rows, None
+    
+    def get_task_users(self) -> Dict[int, str]:
+        """Usuarios que tienen tareas (user_id -> nombre), para los filtros del panel"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, MAX(user_name) AS user_name FROM tasks GROUP BY user_id')
+        rows = cursor.fetchall()
+        conn.close()
+        return {row['user_id']: row['user_name'] or f"Usuario {row['user_id']}" for row in rows}
+    
+    def get_tasks_by_day_range(self, day_from, day_to, include_archive: bool = False,
+                               **filters) -> List[Dict]:
+        """
+        Obtiene las tareas con fecha entre day_from y day_to (ambos incluidos).
+        
+        Args:
+            day_from, day_to: date o cadena 'YYYY-MM-DD'
+            filters: filtros de _task_filters_sql (user_id, status, búsqueda...)
+        
+        Returns:
+            Tareas ordenadas por fecha y hora (rango sobre idx_tasks_task_day)
+        """
+        where, filter_params = self._task_filters_sql(**filters)
+        conditions = ['t.task_day BETWEEN ? AND ?']
+        if where:
+            conditions.append(where[len(' WHERE '):])
+        params = [str(day_from), str(day_to)] + filter_params
+        
+        query = f'''
+            SELECT t.* FROM {self._source("tasks", include_archive)} AS t
+            WHERE {' AND '.join(conditions)}
+            ORDER BY t.task_day, t.task_date, t.id
+        '''
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
     def update_task(self, task_id: int, **kwargs) -> bool:
         """Actualiza tarea con reintentos automáticos si la BD está bloqueada"""
         def _update():
@@ -450,13 +1064,18 @@ class Database:
                 cursor = conn.cursor()
                 
                 allowed_fields = ['title', 'description', 'status', 'priority',
-                                 'task_date', 'client_id', 'client_name_raw',
+                                 'task_date', 'task_day', 'client_id', 'client_name_raw',
                                  'category', 'google_event_id', 'google_event_link',
                                  'ampliacion', 'ampliacion_user', 'solution', 'solution_user']
                 
                 updates = []
                 params = []
                 
+                # task_date siempre en formato canónico, con su task_day
+                if 'task_date' in kwargs:
+                    kwargs['task_date'] = normalize_task_date(kwargs['task_date'])
+                    kwargs['task_day'] = kwargs['task_date'][:10] if kwargs['task_date'] else None
+                
                 for key, value in kwargs.items():
                     if key in allowed_fields:
                         # Manejar valores None/null para establecer NULL en la base de datos
@@ -538,14 +1157,95 @@ class Database:
                 VALUES (?, ?, ?, ?)
             ''', (name, icon, color, display_name))
     
+    def _init_categories_version(self, cursor):
+        """
+        Versión de las categorías compartida entre procesos: los triggers la
+        incrementan con cualquier cambio en la tabla (update_category, importación, SQL a mano).
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('categories', 0)")
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_categories_{op.lower()}_version AFTER {op} ON categories
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = 'categories';
+                END
+            ''')
+    
+    def _category_registry(self) -> Dict:
+        """
+        Registro de categorías en memoria, cargado en la primera consulta.
+        
+        Las categorías casi nunca cambian: se leen una vez y, como mucho cada
+        CATEGORIES_CHECK_SECONDS, se compara la versión guardada en la BD (una
+        lectura por clave primaria) para ver los cambios hechos desde otro proceso.
+        invalidate_categories (update_category, init_db) fuerza la relectura en este.
+        """
+        registry = self._categories
+        if registry is not None and time.monotonic() < self._categories_checked_at + config.CATEGORIES_CHECK_SECONDS:
+            return registry
+        
+        with self._categories_lock:
+            now = time.monotonic()
+            if self._categories is not None and now < self._categories_checked_at + config.CATEGORIES_CHECK_SECONDS:
+                return self._categories
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT version FROM data_versions WHERE name = 'categories'")
+                row = cursor.fetchone()
+                db_version = row['version'] if row else 0
+                if self._categories is None or self._categories['db_version'] != db_version:
+                    if self._categories is not None:
+                        # Otro proceso ha cambiado las categorías
+                        self._categories_version += 1
+                    cursor.execute('SELECT * FROM categories ORDER BY name')
+                    categories = [dict(row) for row in cursor.fetchall()]
+                    self._categories = {
+                        'version': self._categories_version,
+                        'db_version': db_version,
+                        'list': categories,
+                        'by_name': {cat['name']: cat for cat in categories},
+                        'by_display_name': {(cat['display_name'] or cat['name']).lower(): cat for cat in categories},
+                    }
+            finally:
+                conn.close()
+            self._categories_checked_at = now
+            return self._categories
+    
+    @property
+    def categories_version(self) -> int:
+        """Versión del registro de categorías; cambia con cada relectura"""
+        return self._category_registry()['version']
+    
+    def invalidate_categories(self):
+        """Descarta el registro de categorías para releerlo en la próxima consulta"""
+        with self._categories_lock:
+            self._categories = None
+            self._categories_version += 1
+    
     def get_all_categories(self) -> List[Dict]:
         """Obtiene todas las categorías"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM categories ORDER BY name')
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        return [dict(cat) for cat in self._category_registry()['list']]
+    
+    def get_category_names(self) -> List[str]:
+        """Nombres internos de todas las categorías, ordenados"""
+        return [cat['name'] for cat in self._category_registry()['list']]
+    
+    def get_category(self, name: str) -> Optional[Dict]:
+        """Obtiene una categoría por su nombre interno"""
+        category = self._category_registry()['by_name'].get(name)
+        return dict(category) if category else None
+    
+    def get_category_by_display_name(self, display_name: str) -> Optional[Dict]:
+        """Obtiene una categoría por su nombre de visualización (sin distinguir mayúsculas)"""
+        category = self._category_registry()['by_display_name'].get((display_name or '').strip().lower())
+        return dict(category) if category else None
     
     def update_category(self, category_id: int, icon: str = None, 
                        color: str = None, display_name: str = None) -> bool:
@@ -580,11 +1280,14 @@ class Database:
             success = False
         
         conn.close()
+        if success:
+            self.invalidate_categories()
         return success
     
     # ========== IMÁGENES DE TAREAS ==========
     
-    def add_image_to_task(self, task_id: int, file_id: str, file_path: str) -> int:
+    def add_image_to_task(self, task_id: int, file_id: str, file_path: str,
+                          upload_state: Optional[str] = None) -> int:
         """Añade una imagen a una tarea con reintentos automáticos si la BD está bloqueada"""
         def _add_image():
             conn = None
@@ -593,9 +1296,9 @@ class Database:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                    INSERT INTO task_images (task_id, file_id, file_path)
-                    VALUES (?, ?, ?)
-                ''', (task_id, file_id, file_path))
+                    INSERT INTO task_images (task_id, file_id, file_path, upload_state)
+                    VALUES (?, ?, ?, ?)
+                ''', (task_id, file_id, file_path, upload_state))
                 
                 image_id = cursor.lastrowid
                 conn.commit()
@@ -606,15 +1309,64 @@ class Database:
         
         return self._retry_on_locked(_add_image)
     
-    def get_task_images(self, task_id: int) -> List[Dict]:
+    def get_task_images(self, task_id: int, include_archive: bool = False) -> List[Dict]:
         """Obtiene todas las imágenes de una tarea"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM task_images WHERE task_id = ? ORDER BY created_at', (task_id,))
+        cursor.execute(
+            f'SELECT * FROM {self._source("task_images", include_archive)} WHERE task_id = ? ORDER BY created_at',
+            (task_id,)
+        )
         rows = cursor.fetchall()
         conn.close()
         return [dict(row) for row in rows]
     
+    def get_task_images_for_tasks(self, task_ids: List[int], include_archive: bool = False) -> Dict[int, List[Dict]]:
+        """Imágenes de varias tareas en una consulta (task_id -> imágenes por fecha)"""
+        images = {task_id: [] for task_id in task_ids}
+        if not task_ids:
+            return images
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM {self._source("task_images", include_archive)}
+            WHERE task_id IN ({', '.join('?' for _ in task_ids)})
+            ORDER BY task_id, created_at
+        ''', list(task_ids))
+        for row in cursor.fetchall():
+            images[row['task_id']].append(dict(row))
+        conn.close()
+        return images
+    
+    def update_task_image_path(self, image_id: int, file_path: str,
+                               upload_state: Optional[str] = None) -> bool:
+        """Actualiza la ruta y el estado de subida de una imagen (p. ej. al llegar a SFTP)"""
+        def _update():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE task_images SET file_path = ?, upload_state = COALESCE(?, upload_state)
+                    WHERE id = ?
+                ''', (file_path, upload_state, image_id))
+                conn.commit()
+                return cursor.rowcount > 0
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_update)
+    
+    def get_task_image(self, image_id: int, include_archive: bool = False) -> Optional[Dict]:
+        """Obtiene una imagen por ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT * FROM {self._source("task_images", include_archive)} WHERE id = ?', (image_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+    
     def delete_task_image(self, image_id: int) -> bool:
         """Elimina una imagen de una tarea"""
         conn = self.get_connection()
@@ -658,6 +1410,74 @@ class Database:
         conn.close()
         return dict(row) if row else None
     
+    def get_users_with_categories(self, user_id: int = None, include_master: bool = True) -> List[Dict]:
+        """
+        Usuarios web con sus categorías permitidas ('categories'), en una sola consulta.
+        
+        Agrupa user_categories con GROUP_CONCAT en lugar de consultar las
+        categorías usuario a usuario; con user_id devuelve solo ese usuario.
+        """
+        conditions = []
+        params = [CATEGORY_SEPARATOR]
+        if user_id is not None:
+            conditions.append('web_users.id = ?')
+            params.append(user_id)
+        if not include_master:
+            conditions.append('NOT web_users.is_master')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT web_users.*, GROUP_CONCAT(user_categories.category_name, ?) AS category_list
+            FROM web_users
+            LEFT JOIN user_categories ON user_categories.user_id = web_users.id
+            {where}
+            GROUP BY web_users.id
+            ORDER BY web_users.created_at DESC
+        ''', params)
+        rows = cursor.fetchall()
+        conn.close()
+        
+        users = []
+        for row in rows:
+            user = dict(row)
+            category_list = user.pop('category_list')
+            user['categories'] = sorted(category_list.split(CATEGORY_SEPARATOR)) if category_list else []
+            users.append(user)
+        return users
+    
+    def get_web_user_identity(self, user_id: int) -> Optional[Dict]:
+        """
+        Usuario web con sus categorías permitidas ('categories'), en una sola consulta.
+        
+        Usa get_users_with_categories y se guarda en una caché por proceso durante AUTH_CACHE_TTL_SECONDS; los
+        cambios hechos con update_web_user, delete_web_user y set_user_categories
+        la invalidan al momento (en el resto de procesos caduca sola).
+        """
+        now = time.monotonic()
+        with self._identity_lock:
+            cached = self._identity_cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            user = cached[1]
+            return {**user, 'categories': list(user['categories'])} if user else None
+        
+        users = self.get_users_with_categories(user_id=user_id)
+        user = users[0] if users else None
+        with self._identity_lock:
+            if len(self._identity_cache) > 1000:
+                self._identity_cache.clear()
+            self._identity_cache[user_id] = (now + config.AUTH_CACHE_TTL_SECONDS, user)
+        return {**user, 'categories': list(user['categories'])} if user else None
+    
+    def invalidate_web_user_identity(self, user_id: int = None):
+        """Descarta de la caché la identidad de un usuario (o la de todos)"""
+        with self._identity_lock:
+            if user_id is None:
+                self._identity_cache.clear()
+            else:
+                self._identity_cache.pop(user_id, None)
+    
     def get_all_web_users(self) -> List[Dict]:
         """Obtiene todos los usuarios web"""
         conn = self.get_connection()
@@ -699,6 +1519,7 @@ class Database:
             conn.commit()
         
         conn.close()
+        self.invalidate_web_user_identity(user_id)
     
     def delete_web_user(self, user_id: int) -> bool:
         """Elimina un usuario web"""
@@ -708,6 +1529,7 @@ class Database:
         conn.commit()
         success = cursor.rowcount > 0
         conn.close()
+        self.invalidate_web_user_identity(user_id)
         return success
     
     def get_user_categories(self, user_id: int) -> List[str]:
@@ -739,10 +1561,11 @@ class Database:
         
         conn.commit()
         conn.close()
+        self.invalidate_web_user_identity(user_id)
     
     def user_has_category_access(self, user_id: int, category_name: str) -> bool:
         """Verifica si un usuario tiene acceso a una categoría"""
-        user = self.get_web_user_by_id(user_id)
+        user = self.get_web_user_identity(user_id)
         if not user:
             return False
         
@@ -751,8 +1574,7 @@ class Database:
             return True
         
         # Verificar si el usuario tiene acceso a esta categoría
-        categories = self.get_user_categories(user_id)
-        return category_name in categories
+        return category_name in user['categories']
     
     # ========== HISTORIAL DE AMPLIACIONES ==========
     
@@ -776,13 +1598,13 @@ class Database:
         
         return self._retry_on_locked(_add_history)
     
-    def get_task_ampliaciones_history(self, task_id: int) -> List[Dict]:
+    def get_task_ampliaciones_history(self, task_id: int, include_archive: bool = False) -> List[Dict]:
         """Obtiene el historial de ampliaciones de una tarea"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT id, ampliacion_text, user_name, user_id, created_at
-            FROM task_ampliaciones_history
+            FROM {self._source('task_ampliaciones_history', include_archive)}
             WHERE task_id = ?
             ORDER BY created_at ASC
         ''', (task_id,))
@@ -790,13 +1612,13 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
-    def get_last_ampliacion(self, task_id: int) -> Optional[Dict]:
+    def get_last_ampliacion(self, task_id: int, include_archive: bool = False) -> Optional[Dict]:
         """Obtiene la última ampliación de una tarea"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT id, ampliacion_text, user_name, user_id, created_at
-            FROM task_ampliaciones_history
+            FROM {self._source('task_ampliaciones_history', include_archive)}
             WHERE task_id = ?
             ORDER BY created_at DESC
             LIMIT 1
@@ -804,6 +1626,761 @@ class Database:
         row = cursor.fetchone()
         conn.close()
         return dict(row) if row else None
+    
+    def get_last_ampliaciones(self, task_ids: List[int], include_archive: bool = False) -> Dict[int, Dict]:
+        """Última ampliación de varias tareas en una consulta (task_id -> ampliación; sin entrada si no hay)"""
+        if not task_ids:
+            return {}
+        history = self._source('task_ampliaciones_history', include_archive)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT h.id, h.task_id, h.ampliacion_text, h.user_name, h.user_id, h.created_at
+            FROM {history} AS h
+            WHERE h.task_id IN ({', '.join('?' for _ in task_ids)})
+              AND h.id = (
+                  SELECT last.id FROM {history} AS last
+                  WHERE last.task_id = h.task_id
+                  ORDER BY last.created_at DESC, last.id DESC
+                  LIMIT 1
+              )
+        ''', list(task_ids))
+        rows = cursor.fetchall()
+        conn.close()
+        return {row['task_id']: dict(row) for row in rows}
+    
+    # ========== ARCHIVO DE TAREAS ==========
+    
+    @staticmethod
+    def _source(table: str, include_archive: bool) -> str:
+        """Tabla activa o vista '<tabla>_all' (activa + archivo) para las lecturas"""
+        return f'{table}_all' if include_archive else table
+    
+    def archive_tasks(self, older_than_days: int, batch_size: int = 500) -> int:
+        """
+        Mueve al archivo las tareas completadas o canceladas sin cambios en N días,
+        junto con sus imágenes y su historial de ampliaciones.
+        
+        Trabaja por lotes, una transacción corta por lote, para no bloquear
+        a los workers ni al bot mientras se archiva.
+        
+        Returns:
+            Número de tareas archivadas
+        """
+        def _archive_batch():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                statuses = ', '.join('?' for _ in ARCHIVABLE_STATUSES)
+                cursor.execute(f'''
+                    SELECT id FROM tasks
+                    WHERE status IN ({statuses})
+                      AND COALESCE(updated_at, created_at) < datetime('now', ?)
+                    LIMIT ?
+                ''', (*ARCHIVABLE_STATUSES, f'-{older_than_days} days', batch_size))
+                task_ids = [row['id'] for row in cursor.fetchall()]
+                if not task_ids:
+                    conn.rollback()
+                    return 0
+                
+                cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+                first_seq = cursor.fetchone()[0]
+                ids = ', '.join('?' for _ in task_ids)
+                # Primero las tablas hijas y al final la tarea
+                for table, key in (('task_images', 'task_id'), ('task_ampliaciones_history', 'task_id'), ('tasks', 'id')):
+                    columns = ', '.join(self._table_columns(cursor, table))
+                    cursor.execute(f'''
+                        INSERT INTO {ARCHIVE_TABLES[table]} ({columns})
+                        SELECT {columns} FROM {table} WHERE {key} IN ({ids})
+                    ''', task_ids)
+                    cursor.execute(f'DELETE FROM {table} WHERE {key} IN ({ids})', task_ids)
+                # Para los consumidores del registro de cambios no son borrados sino archivados
+                cursor.execute("UPDATE changes SET op = 'archive' WHERE seq > ? AND op = 'delete'", (first_seq,))
+                conn.commit()
+                return len(task_ids)
+            finally:
+                if conn:
+                    conn.close()
+        
+        total = 0
+        while True:
+            archived = self._retry_on_locked(_archive_batch)
+            total += archived
+            if archived < batch_size:
+                return total
+    
+    def get_archive_stats(self) -> Dict:
+        """Número de tareas activas y archivadas"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT (SELECT COUNT(*) FROM tasks) AS active, (SELECT COUNT(*) FROM tasks_archive) AS archived')
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row)
+    
+    # ========== REGISTRO DE CAMBIOS ==========
+    
+    def _init_changes(self, cursor):
+        """Triggers que anotan en 'changes' cada alta, modificación y borrado de las tablas seguidas"""
+        for table, task_expr in CHANGE_TRACKED_TABLES.items():
+            for op, event, ref in (('insert', 'INSERT', 'NEW'), ('update', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD')):
+                task_id = f'{ref}.{task_expr}' if task_expr else 'NULL'
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_changes AFTER {event} ON {table}
+                    BEGIN
+                        INSERT INTO changes (table_name, row_id, op, task_id)
+                        VALUES ('{table}', {ref}.id, '{op}', {task_id});
+                    END
+                ''')
+    
+    def latest_change_seq(self) -> int:
+        """Último seq registrado (0 si aún no hay cambios); sirve a un consumidor nuevo para empezar desde ahora"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+        seq = cursor.fetchone()[0]
+        conn.close()
+        return seq
+    
+    def changes_since(self, seq: int, limit: int = 500, tables: List[str] = None) -> List[Dict]:
+        """
+        Cambios posteriores a 'seq', en orden. El consumidor guarda el seq del
+        último cambio procesado (ack_changes) y vuelve a pedir desde ahí.
+        
+        Si la compactación ya ha borrado cambios posteriores a 'seq', lanza
+        ChangesCompactedError: se han perdido cambios y hay que releer las tablas.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            # La compactación nunca borra el último cambio: todo lo anterior al primero
+            # que queda ya no está disponible
+            cursor.execute('SELECT MIN(seq) FROM changes')
+            first_seq = cursor.fetchone()[0]
+            horizon = first_seq - 1 if first_seq is not None else 0
+            if seq < horizon:
+                raise ChangesCompactedError(f"Los cambios posteriores a {seq} ya se han compactado (hasta {horizon})")
+            
+            query = 'SELECT * FROM changes WHERE seq > ?'
+            params = [seq]
+            if tables:
+                query += f" AND table_name IN ({', '.join('?' for _ in tables)})"
+                params.extend(tables)
+            query += ' ORDER BY seq LIMIT ?'
+            params.append(limit)
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def get_change_cursor(self, consumer: str) -> Optional[int]:
+        """Último seq procesado por un consumidor (None si no está registrado)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT last_seq FROM change_consumers WHERE name = ?', (consumer,))
+        row = cursor.fetchone()
+        conn.close()
+        return row['last_seq'] if row else None
+    
+    def ack_changes(self, consumer: str, seq: int):
+        """Registra que el consumidor ha procesado los cambios hasta 'seq' (incluido)"""
+        def _ack():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO change_consumers (name, last_seq) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        last_seq = MAX(last_seq, excluded.last_seq),
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (consumer, seq))
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_ack)
+    
+    def compact_changes(self, retention_days: int) -> int:
+        """
+        Borra los cambios que ya han procesado todos los consumidores registrados
+        y, en cualquier caso, los de más de 'retention_days' días (un consumidor
+        parado no hace crecer la tabla sin límite). El último cambio se conserva
+        siempre para que changes_since sepa hasta dónde se ha compactado.
+        
+        Returns:
+            Número de cambios borrados
+        """
+        def _compact():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM changes
+                    WHERE seq < (SELECT MAX(seq) FROM changes)
+                      AND (seq <= (SELECT COALESCE(MIN(last_seq), 0) FROM change_consumers)
+                           OR changed_at < datetime('now', ?))
+                ''', (f'-{retention_days} days',))
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_compact)
+    
+    # ========== SINCRONIZACIÓN DE CALENDARIO ==========
+    
+    def get_calendar_sync_states(self, task_ids: List[int] = None, status: str = None) -> List[Dict]:
+        """Estado de sincronización de las tareas indicadas (o de todas), opcionalmente por estado"""
+        query = 'SELECT * FROM calendar_sync_state WHERE 1=1'
+        params = []
+        if task_ids is not None:
+            query += f" AND task_id IN ({', '.join('?' for _ in task_ids)})"
+            params.extend(task_ids)
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        query += ' ORDER BY task_id'
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
+    def get_calendar_sync_states_by_event(self, event_ids: List[str]) -> Dict[str, Dict]:
+        """Estado de sincronización por id de evento (solo los eventos que corresponden a tareas)"""
+        if not event_ids:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM calendar_sync_state
+            WHERE event_id IN ({', '.join('?' for _ in event_ids)})
+        ''', list(event_ids))
+        rows = cursor.fetchall()
+        conn.close()
+        return {row['event_id']: dict(row) for row in rows}
+    
+    def save_calendar_sync_states(self, states: List[Dict]):
+        """Guarda (inserta o sustituye) estados de sincronización en una sola transacción"""
+        if not states:
+            return
+        
+        def _save():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO calendar_sync_state
+                        (task_id, event_id, etag, event_hash, status, last_error, synced_at, updated_at)
+                    VALUES (:task_id, :event_id, :etag, :event_hash, :status, :last_error, :synced_at, CURRENT_TIMESTAMP)
+                    ON CONFLICT(task_id) DO UPDATE SET
+                        event_id = excluded.event_id,
+                        etag = excluded.etag,
+                        event_hash = excluded.event_hash,
+                        status = excluded.status,
+                        last_error = excluded.last_error,
+                        synced_at = excluded.synced_at,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [
+                    {
+                        'event_id': None, 'etag': None, 'event_hash': None, 'status': 'pending',
+                        'last_error': None, 'synced_at': None, **state,
+                    }
+                    for state in states
+                ])
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_save)
+    
+    def mark_calendar_sync_pending(self, task_ids: List[int] = None) -> int:
+        """Marca como pendientes las tareas indicadas que tienen evento (o todas si no se indican)"""
+        def _mark():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                if task_ids is None:
+                    cursor.execute("UPDATE calendar_sync_state SET status = 'pending' WHERE status != 'pending'")
+                else:
+                    ids = list(task_ids)
+                    cursor.execute(f'''
+                        UPDATE calendar_sync_state SET status = 'pending'
+                        WHERE status != 'pending' AND task_id IN ({', '.join('?' for _ in ids)})
+                    ''', ids)
+                marked = cursor.rowcount
+                conn.commit()
+                return marked
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_mark)
+    
+    def delete_calendar_sync_states(self, task_ids: List[int]):
+        """Deja de sincronizar las tareas indicadas"""
+        if not task_ids:
+            return
+        
+        def _delete():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    DELETE FROM calendar_sync_state WHERE task_id IN ({', '.join('?' for _ in task_ids)})
+                ''', list(task_ids))
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_delete)
+    
+    def get_calendar_sync_token(self, calendar_id: str) -> Optional[str]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT sync_token FROM calendar_sync_tokens WHERE calendar_id = ?', (calendar_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row['sync_token'] if row else None
+    
+    def set_calendar_sync_token(self, calendar_id: str, sync_token: Optional[str]):
+        """Guarda el syncToken de un calendario (None fuerza una lectura completa la próxima vez)"""
+        def _set():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO calendar_sync_tokens (calendar_id, sync_token) VALUES (?, ?)
+                    ON CONFLICT(calendar_id) DO UPDATE SET
+                        sync_token = excluded.sync_token,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (calendar_id, sync_token))
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_set)
+    
+    # ========== CACHÉ DE TRANSCRIPCIONES ==========
+    
+    def get_cached_transcript(self, file_unique_id: str, backend: str,
+                              model: str, language: str) -> Optional[str]:
+        """Obtiene una transcripción cacheada (si no ha expirado) y actualiza su uso (LRU)"""
+        def _get():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT transcript FROM transcript_cache
+                    WHERE file_unique_id = ? AND backend = ? AND model = ? AND language = ?
+                      AND created_at >= datetime('now', ?)
+                ''', (file_unique_id, backend, model, language,
+                      f'-{config.TRANSCRIPT_CACHE_TTL_DAYS} days'))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                
+                cursor.execute('''
+                    UPDATE transcript_cache
+                    SET hit_count = hit_count + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE file_unique_id = ? AND backend = ? AND model = ? AND language = ?
+                ''', (file_unique_id, backend, model, language))
+                conn.commit()
+                return row['transcript']
+            finally:
+                if conn:
+                    conn.close()
+        
+        transcript = self._retry_on_locked(_get)
+        with self._stats_lock:
+            if transcript is None:
+                self._transcript_cache_misses += 1
+            else:
+                self._transcript_cache_hits += 1
+        return transcript
+    
+    def save_cached_transcript(self, file_unique_id: str, backend: str, model: str,
+                               language: str, transcript: str):
+        """Guarda una transcripción en caché y aplica la expulsión por TTL y LRU"""
+        def _save():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO transcript_cache
+                        (file_unique_id, backend, model, language, transcript)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (file_unique_id, backend, model, language, transcript))
+                self._evict_transcript_cache(cursor)
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        self._retry_on_locked(_save)
+    
+    def _evict_transcript_cache(self, cursor):
+        """Elimina entradas expiradas y las menos usadas recientemente por encima del máximo"""
+        cursor.execute('''
+            DELETE FROM transcript_cache WHERE created_at < datetime('now', ?)
+        ''', (f'-{config.TRANSCRIPT_CACHE_TTL_DAYS} days',))
+        cursor.execute('''
+            DELETE FROM transcript_cache WHERE rowid IN (
+                SELECT rowid FROM transcript_cache
+                ORDER BY last_used_at DESC, rowid DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (config.TRANSCRIPT_CACHE_MAX_ENTRIES,))
+    
+    def get_transcript_cache_stats(self) -> Dict:
+        """Obtiene métricas de la caché de transcripciones"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM transcript_cache')
+        entries, total_hits = cursor.fetchone()
+        conn.close()
+        
+        with self._stats_lock:
+            hits = self._transcript_cache_hits
+            misses = self._transcript_cache_misses
+        lookups = hits + misses
+        
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'total_hits': total_hits,
+        }
+    
+    
+    # ========== ESTADO DE CONVERSACIÓN ==========
+    
+    def get_conversation_state(self, state_key: str) -> Optional[bytes]:
+        """Obtiene un estado de conversación serializado (None si no existe o expiró)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT value FROM conversation_states WHERE state_key = ? AND expires_at > ?',
+            (state_key, time.time())
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row['value'] if row else None
+    
+    def set_conversation_state(self, state_key: str, value: bytes, ttl_seconds: int):
+        """Guarda un estado de conversación serializado con expiración"""
+        def _set():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO conversation_states (state_key, value, expires_at)
+                    VALUES (?, ?, ?)
+                ''', (state_key, sqlite3.Binary(value), time.time() + ttl_seconds))
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        self._retry_on_locked(_set)
+    
+    def delete_conversation_state(self, state_key: str) -> bool:
+        """Elimina un estado de conversación"""
+        def _delete():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM conversation_states WHERE state_key = ?', (state_key,))
+                conn.commit()
+                return cursor.rowcount > 0
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_delete)
+    
+    def purge_expired_conversation_states(self) -> int:
+        """Elimina los estados de conversación expirados"""
+        def _purge():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM conversation_states WHERE expires_at <= ?', (time.time(),))
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_purge)
+    
+    # ========== COLA DE TRABAJOS ==========
+    
+    def enqueue_job(self, job_type: str, payload: Dict = None, queue: str = 'default',
+                    priority: int = 100, idempotency_key: str = None,
+                    max_attempts: int = 5, delay_seconds: float = 0) -> int:
+        """
+        Encola un trabajo. Si ya existe uno con la misma idempotency_key,
+        devuelve su ID en lugar de crear otro.
+        """
+        def _enqueue():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO jobs
+                        (queue, job_type, payload, priority, idempotency_key, max_attempts, run_at)
+                    VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))
+                ''', (queue, job_type, json.dumps(payload or {}), priority, idempotency_key,
+                      max_attempts, f'+{delay_seconds} seconds'))
+                if cursor.rowcount:
+                    job_id = cursor.lastrowid
+                else:
+                    cursor.execute('SELECT id FROM jobs WHERE idempotency_key = ?', (idempotency_key,))
+                    job_id = cursor.fetchone()['id']
+                conn.commit()
+                return job_id
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_enqueue)
+    
+    def claim_job(self, queue: str, worker_id: str, visibility_timeout: int) -> Optional[Dict]:
+        """
+        Reserva el siguiente trabajo disponible de una cola (por prioridad y run_at).
+        
+        Los trabajos 'running' cuyo locked_until ha vencido se consideran abandonados
+        (worker caído o reinicio) y vuelven a estar disponibles.
+        """
+        def _claim():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                # BEGIN IMMEDIATE: evita que dos workers reserven el mismo trabajo
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    SELECT id FROM jobs
+                    WHERE queue = ? AND status IN ('pending', 'running')
+                      AND ((status = 'pending' AND run_at <= CURRENT_TIMESTAMP)
+                           OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP))
+                    ORDER BY priority, run_at, id
+                    LIMIT 1
+                ''', (queue,))
+                row = cursor.fetchone()
+                if not row:
+                    conn.rollback()
+                    return None
+                
+                cursor.execute('''
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                        locked_until = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (worker_id, f'+{visibility_timeout} seconds', row['id']))
+                cursor.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],))
+                job = self._job_row_to_dict(cursor.fetchone())
+                conn.commit()
+                return job
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_claim)
+    
+    def complete_job(self, job_id: int, result: Dict = None):
+        """Marca un trabajo como terminado correctamente"""
+        def _complete():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE jobs
+                    SET status = 'done', result = ?, locked_until = NULL,
+                        updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (json.dumps(result) if result is not None else None, job_id))
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        self._retry_on_locked(_complete)
+    
+    def set_job_progress(self, job_id: int, progress: Dict):
+        """Guarda el progreso de un trabajo en curso (para consultarlo desde cualquier worker)"""
+        def _set():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute(
+                    'UPDATE jobs SET progress = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    (json.dumps(progress), job_id)
+                )
+                conn.commit()
+            finally:
+                if conn:
+                    conn.close()
+        
+        self._retry_on_locked(_set)
+    
+    def fail_job(self, job_id: int, error: str, retry_delay: float = None) -> str:
+        """
+        Registra el fallo de un trabajo. Si quedan intentos y se indica retry_delay,
+        se reprograma; si no, queda en estado 'failed'.
+        
+        Returns:
+            Nuevo estado del trabajo ('pending' o 'failed')
+        """
+        def _fail():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return 'failed'
+                
+                if retry_delay is not None and row['attempts'] < row['max_attempts']:
+                    cursor.execute('''
+                        UPDATE jobs
+                        SET status = 'pending', last_error = ?, locked_until = NULL,
+                            run_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (error, f'+{retry_delay} seconds', job_id))
+                    status = 'pending'
+                else:
+                    cursor.execute('''
+                        UPDATE jobs
+                        SET status = 'failed', last_error = ?, locked_until = NULL,
+                            updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (error, job_id))
+                    status = 'failed'
+                conn.commit()
+                return status
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_fail)
+    
+    def retry_job(self, job_id: int) -> bool:
+        """Vuelve a poner en cola un trabajo fallido (desde el panel de administración)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE jobs
+            SET status = 'pending', attempts = 0, run_at = CURRENT_TIMESTAMP,
+                locked_until = NULL, finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'failed'
+        ''', (job_id,))
+        conn.commit()
+        success = cursor.rowcount > 0
+        conn.close()
+        return success
+    
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Obtiene un trabajo por ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return self._job_row_to_dict(row) if row else None
+    
+    def get_jobs(self, status: Optional[str] = None, queue: Optional[str] = None,
+                 limit: int = 100) -> List[Dict]:
+        """Obtiene trabajos (más recientes primero) con filtros opcionales"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        query = 'SELECT * FROM jobs WHERE 1=1'
+        params = []
+        
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        
+        if queue:
+            query += ' AND queue = ?'
+            params.append(queue)
+        
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [self._job_row_to_dict(row) for row in rows]
+    
+    def get_job_stats(self) -> Dict:
+        """Obtiene el número de trabajos por cola y estado"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT queue, status, COUNT(*) AS total FROM jobs GROUP BY queue, status')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        stats = {}
+        for row in rows:
+            stats.setdefault(row['queue'], {})[row['status']] = row['total']
+        return stats
+    
+    def purge_finished_jobs(self, days: int) -> int:
+        """Elimina trabajos terminados (done) con más de N días"""
+        def _purge():
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM jobs WHERE status = 'done' AND finished_at < datetime('now', ?)
+                ''', (f'-{days} days',))
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            finally:
+                if conn:
+                    conn.close()
+        
+        return self._retry_on_locked(_purge)
+    
+    def _job_row_to_dict(self, row) -> Dict:
+        """Convierte una fila de jobs a dict, decodificando payload, result y progress"""
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job.get('payload') else {}
+        job['result'] = json.loads(job['result']) if job.get('result') else None
+        job['progress'] = json.loads(job['progress']) if job.get('progress') else None
+        return job
 
 
 # Instancia global
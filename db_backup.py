@@ -0,0 +1,474 @@
+"""Copias de seguridad, exportación e importación de la base de datos SQLite"""
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List
+import calendar_sync
+import config
+import database
+from job_queue import job_handler, set_progress, PermanentJobError
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard es opcional: sin él solo se ofrece gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de los bloques que se leen del snapshot al comprimir
+CHUNK_SIZE = 64 * 1024
+
+# Formatos de descarga: formato -> (extensión, mimetype)
+FORMATS = {
+    'gzip': ('.db.gz', 'application/gzip'),
+    'zstd': ('.db.zst', 'application/zstd'),
+    'raw': ('.db', 'application/x-sqlite3'),
+}
+
+SNAPSHOT_PREFIX = 'app_db_'
+
+# Extensiones aceptadas al importar (sin comprimir o como las genera /descargar_db)
+IMPORT_EXTENSIONS = ('.db', '.db.gz', '.db.zst')
+
+# Tablas con los datos de la aplicación, en orden de dependencias. Las tablas
+# operativas (jobs, conversation_states, transcript_cache) no se importan: la
+# cola de trabajos, incluido el propio trabajo de importación, sigue intacta
+DATA_TABLES = (
+    'clients', 'categories', 'web_users', 'user_categories',
+    'tasks', 'task_images', 'task_ampliaciones_history',
+    *database.ARCHIVE_TABLES.values(),
+)
+
+# Modo merge: columnas que identifican una fila ya existente (la misma fila en las dos bases
+# de datos) y claves ajenas que hay que traducir a los ids locales (columna -> tabla referenciada)
+MERGE_KEYS = {
+    'clients': ('name',),
+    'categories': ('name',),
+    'web_users': ('username',),
+    'user_categories': ('user_id', 'category_name'),
+    'tasks': ('user_id', 'created_at', 'title'),
+    'task_images': ('task_id', 'file_id'),
+    'task_ampliaciones_history': ('task_id', 'created_at', 'ampliacion_text'),
+}
+MERGE_REFERENCES = {
+    'user_categories': {'user_id': 'web_users'},
+    'tasks': {'client_id': 'clients'},
+    'task_images': {'task_id': 'tasks'},
+    'task_ampliaciones_history': {'task_id': 'tasks'},
+}
+
+# Estado de la sincronización con Google Calendar, por id de tarea: tras reemplazar
+# las tareas ya no vale (init_db lo rehace desde los google_event_id importados)
+CALENDAR_SYNC_TABLES = ('calendar_sync_state', 'calendar_sync_tokens')
+
+# Columnas imprescindibles en una base de datos importada
+REQUIRED_COLUMNS = {
+    'tasks': {'id', 'user_id', 'title', 'status'},
+    'clients': {'id', 'name'},
+}
+
+
+class ImportValidationError(ValueError):
+    """La base de datos subida no se puede importar (corrupta, de otra app o de una versión más nueva)"""
+    pass
+
+
+def available_formats() -> List[str]:
+    """Formatos de descarga disponibles (zstd solo si está instalado zstandard)"""
+    return [fmt for fmt in FORMATS if fmt != 'zstd' or zstandard is not None]
+
+
+def create_snapshot(dest_path: str = None, source_path: str = None,
+                    pages: int = None, sleep: float = None) -> str:
+    """
+    Copia consistente de la base de datos con sqlite3.Connection.backup.
+    
+    La copia avanza por bloques de 'pages' páginas y suelta el lock entre
+    bloques, así los escritores no se quedan esperando a que termine; si
+    alguien escribe durante la copia, SQLite la reinicia y el resultado es
+    siempre una foto coherente (incluidas las páginas que aún están en el WAL).
+    
+    Returns:
+        Ruta del snapshot (un fichero temporal en BACKUP_DIR si no se indica dest_path)
+    """
+    source_path = source_path or config.SQLITE_PATH
+    pages = pages or config.BACKUP_PAGES_PER_STEP
+    sleep = config.BACKUP_STEP_SLEEP_SECONDS if sleep is None else sleep
+    
+    if dest_path is None:
+        Path(config.BACKUP_DIR).mkdir(parents=True, exist_ok=True)
+        fd, dest_path = tempfile.mkstemp(prefix='snapshot_', suffix='.db', dir=config.BACKUP_DIR)
+        os.close(fd)
+    
+    started = time.monotonic()
+    source = sqlite3.connect(source_path, timeout=30.0)
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=pages, sleep=sleep)
+    except Exception:
+        dest.close()
+        os.unlink(dest_path)
+        raise
+    finally:
+        source.close()
+    dest.close()
+    
+    logger.info(f"[BACKUP] Snapshot creado en {time.monotonic() - started:.2f}s: {dest_path}")
+    return dest_path
+
+
+def _compressor(fmt: str):
+    if fmt == 'gzip':
+        # wbits=31: flujo con cabecera y CRC de gzip
+        return zlib.compressobj(config.BACKUP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    if fmt == 'zstd':
+        if zstandard is None:
+            raise ValueError("Formato zstd no disponible (falta el paquete zstandard)")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Formato de compresión no soportado: {fmt}")
+
+
+def iter_compressed(path: str, fmt: str = 'gzip', delete: bool = False) -> Iterator[bytes]:
+    """
+    Lee un fichero por bloques y lo devuelve comprimido, sin cargarlo entero en memoria.
+    
+    Args:
+        delete: borrar el fichero al terminar (o si se corta la descarga)
+    """
+    compressor = _compressor(fmt) if fmt != 'raw' else None
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = compressor.compress(chunk) if compressor else chunk
+                if data:
+                    yield data
+        if compressor:
+            tail = compressor.flush()
+            if tail:
+                yield tail
+    finally:
+        if delete:
+            discard(path)
+
+
+def write_compressed(source_path: str, dest_path: str, fmt: str = 'gzip'):
+    """Escribe una copia comprimida de source_path (vía fichero .tmp + rename)"""
+    tmp_path = f"{dest_path}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for data in iter_compressed(source_path, fmt):
+            out.write(data)
+    os.replace(tmp_path, dest_path)
+
+
+def list_snapshots() -> List[Path]:
+    """Snapshots rotativos en BACKUP_DIR, del más reciente al más antiguo"""
+    backup_dir = Path(config.BACKUP_DIR)
+    if not backup_dir.exists():
+        return []
+    snapshots = [p for p in backup_dir.glob(f'{SNAPSHOT_PREFIX}*.db.*') if not p.name.endswith('.tmp')]
+    return sorted(snapshots, reverse=True)
+
+
+def rotate_snapshots(keep: int = None) -> int:
+    """Borra los snapshots más antiguos dejando los 'keep' más recientes"""
+    keep = config.BACKUP_KEEP if keep is None else keep
+    removed = 0
+    for path in list_snapshots()[keep:]:
+        path.unlink()
+        removed += 1
+    return removed
+
+
+def _save_snapshot(prefix: str, fmt: str = 'gzip') -> Path:
+    """Snapshot comprimido en BACKUP_DIR con nombre '<prefix><timestamp>.db.gz'"""
+    snapshot = create_snapshot()
+    try:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        dest = Path(config.BACKUP_DIR) / f"{prefix}{timestamp}{FORMATS[fmt][0]}"
+        write_compressed(snapshot, str(dest), fmt)
+    finally:
+        os.unlink(snapshot)
+    return dest
+
+
+def take_rotating_snapshot(fmt: str = 'gzip') -> Path:
+    """Crea un snapshot comprimido en BACKUP_DIR y rota los antiguos"""
+    dest = _save_snapshot(SNAPSHOT_PREFIX, fmt)
+    removed = rotate_snapshots()
+    logger.info(f"[BACKUP] Snapshot guardado: {dest} ({removed} antiguos eliminados)")
+    return dest
+
+
+@job_handler('db.snapshot', queue='default', priority=200, max_attempts=3,
+             every_seconds=config.BACKUP_INTERVAL_HOURS * 3600)
+def snapshot_job(payload: dict) -> dict:
+    """Trabajo periódico: snapshot comprimido de la base de datos con rotación"""
+    if config.BACKUP_KEEP <= 0:
+        return {'path': None}
+    return {'path': str(take_rotating_snapshot())}
+
+
+# ========== IMPORTACIÓN ==========
+
+def save_upload(stream: BinaryIO, filename: str) -> str:
+    """
+    Guarda un archivo subido en un temporal de BACKUP_DIR, descomprimiéndolo
+    por bloques si viene como .db.gz o .db.zst.
+    
+    Returns:
+        Ruta del temporal (la borra import_database al terminar)
+    """
+    if not filename.endswith(IMPORT_EXTENSIONS):
+        raise ImportValidationError(f"Extensión no soportada (se aceptan {', '.join(IMPORT_EXTENSIONS)})")
+    if filename.endswith('.zst') and zstandard is None:
+        raise ImportValidationError("Formato zstd no disponible (falta el paquete zstandard)")
+    
+    Path(config.BACKUP_DIR).mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='import_', suffix='.db', dir=config.BACKUP_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if filename.endswith('.gz'):
+                source = gzip.GzipFile(fileobj=stream)
+            elif filename.endswith('.zst'):
+                source = zstandard.ZstdDecompressor().stream_reader(stream)
+            else:
+                source = stream
+            shutil.copyfileobj(source, out, CHUNK_SIZE)
+    except (OSError, EOFError, zlib.error) as e:
+        os.unlink(path)
+        raise ImportValidationError(f"No se pudo leer el archivo subido: {e}")
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def discard(path: str):
+    """Borra un fichero temporal (snapshot, subida) si aún existe"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def validate_database(path: str) -> Dict:
+    """
+    Comprueba una base de datos antes de importarla: integridad, versión del
+    esquema (no más nueva que la de esta app) y tablas imprescindibles.
+    
+    Returns:
+        {'schema_version': ..., 'tasks': número de tareas}
+    """
+    try:
+        conn = sqlite3.connect(path)
+    except sqlite3.Error as e:
+        raise ImportValidationError(f"No se pudo abrir la base de datos: {e}")
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        if problems != ['ok']:
+            raise ImportValidationError(f"La base de datos está dañada: {'; '.join(problems[:5])}")
+        
+        schema_version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if schema_version > database.SCHEMA_VERSION:
+            raise ImportValidationError(
+                f"La base de datos es de una versión más nueva de la aplicación "
+                f"(esquema {schema_version}, esta versión usa {database.SCHEMA_VERSION})"
+            )
+        
+        for table, required in REQUIRED_COLUMNS.items():
+            columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if not columns:
+                raise ImportValidationError(f"No es una base de datos de esta aplicación: falta la tabla {table}")
+            missing = required - columns
+            if missing:
+                raise ImportValidationError(
+                    f"No es una base de datos de esta aplicación: a la tabla {table} "
+                    f"le faltan {', '.join(sorted(missing))}"
+                )
+        
+        tasks = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise ImportValidationError(f"El archivo no es una base de datos SQLite válida: {e}")
+    finally:
+        conn.close()
+    return {'schema_version': schema_version, 'tasks': tasks}
+
+
+def _next_id(cursor, table: str) -> int:
+    """
+    Reserva un id de la secuencia AUTOINCREMENT de 'table' (y de su tabla de
+    archivo, que comparte los ids) para una fila que se inserta en el archivo.
+    """
+    archive = database.ARCHIVE_TABLES[table]
+    cursor.execute(f'''
+        SELECT MAX(
+            COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name = ?), 0),
+            COALESCE((SELECT MAX(id) FROM main.{table}), 0),
+            COALESCE((SELECT MAX(id) FROM main.{archive}), 0)
+        ) + 1
+    ''', (table,))
+    new_id = cursor.fetchone()[0]
+    cursor.execute('UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?', (new_id, table))
+    if cursor.rowcount == 0:
+        cursor.execute('INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)', (table, new_id))
+    return new_id
+
+
+def _merge_table(cursor, table: str, columns: List[str], id_maps: Dict[str, Dict[int, int]]) -> int:
+    """
+    Añade las filas importadas de 'table' que no existen ya, con ids nuevos.
+    
+    Las claves ajenas se traducen con id_maps (id importado -> id local) de las
+    tablas ya copiadas, y se apunta el id local de cada fila para las siguientes.
+    Las filas cuyo padre no se ha podido importar se descartan.
+    
+    Returns:
+        Número de filas añadidas
+    """
+    archived = table in database.ARCHIVE_TABLES.values()
+    base = next((active for active, archive in database.ARCHIVE_TABLES.items() if archive == table), table)
+    id_map = id_maps.setdefault(base, {})
+    references = MERGE_REFERENCES.get(base, {})
+    key = [column for column in MERGE_KEYS[base] if column in columns]
+    # Una fila ya archivada en local también cuenta como existente
+    existing_source = f'main.{base}_all' if base in database.ARCHIVE_TABLES else f'main.{table}'
+    
+    cursor.execute(f"SELECT {', '.join(columns)} FROM imported.{table}")
+    rows = cursor.fetchall()
+    added = 0
+    for row in rows:
+        values = dict(zip(columns, row))
+        orphan = False
+        for column, parent in references.items():
+            if values.get(column) is None:
+                continue
+            values[column] = id_maps.get(parent, {}).get(values[column])
+            # Sin padre: task_id es obligatorio; un client_id perdido se queda en NULL
+            orphan = orphan or (values[column] is None and column == 'task_id')
+        if orphan:
+            continue
+        
+        old_id = values.pop('id', None)
+        cursor.execute(
+            f"SELECT id FROM {existing_source} WHERE {' AND '.join(f'{column} IS ?' for column in key)} LIMIT 1",
+            [values[column] for column in key],
+        )
+        existing = cursor.fetchone()
+        if existing is not None:
+            id_map[old_id] = existing[0]
+            continue
+        
+        if archived:
+            # Las tablas de archivo no tienen AUTOINCREMENT: el id sale de la secuencia de la activa
+            values['id'] = _next_id(cursor, base)
+        cursor.execute(
+            f"INSERT INTO main.{table} ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+            list(values.values()),
+        )
+        id_map[old_id] = values['id'] if archived else cursor.lastrowid
+        added += 1
+    return added
+
+
+def _copy_tables(path: str, mode: str) -> Dict[str, int]:
+    """
+    Copia las tablas de datos de la base de datos importada a la activa en una
+    sola transacción: o se importa todo o nada, y las lecturas concurrentes (WAL)
+    siguen viendo los datos anteriores hasta el commit.
+    
+    mode='replace' vacía cada tabla antes de copiarla (y el estado de la
+    sincronización con Google Calendar); mode='merge' solo añade
+    las filas que no existen ya (según MERGE_KEYS), con ids nuevos y las claves
+    ajenas traducidas, para que las imágenes o el historial de una tarea
+    importada no acaben colgando de una tarea local con el mismo id.
+    """
+    db = database.db
+    conn = db.get_connection()
+    try:
+        conn.execute('ATTACH DATABASE ? AS imported', (path,))
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        counts = {}
+        id_maps = {}
+        if mode == 'replace':
+            # Con ids de tarea reciclados, el estado anterior parchearía o borraría eventos
+            # de otras tareas: se vacía y la sincronización empieza desde el registro actual
+            for table in CALENDAR_SYNC_TABLES:
+                cursor.execute(f'DELETE FROM main.{table}')
+            cursor.execute('DELETE FROM main.change_consumers WHERE name = ?', (calendar_sync.CHANGES_CONSUMER,))
+        for table in DATA_TABLES:
+            cursor.execute(f'PRAGMA imported.table_info({table})')
+            imported_columns = {row[1] for row in cursor.fetchall()}
+            if mode == 'replace':
+                cursor.execute(f'DELETE FROM main.{table}')
+            if not imported_columns:
+                continue
+            # Columnas comunes: las que falten en una BD antigua las rellenan las migraciones
+            columns = [c for c in db._table_columns(cursor, table) if c in imported_columns]
+            if mode == 'merge':
+                counts[table] = _merge_table(cursor, table, columns, id_maps)
+                continue
+            column_list = ', '.join(columns)
+            cursor.execute(f'INSERT INTO main.{table} ({column_list}) SELECT {column_list} FROM imported.{table}')
+            counts[table] = cursor.rowcount
+        conn.commit()
+        conn.execute('DETACH DATABASE imported')
+        return counts
+    finally:
+        conn.close()
+
+
+def import_database(path: str, mode: str = 'replace') -> Dict:
+    """
+    Importa la base de datos de 'path' (un temporal de save_upload) y lo borra.
+    
+    Pasos: validación, snapshot de la BD actual en BACKUP_DIR, copia de las
+    tablas en una transacción y migraciones (init_db) sobre lo importado.
+    """
+    if mode not in ('replace', 'merge'):
+        raise ValueError(f"Modo de importación no válido: {mode}")
+    
+    try:
+        set_progress(stage='validando', percent=0)
+        info = validate_database(path)
+        
+        set_progress(stage='respaldo', percent=25)
+        backup_path = _save_snapshot('preimport_')
+        logger.info(f"[BACKUP] Respaldo antes de importar: {backup_path}")
+        
+        set_progress(stage='importando', percent=50)
+        counts = _copy_tables(path, mode)
+        
+        set_progress(stage='migraciones', percent=90)
+        database.db.init_db()
+    finally:
+        discard(path)
+    
+    logger.info(f"[BACKUP] Base de datos importada ({mode}): {counts}")
+    return {
+        'mode': mode,
+        'schema_version': info['schema_version'],
+        'rows': counts,
+        'backup_path': str(backup_path),
+    }
+
+
+@job_handler('db.import', queue='default', priority=20, max_attempts=1,
+             on_failure=lambda payload, error: discard(payload['path']))
+def import_job(payload: dict) -> dict:
+    """Trabajo de la cola: importa una base de datos subida desde el panel"""
+    try:
+        return import_database(payload['path'], payload.get('mode', 'replace'))
+    except ImportValidationError as e:
+        raise PermanentJobError(str(e))
@@ -0,0 +1,344 @@
+"""
+Replicación incremental de la base de datos al servidor SFTP, con restauración a un punto en el tiempo.
+
+Cada ejecución toma un snapshot consistente (db_backup.create_snapshot), lo
+divide en bloques de páginas y sube solo los bloques que han cambiado desde
+la anterior. En el servidor cada "generación" es un directorio con una base
+completa (secuencia 0) y los deltas posteriores:
+
+    <SFTP_BACKUP_PATH>/<generación>/000000.gz + 000000.json   (base)
+    <SFTP_BACKUP_PATH>/<generación>/000001.gz + 000001.json   (delta)
+    ...
+
+El .gz lleva los bloques cambiados concatenados y el .json (que se sube el
+último) su lista, el tamaño de la base de datos y su sha256. Para restaurar
+se aplica la base y los deltas hasta el instante pedido:
+
+    python db_replication.py list
+    python db_replication.py restore --at "2026-03-02 14:30" --output restaurada.db
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import config
+import db_backup
+from job_queue import job_handler
+from sftp_storage import sftp_storage
+
+logger = logging.getLogger(__name__)
+
+# Estado de la última subida (hash de cada bloque) para calcular el siguiente delta
+STATE_FILENAME = 'replication_state.json'
+
+
+def _state_path() -> Path:
+    return Path(config.BACKUP_DIR) / STATE_FILENAME
+
+
+def _load_state() -> Optional[Dict]:
+    try:
+        with open(_state_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state: Dict):
+    path = _state_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _page_size(path: str) -> int:
+    """Tamaño de página de SQLite según la cabecera del fichero (bytes 16-17; 1 significa 65536)"""
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    size = int.from_bytes(header[16:18], 'big')
+    return 65536 if size == 1 else size
+
+
+def _chunk_hashes(path: str, chunk_size: int) -> List[str]:
+    hashes = []
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hashes.append(hashlib.blake2b(chunk, digest_size=16).hexdigest())
+    return hashes
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(db_backup.CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _makedirs(sftp, path: str):
+    """mkdir -p en el servidor SFTP"""
+    current = ''
+    for part in path.strip('/').split('/'):
+        current = f"{current}/{part}" if current or path.startswith('/') else part
+        try:
+            sftp.mkdir(current)
+        except IOError:
+            # Ya existe
+            pass
+
+
+def _list_generations(sftp, root: str) -> List[str]:
+    try:
+        return sorted(name for name in sftp.listdir(root) if not name.startswith('.'))
+    except IOError:
+        return []
+
+
+def _list_manifests(sftp, generation_dir: str) -> List[Dict]:
+    """Manifiestos completos de una generación, por orden de secuencia"""
+    manifests = []
+    for name in sorted(sftp.listdir(generation_dir)):
+        if not name.endswith('.json'):
+            continue
+        with sftp.open(posixpath.join(generation_dir, name), 'rb') as f:
+            manifests.append(json.loads(f.read()))
+    return manifests
+
+
+def _remove_generation(sftp, generation_dir: str):
+    for name in sftp.listdir(generation_dir):
+        sftp.remove(posixpath.join(generation_dir, name))
+    sftp.rmdir(generation_dir)
+
+
+def _write_delta(snapshot: str, chunk_size: int, changed: List[int], dest_path: str):
+    """Concatena (comprimidos) los bloques cambiados en el orden de 'changed'"""
+    with open(snapshot, 'rb') as source, \
+            gzip.open(dest_path, 'wb', compresslevel=config.BACKUP_COMPRESSION_LEVEL) as out:
+        for index in changed:
+            source.seek(index * chunk_size)
+            out.write(source.read(chunk_size))
+
+
+def replicate(sftp=None, root: str = None, now: datetime = None) -> Dict:
+    """
+    Sube a SFTP los bloques de la base de datos que han cambiado desde la última ejecución.
+    
+    Empieza una generación nueva (base completa) si no hay estado local, si
+    cambia el tamaño de bloque, tras REPLICATION_FULL_EVERY deltas o si ha
+    cambiado más de la mitad de la base de datos.
+    
+    Args:
+        sftp: cliente SFTP (por defecto, la conexión del thread de sftp_storage)
+        root: directorio remoto (por defecto, SFTP_BACKUP_PATH)
+    """
+    sftp = sftp or sftp_storage._get_thread_connection()
+    root = root or sftp_storage.backup_path
+    now = now or datetime.now()
+    
+    snapshot = db_backup.create_snapshot()
+    delta_path = f"{snapshot}.delta.gz"
+    try:
+        chunk_size = _page_size(snapshot) * config.REPLICATION_PAGES_PER_CHUNK
+        hashes = _chunk_hashes(snapshot, chunk_size)
+        state = _load_state()
+        
+        full = (
+            state is None
+            or state.get('root') != root
+            or state.get('chunk_size') != chunk_size
+            or state['seq'] + 1 >= config.REPLICATION_FULL_EVERY
+        )
+        if not full:
+            # Si el servidor ha perdido la generación en curso, los deltas no servirían de nada
+            try:
+                sftp.stat(posixpath.join(root, state['generation'], f"{state['seq']:06d}.json"))
+            except IOError:
+                full = True
+        if not full:
+            previous = state['hashes']
+            changed = [i for i, h in enumerate(hashes) if i >= len(previous) or previous[i] != h]
+            if len(hashes) == len(previous) and not changed:
+                return {'generation': state['generation'], 'seq': state['seq'], 'changed': 0}
+            full = len(changed) * 2 > len(hashes)
+        
+        if full:
+            generation = now.strftime('%Y%m%dT%H%M%S')
+            seq = 0
+            changed = list(range(len(hashes)))
+        else:
+            generation = state['generation']
+            seq = state['seq'] + 1
+        
+        _write_delta(snapshot, chunk_size, changed, delta_path)
+        manifest = {
+            'generation': generation,
+            'seq': seq,
+            'timestamp': now.isoformat(timespec='seconds'),
+            'chunk_size': chunk_size,
+            'size': os.path.getsize(snapshot),
+            'sha256': _file_sha256(snapshot),
+            'changed': changed,
+        }
+        
+        generation_dir = posixpath.join(root, generation)
+        _makedirs(sftp, generation_dir)
+        name = f"{seq:06d}"
+        sftp.put(delta_path, posixpath.join(generation_dir, f"{name}.gz"))
+        # El manifiesto se sube el último (vía .tmp + rename): sin él el delta no cuenta
+        tmp_manifest = posixpath.join(generation_dir, f".{name}.json.tmp")
+        with sftp.open(tmp_manifest, 'wb') as f:
+            f.write(json.dumps(manifest).encode('utf-8'))
+        sftp.posix_rename(tmp_manifest, posixpath.join(generation_dir, f"{name}.json"))
+        uploaded = os.path.getsize(delta_path)
+    finally:
+        for path in (snapshot, delta_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    _save_state({
+        'root': root,
+        'generation': generation,
+        'seq': seq,
+        'chunk_size': chunk_size,
+        'hashes': hashes,
+    })
+    
+    removed = 0
+    if seq == 0:
+        for old in _list_generations(sftp, root)[:-config.REPLICATION_KEEP_GENERATIONS]:
+            _remove_generation(sftp, posixpath.join(root, old))
+            removed += 1
+    
+    logger.info(
+        f"[REPLICATION] {'Base' if seq == 0 else 'Delta'} {generation}/{seq}: "
+        f"{len(changed)}/{len(hashes)} bloques, {uploaded} bytes subidos"
+        + (f", {removed} generaciones antiguas eliminadas" if removed else "")
+    )
+    return {'generation': generation, 'seq': seq, 'changed': len(changed), 'bytes': uploaded}
+
+
+@job_handler('db.replicate', queue='uploads', priority=200, max_attempts=3,
+             every_seconds=config.REPLICATION_INTERVAL_MINUTES * 60)
+def replicate_job(payload: dict) -> dict:
+    """Trabajo periódico: sube a SFTP los cambios de la base de datos"""
+    if not sftp_storage.enabled or config.REPLICATION_INTERVAL_MINUTES <= 0:
+        return {'changed': 0, 'skipped': True}
+    try:
+        return replicate()
+    except Exception:
+        # Conexión en estado desconocido: se descarta y el reintento abre otra
+        sftp_storage._close_thread_connection()
+        raise
+
+
+# ========== RESTAURACIÓN ==========
+
+def list_restore_points(sftp, root: str) -> List[Dict]:
+    """Puntos de restauración disponibles (manifiestos), del más antiguo al más reciente"""
+    points = []
+    for generation in _list_generations(sftp, root):
+        points.extend(_list_manifests(sftp, posixpath.join(root, generation)))
+    return points
+
+
+def restore(sftp, root: str, output_path: str, at: datetime = None) -> Dict:
+    """
+    Reconstruye en output_path la base de datos tal como estaba en el último
+    punto de restauración anterior o igual a 'at' (el más reciente si no se indica).
+    
+    Returns:
+        El manifiesto del punto restaurado
+    """
+    points = list_restore_points(sftp, root)
+    if at is not None:
+        points = [p for p in points if datetime.fromisoformat(p['timestamp']) <= at]
+    if not points:
+        raise ValueError("No hay ningún punto de restauración anterior a la fecha indicada")
+    target = points[-1]
+    chain = [p for p in points if p['generation'] == target['generation'] and p['seq'] <= target['seq']]
+    if [p['seq'] for p in chain] != list(range(target['seq'] + 1)):
+        raise ValueError(f"Faltan deltas en la generación {target['generation']}")
+    
+    generation_dir = posixpath.join(root, target['generation'])
+    tmp_path = f"{output_path}.tmp"
+    fd, download_path = tempfile.mkstemp(suffix='.gz')
+    os.close(fd)
+    try:
+        with open(tmp_path, 'wb') as out:
+            for manifest in chain:
+                sftp.get(posixpath.join(generation_dir, f"{manifest['seq']:06d}.gz"), download_path)
+                chunk_size = manifest['chunk_size']
+                with gzip.open(download_path, 'rb') as delta:
+                    for index in manifest['changed']:
+                        offset = index * chunk_size
+                        out.seek(offset)
+                        out.write(delta.read(min(chunk_size, manifest['size'] - offset)))
+                out.truncate(manifest['size'])
+        
+        if _file_sha256(tmp_path) != target['sha256']:
+            raise ValueError("La base de datos restaurada no coincide con el hash del manifiesto")
+        os.replace(tmp_path, output_path)
+    finally:
+        for path in (tmp_path, download_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    logger.info(f"[REPLICATION] Restaurado {target['generation']}/{target['seq']} ({target['timestamp']}) en {output_path}")
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Réplica incremental de la base de datos en SFTP")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="Lista los puntos de restauración")
+    subparsers.add_parser('push', help="Sube ahora los cambios pendientes")
+    restore_parser = subparsers.add_parser('restore', help="Restaura la base de datos a un punto en el tiempo")
+    restore_parser.add_argument('--at', help="Fecha y hora (YYYY-MM-DD HH:MM[:SS]); por defecto, la más reciente")
+    restore_parser.add_argument('--output', required=True, help="Fichero donde escribir la base de datos restaurada")
+    args = parser.parse_args(argv)
+    
+    if not sftp_storage.enabled:
+        print("❌ ERROR: SFTP no está configurado (SFTP_HOST, SFTP_USERNAME, SFTP_PASSWORD)")
+        return 1
+    
+    sftp, transport = sftp_storage._get_connection()
+    try:
+        root = sftp_storage.backup_path
+        if args.command == 'list':
+            for point in list_restore_points(sftp, root):
+                kind = 'base ' if point['seq'] == 0 else 'delta'
+                print(f"{point['timestamp']}  {kind}  {point['generation']}/{point['seq']}  "
+                      f"{len(point['changed'])} bloques")
+        elif args.command == 'push':
+            print(replicate(sftp, root))
+        else:
+            at = datetime.fromisoformat(args.at) if args.at else None
+            point = restore(sftp, root, args.output, at)
+            print(f"✅ Base de datos del {point['timestamp']} restaurada en {args.output}")
+            print("   Se puede cargar desde el panel (Base de datos → Importar)")
+    finally:
+        sftp.close()
+        transport.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""Configuración de gunicorn (se carga automáticamente desde el directorio de la app)"""
+import os
+
+# Workers con hilos: cada panel abierto mantiene una conexión SSE (/admin/events)
+# que ocupa un hilo; con workers síncronos bloquearía el worker entero
+# (config.LIVE_EVENTS_MAX_STREAMS limita cuántos hilos pueden ocupar)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+
+def post_worker_init(worker):
+    """
+    Arranca los servicios en segundo plano en cuanto el worker ha cargado la app.
+    
+    El primer worker que consigue el lock pasa a ser el líder: inicializa el bot
+    de Telegram y la cola de trabajos antes del primer webhook. El resto de workers
+    solo reenvían los updates al líder por el socket Unix.
+    """
+    import app
+    app.start_background_services()
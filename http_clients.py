@@ -0,0 +1,272 @@
+"""Registro de clientes HTTP compartidos por todo el proceso (pool + keep-alive)"""
+import asyncio
+import atexit
+import logging
+import threading
+import config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_requests_session = None
+_openai_client = None
+_async_openai_clients = {}
+_calendar_service = None
+_calendar_credentials = None
+# httplib2.Http no es thread-safe: cada thread (executor del bot, workers) usa el suyo
+_calendar_http = threading.local()
+
+# Códigos HTTP que se reintentan automáticamente (solo en peticiones idempotentes)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _default_timeout():
+    """Timeout (conexión, lectura) por defecto para requests"""
+    return (config.HTTP_CONNECT_TIMEOUT_SECONDS, config.HTTP_TIMEOUT_SECONDS)
+
+
+def get_requests_session():
+    """
+    Sesión de requests compartida con pool de conexiones, keep-alive,
+    reintentos con backoff y timeout por defecto.
+    """
+    global _requests_session
+    if _requests_session is not None:
+        return _requests_session
+    
+    with _lock:
+        if _requests_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            
+            class _TimeoutSession(requests.Session):
+                """Session que aplica un timeout por defecto si no se indica otro"""
+                
+                def request(self, method, url, **kwargs):
+                    kwargs.setdefault('timeout', _default_timeout())
+                    return super().request(method, url, **kwargs)
+            
+            retry = Retry(
+                total=config.HTTP_MAX_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=config.HTTP_POOL_SIZE,
+                pool_maxsize=config.HTTP_POOL_SIZE,
+                max_retries=retry
+            )
+            session = _TimeoutSession()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _requests_session = session
+            logger.info("[HTTP] Sesión de requests compartida creada")
+    
+    return _requests_session
+
+
+def _openai_limits():
+    """Límites del pool httpx usado por los clientes de OpenAI"""
+    import httpx
+    return httpx.Limits(
+        max_connections=config.HTTP_POOL_SIZE,
+        max_keepalive_connections=config.HTTP_POOL_SIZE,
+        keepalive_expiry=config.HTTP_KEEPALIVE_SECONDS
+    )
+
+
+def _openai_timeout():
+    """Timeout de OpenAI (la transcripción puede tardar más que una petición normal)"""
+    from openai import Timeout
+    return Timeout(config.OPENAI_TIMEOUT_SECONDS, connect=config.HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+def get_openai_client():
+    """Cliente síncrono de OpenAI compartido (reutiliza conexiones TLS entre llamadas)"""
+    global _openai_client
+    if _openai_client is not None:
+        return _openai_client
+    
+    if not config.OPENAI_ENABLED:
+        raise RuntimeError("OpenAI no está configurado. Configura OPENAI_API_KEY en tu archivo .env")
+    
+    with _lock:
+        if _openai_client is None:
+            from openai import OpenAI, DefaultHttpxClient
+            _openai_client = OpenAI(
+                api_key=config.OPENAI_API_KEY,
+                max_retries=config.HTTP_MAX_RETRIES,
+                timeout=_openai_timeout(),
+                http_client=DefaultHttpxClient(limits=_openai_limits(), timeout=_openai_timeout())
+            )
+            logger.info("[HTTP] Cliente OpenAI compartido creado")
+    
+    return _openai_client
+
+
+def get_async_openai_client():
+    """
+    Cliente asíncrono de OpenAI para el event loop del bot.
+    
+    Las conexiones de httpx.AsyncClient pertenecen al loop que las creó,
+    así que se mantiene un cliente por event loop.
+    """
+    if not config.OPENAI_ENABLED:
+        raise RuntimeError("OpenAI no está configurado. Configura OPENAI_API_KEY en tu archivo .env")
+    
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(id(loop))
+    if client is not None and client[0] is loop:
+        return client[1]
+    
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    async_client = AsyncOpenAI(
+        api_key=config.OPENAI_API_KEY,
+        max_retries=config.HTTP_MAX_RETRIES,
+        timeout=_openai_timeout(),
+        http_client=DefaultAsyncHttpxClient(limits=_openai_limits(), timeout=_openai_timeout())
+    )
+    with _lock:
+        _async_openai_clients[id(loop)] = (loop, async_client)
+    logger.info("[HTTP] Cliente AsyncOpenAI compartido creado para el event loop del bot")
+    return async_client
+
+
+def get_calendar_credentials():
+    """
+    Credenciales OAuth de Google compartidas por todo el proceso.
+    
+    - Un solo refresco a la vez: los threads que llegan con el token caducado
+      esperan al que ya lo está pidiendo en lugar de pedir otro.
+    - Refresco anticipado: si al hacer una petición quedan menos de
+      GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS, la petición usa el token actual y
+      el nuevo se pide en segundo plano, así ninguna llamada espera al refresco.
+    """
+    global _calendar_credentials
+    if _calendar_credentials is not None:
+        return _calendar_credentials
+    
+    with _lock:
+        if _calendar_credentials is None:
+            from datetime import datetime, timedelta, timezone
+            from google.auth.transport.requests import Request
+            from google.oauth2.credentials import Credentials
+            
+            class _SharedCredentials(Credentials):
+                """Credentials con refresco serializado y anticipado"""
+                
+                _refresh_lock = threading.Lock()
+                _refresh_thread = None
+                
+                def _expires_soon(self) -> bool:
+                    if self.expiry is None:
+                        return False
+                    # google-auth guarda expiry como UTC sin zona
+                    now = datetime.now(timezone.utc).replace(tzinfo=None)
+                    return now >= self.expiry - timedelta(seconds=config.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS)
+                
+                def refresh(self, request):
+                    with self._refresh_lock:
+                        # Otro thread puede haberlo refrescado mientras se esperaba el lock
+                        if self.valid and not self._expires_soon():
+                            return
+                        super().refresh(request)
+                        logger.info(f"[HTTP] Token de Google renovado (caduca {self.expiry})")
+                
+                def refresh_in_background(self):
+                    """Pide un token nuevo en un thread aparte (si no se está pidiendo ya)"""
+                    if self._refresh_lock.locked() or (self._refresh_thread and self._refresh_thread.is_alive()):
+                        return
+                    
+                    def _refresh():
+                        try:
+                            self.refresh(Request(session=get_requests_session()))
+                        except Exception as e:
+                            # La siguiente petición lo reintentará al caducar
+                            logger.warning(f"[HTTP] No se pudo renovar el token de Google: {e}")
+                    
+                    self._refresh_thread = threading.Thread(target=_refresh, name='google-token-refresh', daemon=True)
+                    self._refresh_thread.start()
+                
+                def before_request(self, request, method, url, headers):
+                    if self.valid and self._expires_soon():
+                        self.refresh_in_background()
+                    super().before_request(request, method, url, headers)
+            
+            _calendar_credentials = _SharedCredentials(
+                token=None,
+                refresh_token=config.GOOGLE_REFRESH_TOKEN,
+                token_uri='https://oauth2.googleapis.com/token',
+                client_id=config.GOOGLE_CLIENT_ID,
+                client_secret=config.GOOGLE_CLIENT_SECRET
+            )
+    
+    return _calendar_credentials
+
+
+def _calendar_thread_http():
+    """Cliente httplib2 autenticado del thread actual (con las credenciales compartidas)"""
+    http = getattr(_calendar_http, 'http', None)
+    if http is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        http = AuthorizedHttp(get_calendar_credentials(), http=httplib2.Http(timeout=config.HTTP_TIMEOUT_SECONDS))
+        _calendar_http.http = http
+    return http
+
+
+def _calendar_request_builder(http, *args, **kwargs):
+    """Las peticiones del servicio compartido salen por el cliente httplib2 del thread que las ejecuta"""
+    from googleapiclient.http import HttpRequest
+    return HttpRequest(_calendar_thread_http(), *args, **kwargs)
+
+
+def get_calendar_service():
+    """
+    Servicio de Google Calendar compartido y seguro entre threads.
+    
+    Se construye con el documento de discovery incluido en la librería
+    (static_discovery), así que crearlo no hace ninguna petición; el primer
+    token se pide en segundo plano nada más crearlo.
+    """
+    global _calendar_service
+    if _calendar_service is not None:
+        return _calendar_service
+    
+    credentials = get_calendar_credentials()
+    with _lock:
+        if _calendar_service is None:
+            from googleapiclient.discovery import build
+            
+            client_options = {'api_endpoint': config.GOOGLE_CALENDAR_API_URL} if config.GOOGLE_CALENDAR_API_URL else None
+            _calendar_service = build('calendar', 'v3', credentials=credentials, cache_discovery=False,
+                                      static_discovery=True, client_options=client_options,
+                                      requestBuilder=_calendar_request_builder)
+            logger.info("[HTTP] Servicio de Google Calendar compartido creado")
+            if not credentials.valid:
+                credentials.refresh_in_background()
+    
+    return _calendar_service
+
+
+def close_all():
+    """Cierra los clientes compartidos (se llama al terminar el proceso)"""
+    global _requests_session, _openai_client, _calendar_service, _calendar_credentials
+    with _lock:
+        if _requests_session is not None:
+            _requests_session.close()
+            _requests_session = None
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
+        _calendar_service = None
+        _calendar_credentials = None
+        # Los clientes asíncronos se descartan junto con su event loop
+        _async_openai_clients.clear()
+
+
+atexit.register(close_all)
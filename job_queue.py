@@ -0,0 +1,362 @@
+"""Cola de trabajos persistente (SQLite) con workers en segundo plano"""
+import asyncio
+import importlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+# Módulos que registran handlers de trabajos al importarse
+HANDLER_MODULES = ('audio_pipeline', 'calendar_sync', 'sftp_storage', 'task_archive', 'db_backup', 'db_replication')
+
+# Colas y número de workers de cada una
+QUEUES = {
+    'default': config.JOB_WORKERS_DEFAULT,
+    'audio': config.JOB_WORKERS_AUDIO,
+    'uploads': config.JOB_WORKERS_UPLOADS,
+}
+
+_handlers: Dict[str, Dict] = {}
+_workers = []
+_wake_events = {queue: threading.Event() for queue in QUEUES}
+_stop_event = threading.Event()
+_notifier: Optional[Callable] = None
+_waiters: Dict[int, list] = {}  # job_id -> [(loop, future)] de corrutinas esperando el resultado
+_waiters_lock = threading.Lock()
+_handlers_loaded = False
+_current = threading.local()  # Trabajo que está ejecutando el thread actual (para set_progress)
+
+
+class PermanentJobError(Exception):
+    """Error que no tiene sentido reintentar (configuración ausente, datos inexistentes...)"""
+    pass
+
+
+def job_handler(job_type: str, queue: str = 'default', priority: int = 100, max_attempts: int = 5,
+                on_failure: Optional[Callable] = None, every_seconds: Optional[float] = None):
+    """
+    Decorador que registra una función como handler de un tipo de trabajo.
+    
+    El handler recibe el payload (dict) y devuelve un dict con el resultado.
+    Si el resultado incluye 'message' y el trabajo se encoló con 'notify',
+    se envía ese mensaje al chat al terminar. on_failure(payload, error) se
+    llama cuando el trabajo falla definitivamente (para limpiar o marcar estado).
+    Con every_seconds el trabajo es periódico: se programa al arrancar los
+    workers y cada ejecución programa la siguiente (ver schedule_periodic).
+    """
+    def decorator(func):
+        _handlers[job_type] = {
+            'func': func,
+            'queue': queue,
+            'priority': priority,
+            'max_attempts': max_attempts,
+            'on_failure': on_failure,
+            'every_seconds': every_seconds,
+        }
+        return func
+    return decorator
+
+
+def _load_handlers():
+    """Importa los módulos que registran handlers (una sola vez)"""
+    global _handlers_loaded
+    if _handlers_loaded:
+        return
+    for module_name in HANDLER_MODULES:
+        importlib.import_module(module_name)
+    _handlers_loaded = True
+
+
+def set_notifier(notifier: Callable):
+    """
+    Configura la función que envía los mensajes de seguimiento.
+    
+    Se llama como notifier(chat_id, text, message_id) desde el thread del worker.
+    """
+    global _notifier
+    _notifier = notifier
+
+
+def enqueue(job_type: str, payload: Dict = None, idempotency_key: str = None,
+            priority: int = None, delay_seconds: float = 0) -> int:
+    """
+    Encola un trabajo y despierta a los workers de su cola.
+    
+    Con la misma idempotency_key se devuelve el trabajo existente; si ese
+    trabajo había fallado definitivamente, se vuelve a poner en cola.
+    """
+    _load_handlers()
+    spec = _handlers.get(job_type)
+    if not spec:
+        raise ValueError(f"Tipo de trabajo desconocido: {job_type}")
+    
+    db = database.db
+    job_id = db.enqueue_job(
+        job_type,
+        payload=payload,
+        queue=spec['queue'],
+        priority=spec['priority'] if priority is None else priority,
+        idempotency_key=idempotency_key,
+        max_attempts=spec['max_attempts'],
+        delay_seconds=delay_seconds
+    )
+    
+    if idempotency_key and db.retry_job(job_id):
+        logger.info(f"[JOBS] Trabajo {job_id} ({idempotency_key}) había fallado, se reencola")
+    
+    event = _wake_events.get(spec['queue'])
+    if event:
+        event.set()
+    
+    logger.info(f"[JOBS] Trabajo {job_id} encolado: {job_type} (cola {spec['queue']})")
+    return job_id
+
+
+def schedule_periodic(job_type: str, next_slot: bool = False) -> int:
+    """
+    Encola la ejecución de un trabajo periódico en su franja actual (o la siguiente).
+    
+    El tiempo se divide en franjas de every_seconds y la idempotency_key lleva
+    la franja, así los reinicios o varios procesos no duplican ejecuciones.
+    """
+    _load_handlers()
+    every = _handlers[job_type]['every_seconds']
+    now = time.time()
+    slot = int(now // every) + (1 if next_slot else 0)
+    return enqueue(job_type, {'slot': slot}, idempotency_key=f"{job_type}@{slot}",
+                   delay_seconds=max(slot * every - now, 0))
+
+
+def set_progress(**progress):
+    """
+    Publica el progreso del trabajo que se está ejecutando en este thread
+    (p. ej. set_progress(stage='copia', percent=40)). Fuera de un trabajo no hace nada.
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None:
+        return
+    try:
+        database.db.set_job_progress(job_id, progress)
+    except Exception as e:
+        logger.warning(f"[JOBS] No se pudo guardar el progreso del trabajo {job_id}: {e}")
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff exponencial con jitter para el siguiente reintento"""
+    delay = config.JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    delay = min(delay, config.JOB_RETRY_MAX_SECONDS)
+    return round(delay * random.uniform(0.8, 1.2), 1)
+
+
+def run_job(job: Dict) -> str:
+    """
+    Ejecuta un trabajo ya reservado y registra el resultado.
+    
+    Returns:
+        Estado final del trabajo ('done', 'failed' o 'pending' si se reintentará)
+    """
+    db = database.db
+    spec = _handlers.get(job['job_type'])
+    result = None
+    error = None
+    
+    try:
+        if spec is None:
+            raise PermanentJobError(f"Tipo de trabajo desconocido: {job['job_type']}")
+        if job['attempts'] > job['max_attempts']:
+            raise PermanentJobError(f"Superado el máximo de intentos ({job['max_attempts']})")
+        
+        _current.job_id = job['id']
+        try:
+            result = spec['func'](job['payload']) or {}
+        finally:
+            _current.job_id = None
+        db.complete_job(job['id'], result)
+        status = 'done'
+        logger.info(f"[JOBS] Trabajo {job['id']} ({job['job_type']}) completado")
+    except PermanentJobError as e:
+        error = str(e)
+        status = db.fail_job(job['id'], error)
+        logger.error(f"[JOBS] Trabajo {job['id']} ({job['job_type']}) falló sin reintento: {error}")
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        delay = retry_delay(job['attempts'])
+        status = db.fail_job(job['id'], error, retry_delay=delay)
+        if status == 'pending':
+            logger.warning(
+                f"[JOBS] Trabajo {job['id']} ({job['job_type']}) falló (intento {job['attempts']}/"
+                f"{job['max_attempts']}), reintento en {delay}s: {error}"
+            )
+            return status
+        logger.error(f"[JOBS] Trabajo {job['id']} ({job['job_type']}) falló definitivamente: {error}",
+                     exc_info=True)
+    
+    if status == 'failed' and spec and spec.get('on_failure'):
+        try:
+            spec['on_failure'](job['payload'], error)
+        except Exception as e:
+            logger.error(f"[JOBS] Error en on_failure del trabajo {job['id']}: {e}", exc_info=True)
+    
+    if spec and spec.get('every_seconds'):
+        try:
+            schedule_periodic(job['job_type'], next_slot=True)
+        except Exception as e:
+            logger.error(f"[JOBS] No se pudo programar la siguiente ejecución de {job['job_type']}: {e}", exc_info=True)
+    
+    _finish(job, status, result, error)
+    return status
+
+
+def _finish(job: Dict, status: str, result: Optional[Dict], error: Optional[str]):
+    """Despierta a las corrutinas que esperan el trabajo o envía el mensaje de seguimiento"""
+    with _waiters_lock:
+        waiters = _waiters.pop(job['id'], [])
+    
+    for loop, future in waiters:
+        loop.call_soon_threadsafe(_resolve_future, future)
+    
+    # Si alguien en este proceso espera el resultado, él se encarga de responder
+    notify = job['payload'].get('notify')
+    if waiters or not notify or not _notifier:
+        return
+    
+    if status == 'done':
+        text = (result or {}).get('message')
+    else:
+        text = f"{notify.get('error_prefix', '❌ Error')}: {error}"
+    
+    if not text:
+        return
+    
+    try:
+        _notifier(notify['chat_id'], text, notify.get('message_id'))
+    except Exception as e:
+        logger.error(f"[JOBS] Error enviando notificación del trabajo {job['id']}: {e}", exc_info=True)
+
+
+def _resolve_future(future: asyncio.Future):
+    """Marca un future como resuelto (se ejecuta dentro de su event loop)"""
+    if not future.done():
+        future.set_result(None)
+
+
+async def wait_for_job(job_id: int, timeout: float = None) -> Dict:
+    """
+    Espera (sin bloquear el event loop) a que un trabajo termine.
+    
+    Los workers de este proceso despiertan la espera al terminar; además se
+    consulta la BD periódicamente por si el trabajo lo ejecuta otro proceso.
+    
+    Returns:
+        Trabajo con estado 'done' o 'failed'
+    
+    Raises:
+        asyncio.TimeoutError si no termina dentro del timeout
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    with _waiters_lock:
+        _waiters.setdefault(job_id, []).append((loop, future))
+    
+    deadline = loop.time() + timeout if timeout else None
+    try:
+        while True:
+            job = database.db.get_job(job_id)
+            if job is None:
+                raise ValueError(f"Trabajo {job_id} no encontrado")
+            if job['status'] in ('done', 'failed'):
+                return job
+            
+            wait = config.JOB_POLL_INTERVAL_SECONDS
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait = min(wait, remaining)
+            
+            try:
+                await asyncio.wait_for(asyncio.shield(future), wait)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        with _waiters_lock:
+            remaining_waiters = [w for w in _waiters.get(job_id, []) if w[1] is not future]
+            if remaining_waiters:
+                _waiters[job_id] = remaining_waiters
+            else:
+                _waiters.pop(job_id, None)
+
+
+class JobWorker(threading.Thread):
+    """Worker que procesa trabajos de una cola"""
+    
+    def __init__(self, queue: str, index: int):
+        super().__init__(daemon=True, name=f"job_worker_{queue}_{index}")
+        self.queue = queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{self.name}"
+    
+    def run(self):
+        wake = _wake_events[self.queue]
+        db = database.db
+        
+        while not _stop_event.is_set():
+            try:
+                job = db.claim_job(self.queue, self.worker_id, config.JOB_VISIBILITY_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.error(f"[JOBS] Error reservando trabajo en cola {self.queue}: {e}", exc_info=True)
+                job = None
+            
+            if job is None:
+                wake.wait(config.JOB_POLL_INTERVAL_SECONDS)
+                wake.clear()
+                continue
+            
+            run_job(job)
+
+
+def start_workers():
+    """Arranca los workers de todas las colas (idempotente)"""
+    if _workers:
+        return
+    
+    _load_handlers()
+    _stop_event.clear()
+    
+    try:
+        purged = database.db.purge_finished_jobs(config.JOB_RETENTION_DAYS)
+        if purged:
+            logger.info(f"[JOBS] {purged} trabajos terminados eliminados")
+    except Exception as e:
+        logger.warning(f"[JOBS] No se pudieron purgar trabajos antiguos: {e}")
+    
+    for job_type, spec in _handlers.items():
+        if spec.get('every_seconds'):
+            try:
+                schedule_periodic(job_type)
+            except Exception as e:
+                logger.warning(f"[JOBS] No se pudo programar el trabajo periódico {job_type}: {e}")
+    
+    for queue, count in QUEUES.items():
+        for index in range(count):
+            worker = JobWorker(queue, index)
+            worker.start()
+            _workers.append(worker)
+    
+    logger.info(f"[JOBS] Workers arrancados: {', '.join(f'{q}={n}' for q, n in QUEUES.items())}")
+
+
+def stop_workers(timeout: float = 5):
+    """Detiene los workers (los trabajos en curso terminan o se recuperan tras el visibility timeout)"""
+    _stop_event.set()
+    for event in _wake_events.values():
+        event.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
@@ -0,0 +1,286 @@
+"""
+Cambios de tareas en directo para el panel web (Server-Sent Events).
+
+Un solo productor por proceso lee el registro de cambios (tabla changes) y
+deja los cambios de tareas en un buffer circular compartido. Cada navegador
+conectado a /admin/events es un suscriptor que espera en una condición y lee
+del buffer lo posterior a su último evento, así que la base de datos se
+consulta una vez por intervalo sea cual sea el número de navegadores. El
+productor arranca con el primer suscriptor y se para cuando no queda ninguno.
+
+El id de cada evento es el seq del registro de cambios: es global, así que un
+navegador puede reconectar con Last-Event-ID a cualquier worker. Si lo que
+falta ya no está en el buffer se relee del registro; si la compactación ya lo
+ha borrado se envía un evento 'reset' y el panel recarga.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+# Tablas del registro de cambios que afectan a las tarjetas del panel
+WATCHED_TABLES = ['tasks', 'task_ampliaciones_history', 'task_images']
+
+# Cambios que se leen del registro por consulta
+POLL_BATCH_SIZE = 1000
+
+# Campos de la tarea que viajan en cada evento
+TASK_FIELDS = ('id', 'title', 'status', 'priority', 'category', 'task_date',
+               'client_name_raw', 'user_id', 'user_name', 'updated_at')
+
+
+def format_event(event_type: str, data: Dict, event_id: int = None) -> str:
+    """Un mensaje SSE ('id', 'event' y 'data' en JSON)"""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class StreamLimitError(Exception):
+    """El proceso ya tiene abiertos LIVE_EVENTS_MAX_STREAMS streams"""
+    pass
+
+
+class _Subscription:
+    """Stream de un suscriptor: ocupa una plaza hasta que se cierra o se agota (se lea o no)"""
+    
+    def __init__(self, broadcaster: 'ChangeBroadcaster', messages: Iterator[str]):
+        self._broadcaster = broadcaster
+        self._messages = messages
+        self._closed = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self) -> str:
+        try:
+            return next(self._messages)
+        except StopIteration:
+            self.close()
+            raise
+    
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._messages.close()
+        self._broadcaster._release()
+
+
+class ChangeBroadcaster:
+    """Productor único del proceso que reparte los cambios de tareas a los suscriptores"""
+    
+    def __init__(self, db: database.Database = None, poll_interval: float = None, buffer_size: int = None,
+                 max_streams: int = None):
+        self._db = db
+        self.max_streams = max_streams if max_streams is not None else config.LIVE_EVENTS_MAX_STREAMS
+        self.poll_interval = poll_interval if poll_interval is not None else config.LIVE_EVENTS_POLL_SECONDS
+        self._events = deque(maxlen=buffer_size or config.LIVE_EVENTS_BUFFER_SIZE)
+        self._condition = threading.Condition()
+        self._last_seq = None  # Último seq leído del registro de cambios
+        self._complete_after = None  # El buffer tiene todos los eventos posteriores a este seq
+        self._thread = None
+        self._stop = threading.Event()
+        self._subscribers = 0  # Streams abiertos; sin ninguno el productor se para
+    
+    @property
+    def db(self) -> database.Database:
+        return self._db or database.db
+    
+    @property
+    def last_seq(self) -> int:
+        with self._condition:
+            self._ensure_started_seq()
+            return self._last_seq
+    
+    def _ensure_started_seq(self):
+        if self._last_seq is None:
+            self._last_seq = self._complete_after = self.db.latest_change_seq()
+    
+    def poll(self) -> int:
+        """
+        Lee los cambios nuevos del registro y los publica (uno por tarea y lote).
+        
+        Returns:
+            Número de eventos publicados
+        """
+        with self._condition:
+            self._ensure_started_seq()
+            since = self._last_seq
+        try:
+            changes = self.db.changes_since(since, limit=POLL_BATCH_SIZE, tables=WATCHED_TABLES)
+        except database.ChangesCompactedError:
+            # Se han perdido cambios: los suscriptores que iban por detrás recargan
+            logger.warning("[EVENTS] Registro de cambios compactado, se reinicia el buffer")
+            with self._condition:
+                self._last_seq = self._complete_after = self.db.latest_change_seq()
+                self._events.clear()
+                self._condition.notify_all()
+            return 0
+        if not changes:
+            return 0
+        
+        events = self._build_events(changes)
+        with self._condition:
+            for event in events:
+                if len(self._events) == self._events.maxlen:
+                    # El evento que sale del buffer ya no se puede reenviar al reconectar
+                    self._complete_after = self._events[0]['seq']
+                self._events.append(event)
+            self._last_seq = changes[-1]['seq']
+            self._condition.notify_all()
+        if len(changes) == POLL_BATCH_SIZE:
+            # Quedan cambios por leer
+            return len(events) + self.poll()
+        return len(events)
+    
+    def _build_events(self, changes: List[Dict]) -> List[Dict]:
+        """Cambios del registro -> eventos de tarea (el último cambio de cada tarea del lote)"""
+        last_change = {}
+        created = set()
+        for change in changes:
+            if change['task_id'] is None:
+                continue
+            last_change[change['task_id']] = change
+            if change['table_name'] == 'tasks' and change['op'] == 'insert':
+                created.add(change['task_id'])
+        
+        tasks = self.db.get_tasks_by_ids(list(last_change))
+        events = []
+        for task_id, change in sorted(last_change.items(), key=lambda item: item[1]['seq']):
+            task = tasks.get(task_id)
+            if task is None:
+                # Borrada o archivada
+                events.append({'seq': change['seq'], 'type': 'task.deleted', 'category': None, 'data': {'id': task_id}})
+                continue
+            if task_id in created:
+                event_type = 'task.created'
+            elif task['status'] == 'completed':
+                event_type = 'task.completed'
+            else:
+                event_type = 'task.updated'
+            events.append({
+                'seq': change['seq'],
+                'type': event_type,
+                'category': task.get('category'),
+                'data': {field: task.get(field) for field in TASK_FIELDS},
+            })
+        return events
+    
+    def events_after(self, seq: int) -> Optional[List[Dict]]:
+        """Eventos del buffer posteriores a 'seq', o None si alguno no está en el buffer"""
+        with self._condition:
+            self._ensure_started_seq()
+            if seq < self._complete_after:
+                return None
+            return [event for event in self._events if event['seq'] > seq]
+    
+    def start(self):
+        """Arranca el hilo productor si no está en marcha (con el primer suscriptor)"""
+        with self._condition:
+            # Si el hilo está parando aún no ha salido del bucle: sigue en marcha
+            self._stop.clear()
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='live-events', daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+    
+    def _run(self):
+        logger.info("[EVENTS] Productor de eventos en directo iniciado")
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"[EVENTS] Error leyendo el registro de cambios: {e}", exc_info=True)
+            self._stop.wait(self.poll_interval)
+            with self._condition:
+                # Se decide con el lock tomado: start() no puede ver un hilo que ya está saliendo
+                if self._subscribers == 0 or self._stop.is_set():
+                    self._thread = None
+                    break
+        logger.info("[EVENTS] Productor de eventos en directo parado")
+    
+    def stream(self, after: int = None, allowed_categories: List[str] = None,
+               heartbeat: float = None, max_seconds: float = None) -> Iterator[str]:
+        """
+        Mensajes SSE para un suscriptor.
+        
+        Args:
+            after: último evento recibido (Last-Event-ID); por defecto, desde ahora
+            allowed_categories: si se indica, solo tareas sin categoría o de estas categorías
+            heartbeat: segundos entre comentarios de keep-alive si no hay eventos
+            max_seconds: duración máxima de la conexión (el navegador reconecta solo)
+        
+        Cada stream abierto ocupa un hilo del worker: la plaza se reserva aquí y
+        se libera al cerrar el stream devuelto.
+        
+        Raises:
+            StreamLimitError: si ya hay max_streams streams abiertos en el proceso
+        """
+        heartbeat = heartbeat if heartbeat is not None else config.LIVE_EVENTS_HEARTBEAT_SECONDS
+        max_seconds = max_seconds if max_seconds is not None else config.LIVE_EVENTS_MAX_SECONDS
+        with self._condition:
+            if self._subscribers >= self.max_streams:
+                raise StreamLimitError(f"Ya hay {self._subscribers} streams abiertos (máximo {self.max_streams})")
+            self._subscribers += 1
+        return _Subscription(self, self._stream(after, allowed_categories, heartbeat, max_seconds))
+    
+    def _release(self):
+        with self._condition:
+            self._subscribers -= 1
+    
+    def _stream(self, after: Optional[int], allowed_categories: Optional[List[str]],
+                heartbeat: float, max_seconds: float) -> Iterator[str]:
+        self.start()
+        # retry: milisegundos que espera el navegador antes de reconectar
+        yield f'retry: {int(config.LIVE_EVENTS_RETRY_SECONDS * 1000)}\n\n'
+        seq = after if after is not None else self.db.latest_change_seq()
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            events = self.events_after(seq)
+            if events is None:
+                # Reconexión desde antes del buffer: se relee del registro de cambios.
+                # El seq del productor se toma antes de leer: lo que entre mientras
+                # tanto estará en el buffer o en la siguiente lectura
+                head = self.last_seq
+                try:
+                    changes = self.db.changes_since(seq, limit=POLL_BATCH_SIZE, tables=WATCHED_TABLES)
+                except database.ChangesCompactedError:
+                    yield format_event('reset', {}, self.last_seq)
+                    return
+                events = self._build_events(changes)
+                if not events:
+                    seq = changes[-1]['seq'] if changes else max(seq, head)
+                    continue
+            for event in events:
+                seq = event['seq']
+                if (allowed_categories is not None and event['category']
+                        and event['category'] not in allowed_categories):
+                    continue
+                yield format_event(event['type'], event['data'], event['seq'])
+            if events:
+                continue
+            with self._condition:
+                notified = self._condition.wait_for(
+                    lambda: (self._events and self._events[-1]['seq'] > seq) or seq < self._complete_after,
+                    timeout=min(heartbeat, max(deadline - time.monotonic(), 0)),
+                )
+            if not notified:
+                yield ': ping\n\n'
+
+
+# Productor del proceso (cada worker de gunicorn tiene el suyo)
+broadcaster = ChangeBroadcaster()
@@ -88,6 +88,8 @@ class IntentParser:
     
     def __init__(self):
         self.db = database.db
+        # (versión del registro de categorías, nombres, texto del prompt)
+        self._categories_prompt_cache = None
     
     def parse(self, text: str) -> Dict:
         """Parsea texto y extrae intención y entidades"""
@@ -391,6 +393,26 @@ class IntentParser:
         }
         return synonyms_map.get(category_name, [category_name])
     
+    def _categories_prompt(self):
+        """Nombres de categorías y su lista con sinónimos para el prompt, recalculados solo si cambian"""
+        version = self.db.categories_version
+        cached = self._categories_prompt_cache
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+        
+        categories = self.db.get_all_categories()
+        category_names = [cat['name'] for cat in categories]
+        categories_list = []
+        for cat in categories:
+            synonyms_str = ', '.join(self._get_category_synonyms(cat['name']))
+            categories_list.append(
+                f"- '{cat['name']}' ({cat.get('display_name', cat['name'])}): Busca palabras como: {synonyms_str}"
+            )
+        categories_text = '\n'.join(categories_list)
+        
+        self._categories_prompt_cache = (version, category_names, categories_text)
+        return category_names, categories_text
+    
     def _extract_entities_with_openai(self, text: str) -> Dict:
         """Extrae entidades usando GPT-4o-mini"""
         import logging
@@ -399,33 +421,13 @@ class IntentParser:
         if not config.OPENAI_ENABLED:
             raise RuntimeError("OpenAI no está habilitado")
         
-        # Obtener categorías disponibles
-        categories = self.db.get_all_categories()
-        category_names = [cat['name'] for cat in categories]
-        
-        # Crear mapeo de categorías con sus nombres de visualización y sinónimos
-        category_info = {}
-        for cat in categories:
-            category_info[cat['name']] = {
-                'display_name': cat.get('display_name', cat['name']),
-                'icon': cat.get('icon', ''),
-                'synonyms': self._get_category_synonyms(cat['name'])
-            }
+        # Categorías disponibles y su descripción para el prompt
+        category_names, categories_text = self._categories_prompt()
         
         # Fecha actual para contexto
         fecha_actual = datetime.now()
         fecha_mañana = (fecha_actual + timedelta(days=1)).strftime('%Y-%m-%d')
         
-        # Construir lista detallada de categorías para el prompt
-        categories_list = []
-        for cat_name in category_names:
-            info = category_info[cat_name]
-            synonyms_str = ', '.join(info['synonyms'])
-            categories_list.append(
-                f"- '{cat_name}' ({info['display_name']}): Busca palabras como: {synonyms_str}"
-            )
-        categories_text = '\n'.join(categories_list)
-        
         system_prompt = f"""Eres un asistente experto en extraer información estructurada de mensajes sobre tareas en español.
 
 TU TAREA es analizar el texto y extraer SIEMPRE estos campos:
@@ -520,8 +522,8 @@ Ejemplos de análisis:
 Analiza el texto y extrae TODOS los campos, especialmente la categoría."""
         
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=config.OPENAI_API_KEY)
+            from http_clients import get_openai_client
+            client = get_openai_client()
             
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
@@ -1,6 +1,8 @@
 """Módulo para almacenamiento SFTP de imágenes"""
 import os
 import logging
+import threading
+from job_queue import job_handler, PermanentJobError
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,8 @@ class SFTPStorage:
         self.password = os.getenv('SFTP_PASSWORD', '')
         self.remote_path = os.getenv('SFTP_REMOTE_PATH', '/images/tasks')
         self.web_domain = os.getenv('SFTP_WEB_DOMAIN', '')
+        # Réplica incremental de la base de datos (ver db_replication.py)
+        self.backup_path = os.getenv('SFTP_BACKUP_PATH', '/backups/db')
         
         # Verificar si SFTP está habilitado
         self.enabled = (
@@ -32,6 +36,9 @@ class SFTPStorage:
             self.password
         )
         
+        # Conexión reutilizable por thread (los workers de subida la mantienen abierta)
+        self._local = threading.local()
+        
         if self.enabled:
             logger.info(f"SFTP configurado para {self.host}:{self.port}")
         else:
@@ -54,6 +61,35 @@ class SFTPStorage:
         
         return sftp, transport
     
+    def _get_thread_connection(self):
+        """
+        Obtiene la conexión SFTP del thread actual, reconectando si se ha caído.
+        Evita un handshake SSH completo por cada imagen subida.
+        """
+        sftp = getattr(self._local, 'sftp', None)
+        transport = getattr(self._local, 'transport', None)
+        if sftp is not None and transport is not None and transport.is_active():
+            return sftp
+        
+        self._close_thread_connection()
+        sftp, transport = self._get_connection()
+        self._local.sftp = sftp
+        self._local.transport = transport
+        return sftp
+    
+    def _close_thread_connection(self):
+        """Cierra la conexión SFTP del thread actual (si existe)"""
+        sftp = getattr(self._local, 'sftp', None)
+        transport = getattr(self._local, 'transport', None)
+        self._local.sftp = None
+        self._local.transport = None
+        for conn in (sftp, transport):
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+    
     def upload_image(self, local_file_path: str, remote_filename: str) -> str:
         """
         Sube una imagen al servidor SFTP
@@ -68,7 +104,7 @@ class SFTPStorage:
         if not self.enabled:
             raise RuntimeError("SFTP no está habilitado")
         
-        sftp, transport = self._get_connection()
+        sftp = self._get_thread_connection()
         
         try:
             # Asegurar que el directorio remoto existe
@@ -86,9 +122,10 @@ class SFTPStorage:
             logger.info(f"Imagen subida a SFTP: {remote_file_path}")
             
             return remote_file_path
-        finally:
-            sftp.close()
-            transport.close()
+        except Exception:
+            # Conexión en estado desconocido: se descarta y el reintento abre otra
+            self._close_thread_connection()
+            raise
     
     def delete_image(self, remote_file_path: str):
         """
@@ -114,3 +151,37 @@ class SFTPStorage:
 
 # Crear instancia global
 sftp_storage = SFTPStorage()
+
+
+def _upload_image_job_failed(payload: dict, error: str):
+    """Si la subida falla definitivamente, la imagen queda servida desde la copia local"""
+    import database
+    database.db.update_task_image_path(payload['image_id'], payload['local_path'], upload_state='local')
+
+
+@job_handler('images.upload', queue='uploads', priority=100, max_attempts=8,
+             on_failure=_upload_image_job_failed)
+def upload_image_job(payload: dict) -> dict:
+    """
+    Trabajo de la cola: sube a SFTP una imagen ya guardada localmente y
+    actualiza su ruta en la base de datos. Hasta entonces la imagen se sirve
+    desde la copia local (upload_state 'pending').
+    """
+    import database
+    
+    local_path = payload['local_path']
+    if not os.path.exists(local_path):
+        raise PermanentJobError(f"La imagen local ya no existe: {local_path}")
+    
+    if not sftp_storage.enabled:
+        raise PermanentJobError("SFTP no está habilitado")
+    
+    remote_path = sftp_storage.upload_image(local_path, payload['remote_filename'])
+    database.db.update_task_image_path(payload['image_id'], remote_path, upload_state='remote')
+    
+    try:
+        os.remove(local_path)
+    except OSError as e:
+        logger.warning(f"No se pudo borrar archivo local después de subir a SFTP: {e}")
+    
+    return {'remote_path': remote_path}
@@ -0,0 +1,181 @@
+"""Almacén del estado de conversación del bot (compartible entre procesos)"""
+import json
+import threading
+from abc import ABC, abstractmethod
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, date
+from typing import Any, Optional
+import config
+
+# Valores serializados por encima de este tamaño se comprimen
+COMPRESS_THRESHOLD_BYTES = 512
+
+
+def _encode_default(value):
+    """Serializa tipos que JSON no soporta (fechas del parser) con una etiqueta"""
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable en el estado: {type(value).__name__}")
+
+
+def _decode_hook(obj):
+    """Restaura las fechas etiquetadas por _encode_default"""
+    if len(obj) == 1:
+        if '$dt' in obj:
+            return datetime.fromisoformat(obj['$dt'])
+        if '$d' in obj:
+            return date.fromisoformat(obj['$d'])
+    return obj
+
+
+def encode_state(value: Any) -> bytes:
+    """Serializa un estado a JSON compacto (comprimido si es grande)"""
+    raw = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=_encode_default).encode('utf-8')
+    if len(raw) > COMPRESS_THRESHOLD_BYTES:
+        return b'z' + zlib.compress(raw)
+    return b'j' + raw
+
+
+def decode_state(data: bytes) -> Any:
+    """Deserializa un estado guardado con encode_state"""
+    data = bytes(data)
+    raw = zlib.decompress(data[1:]) if data[:1] == b'z' else data[1:]
+    return json.loads(raw.decode('utf-8'), object_hook=_decode_hook)
+
+
+class StateStore(ABC):
+    """
+    Interfaz tipo dict para el estado de conversación por usuario.
+    
+    Los valores se guardan serializados: modificar el dict devuelto por get()
+    no cambia el estado guardado; hay que volver a asignarlo o usar update().
+    """
+    
+    @abstractmethod
+    def get(self, key, default=None):
+        """Estado guardado (una copia) o 'default' si no existe o ha caducado"""
+    
+    @abstractmethod
+    def set(self, key, value: dict):
+        """Guarda el estado (sustituye al anterior)"""
+    
+    @abstractmethod
+    def delete(self, key) -> bool:
+        """Borra el estado. Devuelve si existía"""
+    
+    def update(self, key, **fields) -> Optional[dict]:
+        """Actualiza campos de un estado existente y lo guarda. Devuelve el estado nuevo"""
+        state = self.get(key)
+        if state is None:
+            return None
+        state.update(fields)
+        self.set(key, state)
+        return state
+    
+    def pop(self, key, default=None):
+        state = self.get(key)
+        if state is None:
+            return default
+        self.delete(key)
+        return state
+    
+    def __getitem__(self, key):
+        state = self.get(key)
+        if state is None:
+            raise KeyError(key)
+        return state
+    
+    def __setitem__(self, key, value):
+        self.set(key, value)
+    
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class MemoryStateStore(StateStore):
+    """Estado en memoria del proceso con expiración (TTL) y límite de entradas (LRU)"""
+    
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, datos serializados)
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            data = entry[1]
+        return decode_state(data)
+    
+    def set(self, key, value: dict):
+        data = encode_state(value)
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl_seconds, data)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def delete(self, key) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteStateStore(StateStore):
+    """Estado compartido entre procesos/workers en la tabla conversation_states"""
+    
+    # Cada cuántas escrituras se purgan las entradas expiradas
+    PURGE_EVERY = 100
+    
+    def __init__(self, db, ttl_seconds: int, namespace: str = 'user_states'):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self._writes = 0
+        self._lock = threading.Lock()
+    
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+    
+    def get(self, key, default=None):
+        data = self.db.get_conversation_state(self._key(key))
+        return decode_state(data) if data is not None else default
+    
+    def set(self, key, value: dict):
+        self.db.set_conversation_state(self._key(key), encode_state(value), self.ttl_seconds)
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.db.purge_expired_conversation_states()
+    
+    def delete(self, key) -> bool:
+        return self.db.delete_conversation_state(self._key(key))
+
+
+def create_state_store(db) -> StateStore:
+    """Crea el almacén de estado según STATE_STORE_BACKEND ('sqlite' o 'memory')"""
+    if config.STATE_STORE_BACKEND == 'memory':
+        return MemoryStateStore(config.STATE_TTL_SECONDS, config.STATE_MEMORY_MAX_ENTRIES)
+    if config.STATE_STORE_BACKEND == 'sqlite':
+        return SQLiteStateStore(db, config.STATE_TTL_SECONDS)
+    raise ValueError(f"STATE_STORE_BACKEND no válido: {config.STATE_STORE_BACKEND}")
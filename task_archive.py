@@ -0,0 +1,30 @@
+"""Mantenimiento periódico: archivo de tareas terminadas y compactación del registro de cambios"""
+import logging
+import config
+import database
+from job_queue import job_handler
+
+logger = logging.getLogger(__name__)
+
+
+@job_handler('tasks.archive', queue='default', priority=200, max_attempts=3,
+             every_seconds=config.ARCHIVE_INTERVAL_HOURS * 3600)
+def archive_tasks_job(payload: dict) -> dict:
+    """Trabajo periódico: mueve al archivo las tareas terminadas hace más de ARCHIVE_AFTER_DAYS"""
+    if config.ARCHIVE_AFTER_DAYS <= 0:
+        return {'archived': 0}
+    
+    archived = database.db.archive_tasks(config.ARCHIVE_AFTER_DAYS, config.ARCHIVE_BATCH_SIZE)
+    if archived:
+        logger.info(f"[ARCHIVE] {archived} tareas archivadas (sin cambios en {config.ARCHIVE_AFTER_DAYS} días)")
+    return {'archived': archived}
+
+
+@job_handler('changes.compact', queue='default', priority=200, max_attempts=3,
+             every_seconds=config.CHANGES_COMPACT_INTERVAL_HOURS * 3600)
+def compact_changes_job(payload: dict) -> dict:
+    """Trabajo periódico: borra del registro de cambios lo ya procesado o caducado"""
+    deleted = database.db.compact_changes(config.CHANGES_RETENTION_DAYS)
+    if deleted:
+        logger.info(f"[CHANGES] {deleted} cambios compactados")
+    return {'deleted': deleted}
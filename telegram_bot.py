@@ -2,17 +2,50 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes
 from datetime import datetime, timedelta
+import asyncio
 import os
 import logging
 import database
 import parser
 import audio_pipeline
 import config
-from utils import normalize_text
-from sftp_storage import sftp_storage, PARAMIKO_AVAILABLE
+import job_queue
+import state_store
+from utils import normalize_text, parse_task_date
+from sftp_storage import sftp_storage, upload_image_job, PARAMIKO_AVAILABLE
 
 logger = logging.getLogger(__name__)
 
+# Tiempo de espera para reunir todas las fotos de un álbum (media group)
+MEDIA_GROUP_WAIT_SECONDS = 1.0
+
+# Listados paginados de tareas: tareas por página y límite de callback_data de Telegram
+TASK_PAGE_SIZE = 10
+CALLBACK_DATA_MAX_BYTES = 64
+
+# Prefijo de los botones de paginación: tp|<listado>|<filtro>|<página>|<task_date>|<id>
+# (se separa con '|' porque task_date contiene ':')
+TASK_PAGE_PREFIX = 'tp|'
+
+# Listados de tareas: código -> estados incluidos y acción del botón de cada tarea
+TASK_LISTS = {
+    'v': {'statuses': ('open',), 'action': 'view_task'},
+    'c': {'statuses': ('open',), 'action': 'close_task'},
+    'i': {'statuses': ('open',), 'action': 'assign_image_to_task'},
+    'a': {'statuses': ('open', 'pending_approval', 'cancelled'), 'action': 'select_task_for_ampliar'},
+}
+
+# Filtros del listado de tareas pendientes: nombre -> código en callback_data
+TASK_FILTER_CODES = {'all': 'a', 'no_date': 'n', 'today': 't', 'tomorrow': 'm', 'this_week': 'w'}
+
+
+class PhotoFile:
+    """Referencia a una foto de Telegram guardada en el estado del usuario"""
+    
+    def __init__(self, file_id, file_unique_id):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+
 
 class TelegramBotHandler:
     """Manejador de comandos y mensajes del bot"""
@@ -22,7 +55,20 @@ class TelegramBotHandler:
         self.parser = parser.IntentParser()
         # Estado de usuarios: {user_id: {'action': 'ampliar_task', 'task_id': int}}
         # O también: {user_id: {'action': 'waiting_category', 'parsed': dict}}
-        self.user_states = {}
+        # Se guarda serializado (compartido entre workers con el backend SQLite): los cambios
+        # en un estado se guardan reasignándolo o con user_states.update()
+        self.user_states = state_store.create_state_store(self.db)
+        # Tareas lanzadas en segundo plano (se guarda la referencia hasta que terminan)
+        self._background_tasks = set()
+        # Álbumes de fotos en recepción: {(user_id, media_group_id): {'update': Update, 'photos': [...]}}
+        self._media_groups = {}
+    
+    def _run_in_background(self, coro):
+        """Lanza una corrutina en el loop actual sin que el handler espere a que termine"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
     
     def _get_action_buttons(self) -> InlineKeyboardMarkup:
         """Retorna botones de acción siempre disponibles (inline)"""
@@ -211,56 +257,21 @@ class TelegramBotHandler:
             )
             return
         
-        # Procesar audio
+        # Con la cola de trabajos el handler responde enseguida y la conversación
+        # continúa en segundo plano cuando termina la transcripción
+        if config.JOB_QUEUE_ENABLED:
+            self._run_in_background(self._process_voice_message(update, context, voice, user))
+        else:
+            await self._process_voice_message(update, context, voice, user)
+    
+    async def _process_voice_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     voice, user):
+        """Transcribe una nota de voz y la procesa según el estado del usuario"""
         try:
-            # Mostrar que el bot está trabajando (typing indicator)
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            
-            # Con OpenAI no hay carga de modelo local, siempre procesamiento directo
-            await update.message.reply_text("🎤 Procesando audio...", reply_markup=reply_markup)
-            
-            # Obtener archivo de audio
-            file = await context.bot.get_file(voice.file_id)
-            
-            # Descargar archivo temporalmente
-            import tempfile
-            temp_ogg = os.path.join(config.TEMP_DIR, f"audio_{user.id}_{voice.file_id}.ogg")
-            await file.download_to_drive(temp_ogg)
-            
-            # Mantener typing indicator activo durante el procesamiento
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            
-            # Pipeline completo: convertir y transcribir
-            # Ejecutar en thread separado para no bloquear el event loop
-            import asyncio
-            import logging
-            logger = logging.getLogger(__name__)
-            
-            logger.info(f"[HANDLER] Iniciando procesamiento de audio para usuario {user.id}")
-            loop = asyncio.get_event_loop()
-            
-            try:
-                transcript = await asyncio.wait_for(
-                    loop.run_in_executor(
-                        None,  # Usar el executor por defecto
-                        audio_pipeline.process_audio_from_file,
-                        temp_ogg
-                    ),
-                    timeout=300  # 5 minutos de timeout
-                )
-                logger.info(f"[HANDLER] Audio procesado correctamente para usuario {user.id}")
-            except asyncio.TimeoutError:
-                logger.error(f"[HANDLER] Timeout procesando audio para usuario {user.id}")
-                await update.message.reply_text(
-                    "❌ El procesamiento del audio tardó demasiado tiempo. Por favor, intenta con un audio más corto.",
-                    reply_markup=reply_markup
-                )
-                return
-            
+            transcript = await self._transcribe_voice(update, context, voice, user)
             if not transcript:
-                await update.message.reply_text("❌ No se pudo transcribir el audio.", reply_markup=reply_markup)
                 return
-            
+
             # Verificar si el usuario está en modo "ampliar tarea"
             user_state = self.user_states.get(user.id)
             if user_state and user_state.get('action') == 'ampliar_task':
@@ -372,6 +383,89 @@ class TelegramBotHandler:
                     reply_markup=reply_markup
                 )
     
+    async def _transcribe_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                voice, user):
+        """
+        Obtiene la transcripción de una nota de voz, usando la caché por file_unique_id
+        antes de descargar y procesar el audio.
+        
+        Returns:
+            Transcripción, o None si ya se informó al usuario del error
+        """
+        reply_markup = self._get_reply_keyboard()
+        cache_key = (
+            voice.file_unique_id,
+            audio_pipeline.TRANSCRIPTION_BACKEND,
+            audio_pipeline.TRANSCRIPTION_MODEL,
+            audio_pipeline.TRANSCRIPTION_LANGUAGE,
+        )
+        
+        # Audios reenviados o updates reintentados: reutilizar la transcripción
+        transcript = self.db.get_cached_transcript(*cache_key)
+        if transcript:
+            logger.info(f"[HANDLER] Transcripción obtenida de caché para {voice.file_unique_id}")
+            return transcript
+        
+        # Mostrar que el bot está trabajando (typing indicator)
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        
+        # Con OpenAI no hay carga de modelo local, siempre procesamiento directo
+        await update.message.reply_text("🎤 Procesando audio...", reply_markup=reply_markup)
+        
+        # Obtener archivo de audio
+        file = await context.bot.get_file(voice.file_id)
+        
+        # Descargar archivo temporalmente
+        temp_ogg = os.path.join(config.TEMP_DIR, f"audio_{user.id}_{voice.file_id}.ogg")
+        await file.download_to_drive(temp_ogg)
+        
+        # Mantener typing indicator activo durante el procesamiento
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        
+        logger.info(f"[HANDLER] Iniciando procesamiento de audio para usuario {user.id}")
+        
+        try:
+            if config.JOB_QUEUE_ENABLED:
+                # Conversión y transcripción en un worker de la cola (con reintentos);
+                # la misma nota de voz no se encola dos veces
+                job_id = job_queue.enqueue(
+                    'audio.transcribe',
+                    {
+                        'file_path': temp_ogg,
+                        'file_unique_id': voice.file_unique_id,
+                        'language': audio_pipeline.TRANSCRIPTION_LANGUAGE,
+                    },
+                    idempotency_key=f"voice:{voice.file_unique_id}"
+                )
+                job = await job_queue.wait_for_job(job_id, timeout=300)  # 5 minutos de timeout
+                if job['status'] == 'failed':
+                    raise RuntimeError(job.get('last_error') or 'Error desconocido')
+                # El worker ya guarda la transcripción en la caché
+                transcript = (job.get('result') or {}).get('transcript')
+            else:
+                # Sin cola: convertir (en thread) y transcribir (cliente HTTP asíncrono
+                # compartido), sin bloquear el event loop
+                transcript = await asyncio.wait_for(
+                    audio_pipeline.process_audio_from_file_async(temp_ogg),
+                    timeout=300  # 5 minutos de timeout
+                )
+                if transcript:
+                    self.db.save_cached_transcript(*cache_key, transcript)
+            logger.info(f"[HANDLER] Audio procesado correctamente para usuario {user.id}")
+        except asyncio.TimeoutError:
+            logger.error(f"[HANDLER] Timeout procesando audio para usuario {user.id}")
+            await update.message.reply_text(
+                "❌ El procesamiento del audio tardó demasiado tiempo. Por favor, intenta con un audio más corto.",
+                reply_markup=reply_markup
+            )
+            return None
+        
+        if not transcript:
+            await update.message.reply_text("❌ No se pudo transcribir el audio.", reply_markup=reply_markup)
+            return None
+        
+        return transcript
+    
     async def _handle_intent(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
                             parsed: dict, user):
         """Procesa intención parseada"""
@@ -446,10 +540,7 @@ class TelegramBotHandler:
         # Verificar si la categoría detectada es válida
         if category:
             # Validar que la categoría existe en la base de datos
-            categories = self.db.get_all_categories()
-            category_names = [cat['name'] for cat in categories]
-            
-            if category in category_names:
+            if self.db.get_category(category):
                 # Categoría válida, crear tarea directamente
                 logger.info(f"[TASK] Categoría detectada por OpenAI: {category}")
                 try:
@@ -465,21 +556,19 @@ class TelegramBotHandler:
                         category=category
                     )
                     
-                    # Si hay una imagen pendiente, adjuntarla automáticamente
+                    # Si hay imágenes pendientes, adjuntarlas automáticamente
                     if photo_file_id:
-                        await self._assign_image_to_task_from_callback(
-                            None, update, context, task_id, 
-                            {'file_id': photo_file_id, 'file_unique_id': photo_file_unique_id}, 
-                            user
-                        )
+                        try:
+                            await self._save_images_to_storage(context, self._get_state_photos(user_state), task_id)
+                        except Exception as e:
+                            logger.error(f"Error adjuntando imagen a nueva tarea: {e}", exc_info=True)
                     
                     # Limpiar estado
                     if user.id in self.user_states:
                         del self.user_states[user.id]
                     
                     # Confirmar creación
-                    categories = self.db.get_all_categories()
-                    category_obj = next((c for c in categories if c['name'] == category), None)
+                    category_obj = self.db.get_category(category)
                     category_display = category_obj['display_name'] if category_obj else category
                     
                     reply_markup = self._get_reply_keyboard()
@@ -521,7 +610,8 @@ class TelegramBotHandler:
             'client_id': client_id,
             'client_name_raw': client_name_raw,
             'photo_file_id': photo_file_id,
-            'photo_file_unique_id': photo_file_unique_id
+            'photo_file_unique_id': photo_file_unique_id,
+            'photo_files': user_state.get('photo_files') if photo_file_id else None
         }
         
         # Preguntar por categoría con botones
@@ -596,11 +686,12 @@ class TelegramBotHandler:
         
         # Mapear texto a categoría - obtener categorías de la BD
         transcript_lower = transcript.lower().strip()
-        categories = self.db.get_all_categories()
         
-        category = None
-        # Buscar coincidencia por nombre o display_name
-        for cat in categories:
+        # Coincidencia exacta por nombre o display_name
+        category_obj = self.db.get_category(transcript_lower) or self.db.get_category_by_display_name(transcript_lower)
+        category = category_obj['name'] if category_obj else None
+        # Buscar coincidencia parcial por nombre o display_name
+        for cat in ([] if category else self.db.get_all_categories()):
             cat_name_lower = cat['name'].lower()
             display_name_lower = (cat['display_name'] or '').lower()
             
@@ -684,25 +775,14 @@ class TelegramBotHandler:
                 await update_or_query.message.reply_text(error_msg)
             return
         
-        # Si hay una imagen pendiente, adjuntarla automáticamente
+        # Si hay imágenes pendientes, adjuntarlas automáticamente
         photo_file_id = user_state.get('photo_file_id')
-        photo_file_unique_id = user_state.get('photo_file_unique_id')
+        photos = self._get_state_photos(user_state)
         
-        if photo_file_id and photo_file_unique_id:
+        if photos:
             try:
-                # Crear objeto Photo simulado
-                class PhotoFile:
-                    def __init__(self, file_id, file_unique_id):
-                        self.file_id = file_id
-                        self.file_unique_id = file_unique_id
-                
-                photo_file = PhotoFile(photo_file_id, photo_file_unique_id)
-                
-                # Guardar imagen (local y SFTP)
-                remote_path = await self._save_image_to_storage(context, photo_file, task_id)
-                
-                # Añadir imagen a la tarea (guardar ruta remota)
-                self.db.add_image_to_task(task_id, photo_file.file_id, remote_path)
+                # Guardar imágenes (local ahora, SFTP en segundo plano)
+                await self._save_images_to_storage(context, photos, task_id)
             except Exception as e:
                 logger.error(f"Error adjuntando imagen a nueva tarea: {e}", exc_info=True)
         
@@ -731,8 +811,7 @@ class TelegramBotHandler:
         # Si es callback query, editar mensaje primero y luego enviar confirmación
         if hasattr(update_or_query, 'callback_query') and update_or_query.callback_query:
             update = update_or_query
-            categories = self.db.get_all_categories()
-            category_obj = next((c for c in categories if c['name'] == category), None)
+            category_obj = self.db.get_category(category)
             category_display = category_obj['display_name'] if category_obj else category
             
             message_text = f"✅ Categoría seleccionada: {category_obj['icon']} {category_display}"
@@ -745,8 +824,7 @@ class TelegramBotHandler:
         elif hasattr(update_or_query, 'edit_message_text'):
             # Es un CallbackQuery directamente
             query = update_or_query
-            categories = self.db.get_all_categories()
-            category_obj = next((c for c in categories if c['name'] == category), None)
+            category_obj = self.db.get_category(category)
             category_display = category_obj['display_name'] if category_obj else category
             
             message_text = f"✅ Categoría seleccionada: {category_obj['icon']} {category_display}"
@@ -861,8 +939,7 @@ class TelegramBotHandler:
         
         category_info = ""
         if task.get('category'):
-            categories = self.db.get_all_categories()
-            category_obj = next((c for c in categories if c['name'] == task['category']), None)
+            category_obj = self.db.get_category(task['category'])
             if category_obj:
                 category_info = f"\n📂 Categoría: {category_obj['icon']} {category_obj['display_name']}"
             else:
@@ -950,36 +1027,25 @@ class TelegramBotHandler:
             entities = parsed['entities']
             text_lower = parsed['original_text'].lower()
             
-            # Determinar filtro de fecha
+            # Determinar filtro de fecha (rango de días, ambos incluidos)
             status = 'open'
-            task_date_filter = None
+            today = datetime.now().date()
+            day_range = None
             
             if 'hoy' in text_lower:
-                task_date_filter = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+                day_range = (today, today)
             elif 'mañana' in text_lower:
-                task_date_filter = (datetime.now() + timedelta(days=1)).replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
+                day_range = (today + timedelta(days=1), today + timedelta(days=1))
             elif 'semana' in text_lower:
-                # Tareas de esta semana
-                task_date_filter = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+                # Tareas de esta semana (lunes a domingo)
+                week_start = today - timedelta(days=today.weekday())
+                day_range = (week_start, week_start + timedelta(days=6))
             
-            # Obtener tareas
-            tasks = self.db.get_tasks(user_id=user.id, status=status)
-            
-            # Filtrar por fecha si es necesario
-            if task_date_filter:
-                filtered_tasks = []
-                for task in tasks:
-                    if task.get('task_date'):
-                        try:
-                            task_dt = datetime.fromisoformat(task['task_date'])
-                            if task_dt.date() == task_date_filter.date():
-                                filtered_tasks.append(task)
-                        except (ValueError, TypeError):
-                            # Si hay error parseando fecha, incluir la tarea de todas formas
-                            pass
-                tasks = filtered_tasks
+            # Obtener tareas (con filtro de fecha, rango indexado sobre task_day)
+            if day_range:
+                tasks = self.db.get_tasks_by_day_range(*day_range, user_id=user.id, status=status)
+            else:
+                tasks = self.db.get_tasks(user_id=user.id, status=status)
             
             if not tasks:
                 await update.message.reply_text(
@@ -1000,28 +1066,8 @@ class TelegramBotHandler:
                     except Exception:
                         pass
                 
-                date_info = ""
-                if task.get('task_date'):
-                    try:
-                        task_dt = datetime.fromisoformat(task['task_date'])
-                        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                        tomorrow = today + timedelta(days=1)
-                        
-                        task_date_only = task_dt.date()
-                        today_date = today.date()
-                        tomorrow_date = tomorrow.date()
-                        
-                        if task_date_only == today_date:
-                            date_info = " 📆 Hoy"
-                        elif task_date_only == tomorrow_date:
-                            date_info = " 🌅 Mañana"
-                        else:
-                            # Día de la semana en español
-                            days_es = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
-                            day_name = days_es[task_dt.weekday()]
-                            date_info = f" 📅 {day_name}"
-                    except (ValueError, TypeError):
-                        pass
+                date_prefix = self._format_task_date_prefix(task.get('task_date'))
+                date_info = f" {date_prefix}" if date_prefix else ""
                 
                 message_parts.append(
                     f"{i}. {task.get('title', 'Sin título')}{client_info}{date_info}"
@@ -1193,6 +1239,10 @@ class TelegramBotHandler:
         await query.answer()
         
         data = query.data
+        if data.startswith(TASK_PAGE_PREFIX):
+            await self._show_task_page_from_callback(query, update, data)
+            return
+        
         parts = data.split(':')
         action = parts[0]
         
@@ -1462,24 +1512,15 @@ class TelegramBotHandler:
                 await query.edit_message_text("❌ Error: Estado no válido.")
                 return
             
-            photo_file_id = user_state.get('photo_file_id')
-            photo_file_unique_id = user_state.get('photo_file_unique_id')
+            photos = self._get_state_photos(user_state)
             
-            if not photo_file_id:
+            if not photos:
                 await query.edit_message_text("❌ Error: No se encontró la imagen.")
                 return
             
-            # Crear un objeto Photo simulado
-            class PhotoFile:
-                def __init__(self, file_id, file_unique_id):
-                    self.file_id = file_id
-                    self.file_unique_id = file_unique_id
-            
-            photo_file = PhotoFile(photo_file_id, photo_file_unique_id)
-            
             if action_type == 'attach_existing':
                 # Mostrar lista de tareas existentes
-                await self._ask_task_for_image_from_callback(query, update, context, photo_file, user)
+                await self._ask_task_for_image_from_callback(query, update, context, photos[0], user)
             elif action_type == 'create_new':
                 # Iniciar creación de nueva tarea con imagen adjunta
                 await query.edit_message_text(
@@ -1489,8 +1530,9 @@ class TelegramBotHandler:
                 # Cambiar estado para crear tarea con imagen
                 self.user_states[user.id] = {
                     'action': 'creating_task_with_image',
-                    'photo_file_id': photo_file_id,
-                    'photo_file_unique_id': photo_file_unique_id
+                    'photo_file_id': user_state.get('photo_file_id'),
+                    'photo_file_unique_id': user_state.get('photo_file_unique_id'),
+                    'photo_files': user_state.get('photo_files')
                 }
         
         elif action == 'assign_image_to_task':
@@ -1499,26 +1541,17 @@ class TelegramBotHandler:
             user_state = self.user_states.get(user.id)
             
             if user_state and user_state.get('action') == 'waiting_task_for_image':
-                # Asignar imagen directamente usando el file_id guardado
-                photo_file_id = user_state.get('photo_file_id')
-                photo_file_unique_id = user_state.get('photo_file_unique_id')
+                # Asignar imágenes directamente usando los file_id guardados
+                photos = self._get_state_photos(user_state)
                 
-                if not photo_file_id:
+                if not photos:
                     await query.edit_message_text("❌ Error: No se encontró la imagen.")
                     if user.id in self.user_states:
                         del self.user_states[user.id]
                     return
                 
-                # Crear un objeto Photo simulado para pasar al método
-                class PhotoFile:
-                    def __init__(self, file_id, file_unique_id):
-                        self.file_id = file_id
-                        self.file_unique_id = file_unique_id
-                
-                photo_file = PhotoFile(photo_file_id, photo_file_unique_id)
-                
-                # Asignar imagen a la tarea
-                await self._assign_image_to_task_from_callback(query, update, context, task_id, photo_file, user)
+                # Asignar imágenes a la tarea
+                await self._assign_image_to_task_from_callback(query, update, context, task_id, photos, user)
             else:
                 await query.edit_message_text("❌ Error: Estado no válido.")
     
@@ -1631,7 +1664,30 @@ class TelegramBotHandler:
         
         try:
             import calendar_sync
-            result = calendar_sync.create_calendar_event(task_id)
+            
+            if config.JOB_QUEUE_ENABLED:
+                # Se encola y se responde enseguida; el worker edita este mensaje al terminar
+                job_id = job_queue.enqueue(
+                    'calendar.create_event',
+                    {
+                        'task_id': task_id,
+                        'notify': {
+                            'chat_id': query.message.chat_id,
+                            'message_id': query.message.message_id,
+                            'error_prefix': '❌ Error al crear evento',
+                        },
+                    },
+                    idempotency_key=f"calendar:{task_id}"
+                )
+                job = self.db.get_job(job_id)
+                if job and job['status'] == 'done':
+                    # Pulsación repetida de un evento ya creado
+                    await query.edit_message_text(job['result'].get('message', '✅ Evento creado en Google Calendar.'))
+                else:
+                    await query.edit_message_text("⏳ Creando evento en Google Calendar...")
+                return
+            
+            result = await asyncio.to_thread(calendar_sync.create_calendar_event, task_id)
             
             if result.get('success'):
                 event_link = result.get('event_link', '')
@@ -1689,140 +1745,169 @@ class TelegramBotHandler:
             reply_markup=reply_markup
         )
     
+    def _task_filter_range(self, filter_code: str) -> tuple:
+        """Traduce un código de filtro a (nombre, argumentos de get_tasks_page)"""
+        today = datetime.now().date()
+        if filter_code == 'n':
+            return "Sin fecha", {'no_date': True}
+        if filter_code == 't':
+            return "Hoy", {'date_from': today.isoformat(), 'date_to': (today + timedelta(days=1)).isoformat()}
+        if filter_code == 'm':
+            tomorrow = today + timedelta(days=1)
+            return "Mañana", {'date_from': tomorrow.isoformat(), 'date_to': (tomorrow + timedelta(days=1)).isoformat()}
+        if filter_code == 'w':
+            # De lunes a domingo de esta semana
+            week_start = today - timedelta(days=today.weekday())
+            return "Esta semana", {'date_from': week_start.isoformat(),
+                                   'date_to': (week_start + timedelta(days=7)).isoformat()}
+        return "Todas", {}
+    
+    def _task_page_callback(self, list_code: str, filter_code: str, page: int, cursor: tuple = None) -> str:
+        """Codifica la página de un listado en callback_data (máximo 64 bytes)"""
+        task_date, task_id = cursor if cursor else ('', '')
+        data = f"{TASK_PAGE_PREFIX}{list_code}|{filter_code}|{page}|{task_date or ''}|{task_id}"
+        if len(data.encode('utf-8')) > CALLBACK_DATA_MAX_BYTES:
+            raise ValueError(f"callback_data demasiado largo: {data}")
+        return data
+    
+    def _parse_task_page_callback(self, data: str) -> tuple:
+        """Decodifica callback_data de paginación en (listado, filtro, página, cursor)"""
+        list_code, filter_code, page, task_date, task_id = data[len(TASK_PAGE_PREFIX):].split('|', 4)
+        cursor = (task_date or None, int(task_id)) if task_id else None
+        return list_code, filter_code, int(page), cursor
+    
+    def _format_task_date_prefix(self, task_date_str: str) -> str:
+        """Formatea fecha con prefijo: Hoy, Mañana o día de la semana"""
+        if not task_date_str:
+            return ""
+        task_dt = parse_task_date(task_date_str)
+        if not task_dt:
+            return ""
+        today = datetime.now().date()
+        
+        if task_dt.date() == today:
+            return "📆 Hoy"
+        elif task_dt.date() == today + timedelta(days=1):
+            return "🌅 Mañana"
+        else:
+            # Día de la semana en español
+            days_es = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+            return f"📅 {days_es[task_dt.weekday()]}"
+    
+    def _task_button_label(self, list_code: str, task: dict) -> str:
+        """Texto del botón de una tarea según el listado"""
+        priority_emoji = {
+            'urgent': '🔴',
+            'high': '🟠',
+            'normal': '🟡',
+            'low': '🟢'
+        }.get(task.get('priority', 'normal'), '🟡')
+        
+        if list_code == 'v':
+            task_title = task['title'][:30] + "..." if len(task['title']) > 30 else task['title']
+            date_prefix = ""
+            if task.get('task_date'):
+                date_prefix = self._format_task_date_prefix(task['task_date']) + " "
+            return f"{date_prefix}{priority_emoji} {task_title}"
+        
+        if list_code == 'a':
+            status_emoji = {
+                'open': '🟦',
+                'completed': '✅',
+                'cancelled': '❌'
+            }.get(task.get('status', 'open'), '🟦')
+            task_title = task['title'][:30] + "..." if len(task['title']) > 30 else task['title']
+            return f"{status_emoji} {priority_emoji} {task_title}"
+        
+        task_title = task['title'][:35] + "..." if len(task['title']) > 35 else task['title']
+        if list_code == 'i':
+            return f"📝 {task_title}"
+        return f"{priority_emoji} {task_title}"
+    
+    def _task_list_header(self, list_code: str, filter_name: str) -> str:
+        if list_code == 'v':
+            return f"📋 Selecciona una tarea para ver detalles ({filter_name}):"
+        if list_code == 'c':
+            return "✅ Selecciona la tarea que quieres completar:"
+        if list_code == 'i':
+            return "📷 ¿A qué tarea abierta quieres asignarla?"
+        return ("📝 Selecciona la tarea que quieres ampliar:\n\n"
+                "Después de seleccionar, envía un mensaje de voz con la ampliación.")
+    
+    def _build_task_page(self, user_id: int, list_code: str, filter_code: str = 'a',
+                         page: int = 1, cursor: tuple = None) -> tuple:
+        """
+        Construye una página de un listado de tareas (una sola consulta por keyset).
+        
+        Returns:
+            (tareas de la página, texto del mensaje, InlineKeyboardMarkup)
+        """
+        filter_name, filter_args = self._task_filter_range(filter_code)
+        tasks, next_cursor = self.db.get_tasks_page(
+            user_id,
+            statuses=TASK_LISTS[list_code]['statuses'],
+            after=cursor,
+            limit=TASK_PAGE_SIZE,
+            **filter_args
+        )
+        
+        action = TASK_LISTS[list_code]['action']
+        keyboard = [
+            [InlineKeyboardButton(self._task_button_label(list_code, task), callback_data=f"{action}:{task['id']}")]
+            for task in tasks
+        ]
+        
+        navigation = []
+        if page > 1:
+            navigation.append(InlineKeyboardButton(
+                "⏮ Primera", callback_data=self._task_page_callback(list_code, filter_code, 1)
+            ))
+        if next_cursor:
+            navigation.append(InlineKeyboardButton(
+                "Siguiente ▶️", callback_data=self._task_page_callback(list_code, filter_code, page + 1, next_cursor)
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        text = self._task_list_header(list_code, filter_name)
+        if navigation:
+            text += f"\n\nPágina {page}"
+        return tasks, text, InlineKeyboardMarkup(keyboard)
+    
+    async def _show_task_page_from_callback(self, query, update, data: str):
+        """Muestra otra página de un listado de tareas (botones Siguiente/Primera)"""
+        user = update.effective_user
+        list_code, filter_code, page, cursor = self._parse_task_page_callback(data)
+        if list_code not in TASK_LISTS:
+            await query.edit_message_text("❌ Listado no válido.", reply_markup=self._get_action_buttons())
+            return
+        
+        tasks, text, reply_markup = self._build_task_page(user.id, list_code, filter_code, page, cursor)
+        if not tasks:
+            await query.edit_message_text("✅ No hay más tareas.", reply_markup=self._get_action_buttons())
+            return
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    
     async def _show_filtered_tasks(self, query, update, filter_type: str):
         """Muestra tareas filtradas según el tipo de filtro"""
         user = update.effective_user
-        from datetime import datetime, timedelta
-        
-        # Obtener todas las tareas abiertas
-        all_tasks = self.db.get_tasks(user_id=user.id, status='open')
-        
-        # Aplicar filtro
-        if filter_type == 'all':
-            tasks = all_tasks
-            filter_name = "Todas"
-        elif filter_type == 'no_date':
-            tasks = [t for t in all_tasks if not t.get('task_date')]
-            filter_name = "Sin fecha"
-        elif filter_type == 'today':
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tasks = []
-            for task in all_tasks:
-                if task.get('task_date'):
-                    try:
-                        task_dt = datetime.fromisoformat(task['task_date'].replace('Z', '+00:00'))
-                        if task_dt.date() == today.date():
-                            tasks.append(task)
-                    except (ValueError, TypeError):
-                        pass
-            filter_name = "Hoy"
-        elif filter_type == 'tomorrow':
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tomorrow = today + timedelta(days=1)
-            tasks = []
-            for task in all_tasks:
-                if task.get('task_date'):
-                    try:
-                        task_dt = datetime.fromisoformat(task['task_date'].replace('Z', '+00:00'))
-                        if task_dt.date() == tomorrow.date():
-                            tasks.append(task)
-                    except (ValueError, TypeError):
-                        pass
-            filter_name = "Mañana"
-        elif filter_type == 'this_week':
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            # Lunes de esta semana
-            days_since_monday = today.weekday()
-            week_start = today - timedelta(days=days_since_monday)
-            week_end = week_start + timedelta(days=6)
-            tasks = []
-            for task in all_tasks:
-                if task.get('task_date'):
-                    try:
-                        task_dt = datetime.fromisoformat(task['task_date'].replace('Z', '+00:00'))
-                        if week_start.date() <= task_dt.date() <= week_end.date():
-                            tasks.append(task)
-                    except (ValueError, TypeError):
-                        pass
-            filter_name = "Esta semana"
-        else:
-            tasks = all_tasks
-            filter_name = "Todas"
+        filter_code = TASK_FILTER_CODES.get(filter_type, 'a')
         
-        # Mostrar lista interactiva con botones
+        tasks, text, reply_markup = self._build_task_page(user.id, 'v', filter_code)
         if not tasks:
+            filter_name, _ = self._task_filter_range(filter_code)
             await query.edit_message_text(
                 f"✅ No tienes tareas pendientes ({filter_name.lower()}).",
                 reply_markup=self._get_action_buttons()
             )
             return
         
-        # Función helper para formatear fecha con prefijo
-        def format_task_date_with_prefix(task_date_str):
-            """Formatea fecha con prefijo: Hoy, Mañana o día de la semana"""
-            if not task_date_str:
-                return ""
-            try:
-                from datetime import datetime
-                task_dt = datetime.fromisoformat(task_date_str.replace('Z', '+00:00'))
-                today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                tomorrow = today + timedelta(days=1)
-                
-                task_date_only = task_dt.date()
-                today_date = today.date()
-                tomorrow_date = tomorrow.date()
-                
-                if task_date_only == today_date:
-                    return "📆 Hoy"
-                elif task_date_only == tomorrow_date:
-                    return "🌅 Mañana"
-                else:
-                    # Día de la semana en español
-                    days_es = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
-                    day_name = days_es[task_dt.weekday()]
-                    return f"📅 {day_name}"
-            except:
-                return ""
-        
-        keyboard = []
-        for task in tasks[:10]:  # Máximo 10 tareas
-            priority_emoji = {
-                'urgent': '🔴',
-                'high': '🟠',
-                'normal': '🟡',
-                'low': '🟢'
-            }.get(task.get('priority', 'normal'), '🟡')
-            
-            task_title = task['title'][:30] + "..." if len(task['title']) > 30 else task['title']
-            
-            # Agregar prefijo de fecha si tiene fecha
-            date_prefix = ""
-            if task.get('task_date'):
-                date_prefix = format_task_date_with_prefix(task['task_date']) + " "
-            
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{date_prefix}{priority_emoji} {task_title}",
-                    callback_data=f"view_task:{task['id']}"
-                )
-            ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            f"📋 Selecciona una tarea para ver detalles ({filter_name}):\n\n"
-            f"Tienes {len(tasks)} tarea(s) pendiente(s).",
-            reply_markup=reply_markup
-        )
-        
-        if len(tasks) > 10:
-            message += f"\n... y {len(tasks) - 10} tarea(s) más."
-        
-        await query.edit_message_text(message, reply_markup=self._get_action_buttons())
+        await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def _show_close_tasks_menu(self, query, update):
         """Muestra menú para cerrar tareas"""
         user = update.effective_user
-        tasks = self.db.get_tasks(user_id=user.id, status='open', limit=10)
+        tasks, text, reply_markup = self._build_task_page(user.id, 'c')
         
         if not tasks:
             await query.edit_message_text(
@@ -1831,111 +1916,34 @@ class TelegramBotHandler:
             )
             return
         
-        keyboard = []
-        for task in tasks:
-            priority_emoji = {
-                'urgent': '🔴',
-                'high': '🟠',
-                'normal': '🟡',
-                'low': '🟢'
-            }.get(task.get('priority', 'normal'), '🟡')
-            
-            task_title = task['title'][:35] + "..." if len(task['title']) > 35 else task['title']
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{priority_emoji} {task_title}",
-                    callback_data=f"close_task:{task['id']}"
-                )
-            ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            f"✅ Selecciona la tarea que quieres completar:\n\n"
-            f"Tienes {len(tasks)} tarea(s) pendiente(s).",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def _show_close_tasks_menu_text(self, update, user):
         """Muestra menú para cerrar tareas (desde teclado de respuesta)"""
-        tasks = self.db.get_tasks(user_id=user.id, status='open', limit=10)
-        reply_markup = self._get_reply_keyboard()
+        tasks, text, inline_markup = self._build_task_page(user.id, 'c')
         
         if not tasks:
             await update.message.reply_text(
                 "✅ No tienes tareas pendientes para cerrar.",
-                reply_markup=reply_markup
+                reply_markup=self._get_reply_keyboard()
             )
             return
         
-        keyboard = []
-        for task in tasks:
-            priority_emoji = {
-                'urgent': '🔴',
-                'high': '🟠',
-                'normal': '🟡',
-                'low': '🟢'
-            }.get(task.get('priority', 'normal'), '🟡')
-            
-            task_title = task['title'][:35] + "..." if len(task['title']) > 35 else task['title']
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{priority_emoji} {task_title}",
-                    callback_data=f"close_task:{task['id']}"
-                )
-            ])
-        
-        inline_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            f"✅ Selecciona la tarea que quieres completar:\n\n"
-            f"Tienes {len(tasks)} tarea(s) pendiente(s).",
-            reply_markup=inline_markup
-        )
+        await update.message.reply_text(text, reply_markup=inline_markup)
     
     async def _show_ampliar_tasks_menu_text(self, update, user):
         """Muestra menú para ampliar tareas (desde teclado de respuesta)"""
-        # Obtener todas las tareas excepto las completadas
-        all_tasks = self.db.get_tasks(user_id=user.id, limit=20)
-        # Filtrar tareas completadas
-        tasks = [t for t in all_tasks if t.get('status') != 'completed']
-        reply_markup = self._get_reply_keyboard()
+        # Todas las tareas excepto las completadas
+        tasks, text, inline_markup = self._build_task_page(user.id, 'a')
         
         if not tasks:
             await update.message.reply_text(
                 "✅ No tienes tareas para ampliar (las tareas completadas no se muestran).",
-                reply_markup=reply_markup
+                reply_markup=self._get_reply_keyboard()
             )
             return
         
-        keyboard = []
-        for task in tasks:
-            priority_emoji = {
-                'urgent': '🔴',
-                'high': '🟠',
-                'normal': '🟡',
-                'low': '🟢'
-            }.get(task.get('priority', 'normal'), '🟡')
-            
-            status_emoji = {
-                'open': '🟦',
-                'completed': '✅',
-                'cancelled': '❌'
-            }.get(task.get('status', 'open'), '🟦')
-            
-            task_title = task['title'][:30] + "..." if len(task['title']) > 30 else task['title']
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{status_emoji} {priority_emoji} {task_title}",
-                    callback_data=f"select_task_for_ampliar:{task['id']}"
-                )
-            ])
-        
-        inline_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            f"📝 Selecciona la tarea que quieres ampliar:\n\n"
-            f"Después de seleccionar, envía un mensaje de voz con la ampliación.\n\n"
-            f"Tienes {len(tasks)} tarea(s).",
-            reply_markup=inline_markup
-        )
+        await update.message.reply_text(text, reply_markup=inline_markup)
     
     async def handle_photo_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Procesa mensajes con fotos/imágenes"""
@@ -1955,27 +1963,74 @@ class TelegramBotHandler:
         # Obtener la foto de mayor calidad (última en la lista)
         photo_file = photo[-1]
         
+        # Álbum: Telegram envía cada foto en un update distinto; se reúnen y se
+        # procesan juntas para que se suban en paralelo
+        media_group_id = update.message.media_group_id
+        if media_group_id:
+            key = (user.id, media_group_id)
+            group = self._media_groups.get(key)
+            if group is None:
+                group = self._media_groups[key] = {'update': update, 'photos': []}
+                self._run_in_background(self._process_media_group(key, context, user))
+            group['photos'].append(photo_file)
+            return
+        
+        await self._process_photos(update, context, [photo_file], user)
+    
+    async def _process_media_group(self, key, context: ContextTypes.DEFAULT_TYPE, user):
+        """Espera a que lleguen todas las fotos de un álbum y las procesa juntas"""
+        await asyncio.sleep(MEDIA_GROUP_WAIT_SECONDS)
+        group = self._media_groups.pop(key, None)
+        if not group:
+            return
+        
+        update = group['update']
+        try:
+            await self._process_photos(update, context, group['photos'], user)
+        except Exception as e:
+            logger.error(f"Error procesando álbum de fotos: {e}", exc_info=True)
+            await update.message.reply_text(
+                f"❌ Error al procesar las imágenes: {str(e)}",
+                reply_markup=self._get_reply_keyboard()
+            )
+    
+    async def _process_photos(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                              photo_files: list, user):
+        """Asigna las fotos a la tarea pendiente o pregunta qué hacer con ellas"""
         # Verificar si el usuario está esperando asignar imagen a una tarea
         user_state = self.user_states.get(user.id)
         if user_state and user_state.get('action') == 'assign_image_to_task':
-            # Asignar imagen a la tarea seleccionada
+            # Asignar imágenes a la tarea seleccionada
             task_id = user_state.get('task_id')
-            await self._assign_image_to_task(update, context, task_id, photo_file, user)
+            await self._assign_image_to_task(update, context, task_id, photo_files, user)
             # Limpiar estado
             del self.user_states[user.id]
             return
         
-        # Si no hay estado, preguntar qué hacer con la imagen
-        await self._ask_image_action(update, context, photo_file, user)
+        # Si no hay estado, preguntar qué hacer con las imágenes
+        await self._ask_image_action(update, context, photo_files, user)
+    
+    def _get_state_photos(self, user_state: dict) -> list:
+        """Fotos pendientes guardadas en el estado del usuario (una o varias de un álbum)"""
+        if not user_state:
+            return []
+        if user_state.get('photo_files'):
+            return [PhotoFile(p['file_id'], p['file_unique_id']) for p in user_state['photo_files']]
+        if user_state.get('photo_file_id'):
+            return [PhotoFile(user_state['photo_file_id'], user_state.get('photo_file_unique_id'))]
+        return []
     
     async def _ask_image_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                photo_file, user):
-        """Pregunta qué hacer con la imagen: adjuntar a tarea existente o crear nueva"""
-        # Guardar el file_id de la imagen en el estado
+                                photo_files: list, user):
+        """Pregunta qué hacer con las imágenes: adjuntar a tarea existente o crear nueva"""
+        # Guardar los file_id de las imágenes en el estado
         self.user_states[user.id] = {
             'action': 'waiting_image_action',
-            'photo_file_id': photo_file.file_id,
-            'photo_file_unique_id': photo_file.file_unique_id
+            'photo_file_id': photo_files[0].file_id,
+            'photo_file_unique_id': photo_files[0].file_unique_id,
+            'photo_files': [
+                {'file_id': p.file_id, 'file_unique_id': p.file_unique_id} for p in photo_files
+            ]
         }
         
         # Crear botones de acción
@@ -1988,16 +2043,17 @@ class TelegramBotHandler:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
+        received = "📷 Imagen recibida." if len(photo_files) == 1 else f"📷 {len(photo_files)} imágenes recibidas."
         await update.message.reply_text(
-            "📷 Imagen recibida. ¿Qué quieres hacer?",
+            f"{received} ¿Qué quieres hacer?",
             reply_markup=reply_markup
         )
     
     async def _ask_task_for_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
                                   photo_file, user):
         """Pregunta a qué tarea asignar la imagen"""
-        # Obtener solo tareas abiertas del usuario
-        tasks = self.db.get_tasks(user_id=user.id, status='open', limit=20)
+        # Solo tareas abiertas del usuario
+        tasks, text, reply_markup = self._build_task_page(user.id, 'i')
         
         if not tasks:
             await update.message.reply_text(
@@ -2006,42 +2062,24 @@ class TelegramBotHandler:
             )
             # Cambiar acción para permitir crear nueva tarea
             if user.id in self.user_states:
-                self.user_states[user.id]['action'] = 'waiting_image_action'
+                self.user_states.update(user.id, action='waiting_image_action')
             return
         
         # Actualizar estado para esperar selección de tarea
         if user.id in self.user_states:
-            self.user_states[user.id]['action'] = 'waiting_task_for_image'
-        
-        # Crear botones con las tareas (solo abiertas)
-        keyboard = []
-        for task in tasks[:10]:  # Máximo 10 tareas
-            task_title = task['title'][:35] + "..." if len(task['title']) > 35 else task['title']
-            
-            keyboard.append([InlineKeyboardButton(
-                f"📝 {task_title}",
-                callback_data=f"assign_image_to_task:{task['id']}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+            self.user_states.update(user.id, action='waiting_task_for_image')
         
         # Si es callback query, editar mensaje; si no, enviar nuevo mensaje
         if hasattr(update, 'callback_query') and update.callback_query:
-            await update.callback_query.edit_message_text(
-                "📷 ¿A qué tarea abierta quieres asignarla?",
-                reply_markup=reply_markup
-            )
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
         else:
-            await update.message.reply_text(
-                "📷 ¿A qué tarea abierta quieres asignarla?",
-                reply_markup=reply_markup
-            )
+            await update.message.reply_text(text, reply_markup=reply_markup)
     
     async def _ask_task_for_image_from_callback(self, query, update: Update, context: ContextTypes.DEFAULT_TYPE,
                                                 photo_file, user):
         """Pregunta a qué tarea asignar la imagen desde un callback"""
-        # Obtener solo tareas abiertas del usuario
-        tasks = self.db.get_tasks(user_id=user.id, status='open', limit=20)
+        # Solo tareas abiertas del usuario
+        tasks, text, reply_markup = self._build_task_page(user.id, 'i')
         
         if not tasks:
             await query.edit_message_text(
@@ -2050,36 +2088,23 @@ class TelegramBotHandler:
             )
             # Cambiar acción para permitir crear nueva tarea
             if user.id in self.user_states:
-                self.user_states[user.id]['action'] = 'waiting_image_action'
+                self.user_states.update(user.id, action='waiting_image_action')
             return
         
         # Actualizar estado para esperar selección de tarea
         if user.id in self.user_states:
-            self.user_states[user.id]['action'] = 'waiting_task_for_image'
-        
-        # Crear botones con las tareas (solo abiertas)
-        keyboard = []
-        for task in tasks[:10]:  # Máximo 10 tareas
-            task_title = task['title'][:35] + "..." if len(task['title']) > 35 else task['title']
-            
-            keyboard.append([InlineKeyboardButton(
-                f"📝 {task_title}",
-                callback_data=f"assign_image_to_task:{task['id']}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+            self.user_states.update(user.id, action='waiting_task_for_image')
         
-        await query.edit_message_text(
-            "📷 ¿A qué tarea abierta quieres asignarla?",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(text, reply_markup=reply_markup)
     
-    async def _save_image_to_storage(self, context: ContextTypes.DEFAULT_TYPE, photo_file, task_id: int) -> str:
+    async def _save_image_to_storage(self, context: ContextTypes.DEFAULT_TYPE, photo_file, task_id: int) -> int:
         """
-        Descarga una imagen de Telegram y la guarda en SFTP (si está disponible) o localmente
+        Descarga una imagen de Telegram, la registra en la tarea con su ruta local
+        y encola la subida a SFTP (si está disponible). La ruta de la imagen se
+        actualiza a la remota cuando termina la subida.
         
         Returns:
-            Ruta remota del archivo (SFTP) o ruta local si SFTP no está disponible
+            ID de la imagen en la base de datos
         """
         # Descargar la imagen de Telegram
         file = await context.bot.get_file(photo_file.file_id)
@@ -2088,30 +2113,31 @@ class TelegramBotHandler:
         images_dir = os.path.join(config.TEMP_DIR, 'task_images')
         os.makedirs(images_dir, exist_ok=True)
         
-        # Guardar imagen localmente temporalmente
+        # Guardar imagen localmente (se sirve desde aquí hasta que llegue a SFTP)
         local_file_path = os.path.join(images_dir, f"{task_id}_{photo_file.file_unique_id}.jpg")
         await file.download_to_drive(local_file_path)
         
-        # Intentar subir a SFTP si está disponible
-        remote_path = local_file_path  # Por defecto, usar ruta local
+        # 'pending': se sirve la copia local hasta que la subida a SFTP termine
+        upload_state = 'pending' if sftp_storage.enabled else 'local'
+        image_id = self.db.add_image_to_task(task_id, photo_file.file_id, local_file_path, upload_state)
+        
         logger.info(f"SFTP habilitado: {sftp_storage.enabled}")
         if sftp_storage.enabled:
-            try:
-                logger.info(f"Intentando subir imagen a SFTP: {local_file_path}")
-                remote_filename = f"{task_id}_{photo_file.file_unique_id}.jpg"
-                logger.info(f"Nombre remoto: {remote_filename}, Ruta remota: {sftp_storage.remote_path}")
-                remote_path = sftp_storage.upload_image(local_file_path, remote_filename)
-                logger.info(f"✅ Imagen subida exitosamente a SFTP: {remote_path}")
-                # Borrar archivo local después de subir a SFTP
+            payload = {
+                'image_id': image_id,
+                'local_path': local_file_path,
+                'remote_filename': f"{task_id}_{photo_file.file_unique_id}.jpg",
+            }
+            if config.JOB_QUEUE_ENABLED:
+                job_queue.enqueue('images.upload', payload, idempotency_key=f"image:{image_id}")
+            else:
                 try:
-                    os.remove(local_file_path)
-                    logger.info(f"Archivo local borrado: {local_file_path}")
+                    await asyncio.to_thread(upload_image_job, payload)
+                    logger.info(f"✅ Imagen subida exitosamente a SFTP: {local_file_path}")
                 except Exception as e:
-                    logger.warning(f"No se pudo borrar archivo local después de subir a SFTP: {e}")
-            except Exception as e:
-                logger.error(f"❌ Error subiendo imagen a SFTP, usando almacenamiento local: {e}", exc_info=True)
-                # Si falla SFTP, mantener archivo local
-                remote_path = local_file_path
+                    # Si falla SFTP, mantener archivo local
+                    logger.error(f"❌ Error subiendo imagen a SFTP, usando almacenamiento local: {e}", exc_info=True)
+                    self.db.update_task_image_path(image_id, local_file_path, upload_state='local')
         else:
             logger.warning(
                 f"⚠️ SFTP no está habilitado. "
@@ -2121,25 +2147,30 @@ class TelegramBotHandler:
                 f"Paramiko disponible: {PARAMIKO_AVAILABLE}"
             )
         
-        return remote_path
+        return image_id
+    
+    async def _save_images_to_storage(self, context: ContextTypes.DEFAULT_TYPE, photo_files: list,
+                                      task_id: int) -> list:
+        """Guarda varias imágenes de una tarea en paralelo (descargas y subidas simultáneas)"""
+        return await asyncio.gather(*(
+            self._save_image_to_storage(context, photo_file, task_id) for photo_file in photo_files
+        ))
     
     async def _assign_image_to_task(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
-                                   task_id: int, photo_file, user):
-        """Asigna una imagen a una tarea"""
+                                   task_id: int, photo_files: list, user):
+        """Asigna una o varias imágenes a una tarea"""
         reply_markup = self._get_reply_keyboard()
         
         try:
-            # Guardar imagen (local y SFTP)
-            remote_path = await self._save_image_to_storage(context, photo_file, task_id)
-            
-            # Guardar en base de datos (ruta remota)
-            self.db.add_image_to_task(task_id, photo_file.file_id, remote_path)
+            # Guardar imágenes (local ahora, SFTP en segundo plano)
+            await self._save_images_to_storage(context, photo_files, task_id)
             
             task = self.db.get_task_by_id(task_id)
             task_title = task['title'] if task else f"Tarea #{task_id}"
+            assigned = "✅ Imagen asignada" if len(photo_files) == 1 else f"✅ {len(photo_files)} imágenes asignadas"
             
             await update.message.reply_text(
-                f"✅ Imagen asignada a la tarea:\n\n"
+                f"{assigned} a la tarea:\n\n"
                 f"📝 {task_title}",
                 reply_markup=reply_markup
             )
@@ -2151,23 +2182,21 @@ class TelegramBotHandler:
             )
     
     async def _assign_image_to_task_from_callback(self, query, update: Update, context: ContextTypes.DEFAULT_TYPE,
-                                                  task_id: int, photo_file, user):
-        """Asigna una imagen a una tarea desde un callback"""
+                                                  task_id: int, photo_files: list, user):
+        """Asigna una o varias imágenes a una tarea desde un callback"""
         try:
-            # Guardar imagen (local y SFTP)
-            remote_path = await self._save_image_to_storage(context, photo_file, task_id)
-            
-            # Guardar en base de datos (ruta remota)
-            self.db.add_image_to_task(task_id, photo_file.file_id, remote_path)
+            # Guardar imágenes (local ahora, SFTP en segundo plano)
+            await self._save_images_to_storage(context, photo_files, task_id)
             
             task = self.db.get_task_by_id(task_id)
             task_title = task['title'] if task else f"Tarea #{task_id}"
+            assigned = "✅ Imagen asignada" if len(photo_files) == 1 else f"✅ {len(photo_files)} imágenes asignadas"
             
             # Limpiar estado
             del self.user_states[user.id]
             
             await query.edit_message_text(
-                f"✅ Imagen asignada a la tarea:\n\n"
+                f"{assigned} a la tarea:\n\n"
                 f"📝 {task_title}"
             )
         except Exception as e:
@@ -2327,8 +2356,7 @@ class TelegramBotHandler:
                 category_names = [c.strip() for c in categories_str.split(',') if c.strip()]
                 
                 # Verificar que las categorías existen
-                all_categories = self.db.get_all_categories()
-                valid_categories = [cat['name'] for cat in all_categories]
+                valid_categories = self.db.get_category_names()
                 invalid_categories = [c for c in category_names if c not in valid_categories]
                 
                 if invalid_categories:
@@ -2395,8 +2423,8 @@ class TelegramBotHandler:
             message_parts.append(f"\n👤 Cliente: {task['client_name_raw']} (sin asociar)")
         
         # Fecha
-        if task.get('task_date'):
-            task_dt = datetime.fromisoformat(task['task_date'].replace('Z', '+00:00'))
+        task_dt = parse_task_date(task.get('task_date'))
+        if task_dt:
             date_str = format_date(task_dt)
             if task_dt.hour != 0 or task_dt.minute != 0:
                 date_str += f" {task_dt.strftime('%H:%M')}"
@@ -2404,8 +2432,7 @@ class TelegramBotHandler:
         
         # Categoría
         if task.get('category'):
-            categories = self.db.get_all_categories()
-            category_obj = next((c for c in categories if c['name'] == task['category']), None)
+            category_obj = self.db.get_category(task['category'])
             if category_obj:
                 message_parts.append(f"\n📂 Categoría: {category_obj['icon']} {category_obj['display_name']}")
             else:
@@ -0,0 +1,275 @@
+"""Runtime único del bot de Telegram compartido por todos los workers de gunicorn"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+from typing import Callable, Dict, Optional
+from telegram import Update
+import config
+
+logger = logging.getLogger(__name__)
+
+# Timeout al reenviar un update al líder por el socket Unix
+FORWARD_TIMEOUT_SECONDS = 5
+
+# Reintentos de la inicialización del Application (espera inicial y máxima, con backoff exponencial)
+STARTUP_RETRY_SECONDS = 1
+STARTUP_RETRY_MAX_SECONDS = 60
+
+
+class TelegramRuntime:
+    """
+    Event loop del Application de Telegram con elección de líder.
+    
+    Solo el proceso que consigue el lock de fichero (el líder) inicializa el
+    Application y mantiene su loop; escucha en un socket Unix los updates que
+    le reenvían los demás workers. Si el líder desaparece, el siguiente worker
+    que no consiga reenviarle un update toma el lock y pasa a ser el líder.
+    """
+    
+    def __init__(self, application, lock_path: str = None, socket_path: str = None,
+                 on_leader: Optional[Callable] = None):
+        self.application = application
+        self.lock_path = lock_path or config.TELEGRAM_LEADER_LOCK_PATH
+        self.socket_path = socket_path or config.TELEGRAM_RUNTIME_SOCKET
+        self.on_leader = on_leader  # Se llama una vez cuando este proceso pasa a ser el líder
+        self.loop = None
+        self.thread = None
+        self.initialized = False
+        self.processed = 0
+        self.forwarded = 0
+        self._lock_file = None
+        self._server = None
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._tasks = set()
+    
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+    
+    def _acquire_leadership(self) -> bool:
+        """Intenta coger el lock exclusivo (no bloqueante). El SO lo libera si el proceso muere"""
+        if self._lock_file is not None:
+            return True
+        
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        logger.info(f"[RUNTIME] Proceso {os.getpid()} elegido líder del runtime de Telegram")
+        return True
+    
+    def start(self, polling: bool = False) -> bool:
+        """
+        Arranca el runtime si este proceso consigue ser el líder.
+        
+        Args:
+            polling: True para recibir updates por polling (desarrollo local)
+                en lugar de por el socket de los workers
+        
+        Returns:
+            True si este proceso es el líder
+        """
+        with self._start_lock:
+            if self.thread is not None or self.is_leader:
+                return self.is_leader
+            
+            if not self._acquire_leadership():
+                logger.info(f"[RUNTIME] Proceso {os.getpid()} reenviará los updates al líder")
+                return False
+            
+            if self.on_leader:
+                try:
+                    self.on_leader()
+                except Exception as e:
+                    logger.error(f"[RUNTIME] Error arrancando servicios del líder: {e}", exc_info=True)
+            
+            if self.application is None:
+                return True
+            
+            self._stopping.clear()
+            self.thread = threading.Thread(target=self._run, args=(polling,), daemon=True, name="telegram_loop")
+            self.thread.start()
+        
+        if not self._ready.wait(config.TELEGRAM_RUNTIME_START_TIMEOUT_SECONDS):
+            logger.warning("[RUNTIME] El Application sigue inicializándose tras el timeout de arranque")
+        return True
+    
+    def _run(self, polling: bool):
+        """Thread del event loop del Application"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        
+        # Un fallo transitorio al arrancar (red, API de Telegram) no puede dejar al líder
+        # sin Application hasta reiniciar el proceso: se reintenta mientras tenga el lock
+        delay = STARTUP_RETRY_SECONDS
+        while not self._stopping.is_set():
+            try:
+                logger.info("[RUNTIME] Inicializando Application...")
+                loop.run_until_complete(self._startup(polling))
+                self.initialized = True
+                logger.info("[RUNTIME] ✅ Application inicializado")
+                break
+            except Exception as e:
+                logger.error(f"[RUNTIME] Error inicializando Application (reintento en {delay}s): {e}", exc_info=True)
+            finally:
+                self._ready.set()
+            self._stopping.wait(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+        
+        if not self.initialized:
+            self.loop = None
+            loop.close()
+            return
+        
+        try:
+            loop.run_forever()
+        except Exception as e:
+            logger.error(f"[RUNTIME] Error en loop: {e}", exc_info=True)
+        finally:
+            loop.run_until_complete(self._shutdown())
+            loop.close()
+    
+    async def _startup(self, polling: bool):
+        await self.application.initialize()
+        if polling:
+            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+            await self.application.start()
+            return
+        
+        # El lock garantiza que un socket existente es de un líder anterior ya muerto
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"[RUNTIME] Escuchando updates de los workers en {self.socket_path}")
+    
+    async def _shutdown(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.application.updater and self.application.updater.running:
+            await self.application.updater.stop()
+        if self.application.running:
+            await self.application.stop()
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Recibe un update reenviado por otro worker (JSON hasta EOF) y confirma con 'ok'"""
+        try:
+            data = await reader.read()
+            self._dispatch(json.loads(data.decode('utf-8')))
+            writer.write(b'ok')
+        except Exception as e:
+            logger.error(f"[RUNTIME] Update reenviado no válido: {e}", exc_info=True)
+            writer.write(b'error')
+        finally:
+            try:
+                await writer.drain()
+            finally:
+                writer.close()
+    
+    def _dispatch(self, update_data: Dict):
+        """Programa el procesamiento de un update en el loop (se ejecuta dentro del loop)"""
+        update = Update.de_json(update_data, self.application.bot)
+        task = self.loop.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _process(self, update: Update):
+        try:
+            await self.application.process_update(update)
+            self.processed += 1
+            logger.info(f"[RUNTIME] Actualización {update.update_id} procesada")
+        except Exception as e:
+            logger.error(f"[RUNTIME] Error procesando actualización {update.update_id}: {e}", exc_info=True)
+    
+    def _forward(self, update_data: Dict):
+        """Reenvía un update al líder por el socket Unix"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(FORWARD_TIMEOUT_SECONDS)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(update_data, separators=(',', ':')).encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            ack = sock.recv(16)
+        if ack != b'ok':
+            raise OSError(f"Respuesta inesperada del líder: {ack!r}")
+    
+    def submit_update(self, update_data: Dict) -> str:
+        """
+        Entrega un update al runtime sin esperar a que se procese.
+        
+        Returns:
+            'local' si lo procesa este proceso, 'forwarded' si se reenvió al líder
+        
+        Raises:
+            RuntimeError si no hay ningún líder disponible (Telegram reintentará)
+        """
+        if not self.is_leader:
+            try:
+                self._forward(update_data)
+                self.forwarded += 1
+                return 'forwarded'
+            except OSError as e:
+                logger.warning(f"[RUNTIME] No se pudo reenviar el update al líder: {e}")
+            
+            # El líder no responde: intentar tomar el relevo
+            if not self.start():
+                raise RuntimeError("El runtime de Telegram no está disponible")
+        
+        if self.thread is None:
+            self.start()
+        if not self.initialized:
+            raise RuntimeError("El Application de Telegram no está inicializado")
+        
+        self.loop.call_soon_threadsafe(self._dispatch, update_data)
+        return 'local'
+    
+    def run_coroutine(self, coro, timeout: float = 30):
+        """Ejecuta una corrutina en el loop del Application desde otro thread y espera el resultado"""
+        if not self.initialized:
+            coro.close()
+            raise RuntimeError("El Application de Telegram no está inicializado en este proceso")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=timeout)
+    
+    def stop(self, timeout: float = 5):
+        """Detiene el loop y libera el lock de líder"""
+        self._stopping.set()
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.loop = None
+        self.initialized = False
+        self._ready.clear()
+        
+        if self._lock_file is not None:
+            if self.application is not None and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def status(self) -> Dict:
+        """Estado del runtime para /health"""
+        return {
+            'pid': os.getpid(),
+            'leader': self.is_leader,
+            'initialized': self.initialized,
+            'processed_updates': self.processed,
+            'forwarded_updates': self.forwarded,
+        }
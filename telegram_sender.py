@@ -0,0 +1,267 @@
+"""Planificador de envíos a Telegram: límites de velocidad, reintentos y coalescencia"""
+import asyncio
+import logging
+import threading
+import time
+import warnings
+from collections import deque
+from datetime import timedelta
+from typing import Any, Dict, Optional
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import config
+
+logger = logging.getLogger(__name__)
+
+# Ediciones que se pueden fusionar: si llega otra para el mismo mensaje antes de
+# enviarse, solo se envía la última
+COALESCED_EDIT_ENDPOINTS = ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup')
+
+# Telegram muestra una acción de chat ("escribiendo...") durante unos 5 segundos
+CHAT_ACTION_TTL_SECONDS = 5
+
+# Número de muestras de latencia que se guardan para las métricas
+LATENCY_SAMPLES = 500
+
+
+class TokenBucket:
+    """Token bucket: 'rate' tokens por segundo con ráfagas de hasta 'capacity'"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Pausa impuesta por un RetryAfter de Telegram
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now: float = None) -> float:
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+    
+    def consume(self):
+        self.tokens -= 1
+    
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _PendingEdit:
+    """Edición en espera; 'replacement' es el future de la edición que la sustituye"""
+    
+    __slots__ = ('future', 'replacement')
+    
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.replacement: Optional[asyncio.Future] = None
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Rate limiter para el Application de PTB: todas las llamadas del bot pasan por aquí.
+    
+    - Token bucket global y otro por chat (más restrictivo en grupos)
+    - Reintento automático tras un RetryAfter (429), pausando ese chat
+    - Coalescencia de ediciones consecutivas del mismo mensaje
+    - Descarta acciones de chat redundantes o que tendrían que esperar
+    """
+    
+    def __init__(self, global_rate: float = None, chat_rate: float = None, chat_burst: float = None,
+                 group_rate: float = None, max_retries: int = None):
+        self.global_bucket = TokenBucket(global_rate or config.TELEGRAM_GLOBAL_RATE,
+                                         global_rate or config.TELEGRAM_GLOBAL_RATE)
+        self.chat_rate = chat_rate or config.TELEGRAM_CHAT_RATE
+        self.chat_burst = chat_burst or config.TELEGRAM_CHAT_BURST
+        self.group_rate = group_rate or config.TELEGRAM_GROUP_RATE
+        self.max_retries = config.TELEGRAM_SEND_MAX_RETRIES if max_retries is None else max_retries
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._chat_actions: Dict[tuple, float] = {}  # (chat_id, action) -> último envío
+        self._edits: Dict[tuple, _PendingEdit] = {}  # (endpoint, chat_id, message_id) -> última edición
+        self._queue_depth = 0
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._counters = {
+            'sent': 0,
+            'retried': 0,
+            'coalesced': 0,
+            'dropped_chat_actions': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+        }
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 1000:
+                self._prune_buckets()
+            # Los grupos (ids negativos) tienen un límite mucho menor que los chats privados
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+    
+    def _prune_buckets(self):
+        """Elimina buckets de chats sin actividad reciente"""
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chat_buckets.items() if b.is_idle(now)]:
+            del self._chat_buckets[chat_id]
+        for key in [k for k, t in self._chat_actions.items() if now - t > CHAT_ACTION_TTL_SECONDS]:
+            del self._chat_actions[key]
+    
+    async def _acquire(self, chat_id, pending_edit: _PendingEdit = None) -> bool:
+        """
+        Espera turno en el bucket global y en el del chat.
+        
+        Returns:
+            False si mientras esperaba llegó una edición más reciente del mismo mensaje
+        """
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        self._queue_depth += 1
+        with self._metrics_lock:
+            self._counters['max_queue_depth'] = max(self._counters['max_queue_depth'], self._queue_depth)
+        try:
+            while True:
+                if pending_edit is not None and pending_edit.replacement is not None:
+                    return False
+                now = time.monotonic()
+                wait = self.global_bucket.delay(now)
+                if chat_bucket is not None:
+                    wait = max(wait, chat_bucket.delay(now))
+                if wait <= 0:
+                    self.global_bucket.consume()
+                    if chat_bucket is not None:
+                        chat_bucket.consume()
+                    return True
+                await asyncio.sleep(wait)
+        finally:
+            self._queue_depth -= 1
+    
+    def _drop_chat_action(self, chat_id, action) -> bool:
+        """Una acción de chat se descarta si ya está visible o si habría que esperar para enviarla"""
+        now = time.monotonic()
+        key = (chat_id, action)
+        last = self._chat_actions.get(key)
+        if last is not None and now - last < CHAT_ACTION_TTL_SECONDS:
+            return True
+        if self.global_bucket.delay(now) > 0 or self._chat_bucket(chat_id).delay(now) > 0:
+            return True
+        self._chat_actions[key] = now
+        return False
+    
+    def _clear_chat_actions(self, chat_id):
+        for key in [k for k in self._chat_actions if k[0] == chat_id]:
+            del self._chat_actions[key]
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        started = time.monotonic()
+        chat_id = data.get('chat_id')
+        
+        if endpoint == 'sendChatAction' and chat_id is not None:
+            if self._drop_chat_action(chat_id, data.get('action')):
+                with self._metrics_lock:
+                    self._counters['dropped_chat_actions'] += 1
+                return True
+        
+        edit_key = None
+        pending_edit = None
+        if endpoint in COALESCED_EDIT_ENDPOINTS and chat_id is not None and data.get('message_id'):
+            edit_key = (endpoint, chat_id, data['message_id'])
+            pending_edit = _PendingEdit(asyncio.get_running_loop().create_future())
+            previous = self._edits.get(edit_key)
+            if previous is not None:
+                previous.replacement = pending_edit.future
+            self._edits[edit_key] = pending_edit
+        
+        try:
+            if chat_id is not None and not await self._acquire(chat_id, pending_edit):
+                # Sustituida por una edición posterior del mismo mensaje: devolver su resultado
+                with self._metrics_lock:
+                    self._counters['coalesced'] += 1
+                result = await asyncio.shield(pending_edit.replacement)
+            else:
+                result = await self._send_with_retries(callback, args, kwargs, endpoint, chat_id)
+                if chat_id is not None and endpoint.startswith('send') and endpoint != 'sendChatAction':
+                    # Al llegar un mensaje Telegram quita la acción de chat: la siguiente ya no es redundante
+                    self._clear_chat_actions(chat_id)
+            if pending_edit is not None:
+                pending_edit.future.set_result(result)
+            return result
+        except BaseException as e:
+            if pending_edit is not None and not pending_edit.future.done():
+                pending_edit.future.set_exception(e)
+                # Evita el aviso de excepción no recuperada si nadie más la espera
+                pending_edit.future.exception()
+            raise
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) is pending_edit:
+                del self._edits[edit_key]
+            with self._metrics_lock:
+                self._latencies.append(time.monotonic() - started)
+    
+    async def _send_with_retries(self, callback, args, kwargs, endpoint: str, chat_id):
+        attempt = 0
+        while True:
+            try:
+                result = await callback(*args, **kwargs)
+                with self._metrics_lock:
+                    self._counters['sent'] += 1
+                return result
+            except RetryAfter as e:
+                with warnings.catch_warnings():
+                    # PTB 22 avisa de que retry_after pasará a ser un timedelta; se aceptan ambos
+                    warnings.simplefilter('ignore')
+                    retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+                if attempt >= self.max_retries:
+                    with self._metrics_lock:
+                        self._counters['errors'] += 1
+                    raise
+                attempt += 1
+                with self._metrics_lock:
+                    self._counters['retried'] += 1
+                logger.warning(f"[SENDER] 429 en {endpoint} (chat {chat_id}), reintento {attempt} en {seconds}s")
+                # Pausar el chat afectado (o todos los envíos si no hay chat)
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+                await asyncio.sleep(seconds)
+                if chat_id is not None:
+                    await self._acquire(chat_id)
+            except Exception:
+                with self._metrics_lock:
+                    self._counters['errors'] += 1
+                raise
+    
+    def stats(self) -> Dict:
+        """Métricas para /health: profundidad de la cola y latencia de envío"""
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._counters)
+        stats['queue_depth'] = self._queue_depth
+        stats['tracked_chats'] = len(self._chat_buckets)
+        if latencies:
+            stats['latency_ms'] = {
+                'avg': round(sum(latencies) / len(latencies) * 1000, 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                'max': round(latencies[-1] * 1000, 1),
+            }
+        else:
+            stats['latency_ms'] = None
+        return stats
@@ -0,0 +1,16 @@
+"""Fixtures comunes de los tests"""
+import pytest
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Base de datos temporal en disco"""
+    return database.Database(str(tmp_path / 'test.db'))
+
+
+@pytest.fixture
+def global_db(db, monkeypatch):
+    """La base de datos temporal también como instancia global (database.db), para el código que la usa así"""
+    monkeypatch.setattr(database, 'db', db)
+    return db
@@ -0,0 +1,152 @@
+"""Tests para la API JSON de tareas y las páginas del panel: paginación por cursor, proyección, ETags y compresión"""
+import gzip
+import json
+import re
+import pytest
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture
+def client(db):
+    import app
+    return app.app.test_client()
+
+
+def _create_tasks(db, count=25):
+    return [db.create_task(user_id=1 + i % 2, user_name='Ana', title=f'Tarea {i}') for i in range(count)]
+
+
+def test_cursor_pages_cover_all_tasks(db, client):
+    """Test que recorrer las páginas devuelve todas las tareas una vez, con filtros en SQL"""
+    task_ids = _create_tasks(db)
+    seen = []
+    cursor = None
+    while True:
+        query = {'limit': 4, 'user_id': 1, **({'cursor': cursor} if cursor else {})}
+        data = client.get('/api/tasks', query_string=query).get_json()
+        seen.extend(task['id'] for task in data['tasks'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    
+    assert seen == [task_id for task_id in task_ids if db.get_task_by_id(task_id)['user_id'] == 1]
+
+
+def test_fields_and_updated_since(db, client):
+    """Test que fields limita las columnas y updated_since devuelve solo lo modificado"""
+    task_ids = _create_tasks(db, 3)
+    conn = db.get_connection()
+    conn.execute("UPDATE tasks SET updated_at = '2026-01-01 00:00:00'")
+    conn.commit()
+    conn.close()
+    db.update_task(task_ids[1], title='Cambiada')
+    
+    data = client.get('/api/tasks?fields=title&updated_since=2026-02-01T00:00:00Z').get_json()
+    
+    assert data['tasks'] == [{'id': task_ids[1], 'created_at': data['tasks'][0]['created_at'], 'title': 'Cambiada'}]
+    assert client.get('/api/tasks?fields=password').status_code == 400
+    assert client.get('/api/tasks?cursor=no-vale').status_code == 400
+
+
+def test_etag_not_modified_until_change(db, client):
+    """Test que el ETag permite responder 304 hasta que cambia alguna tarea"""
+    task_ids = _create_tasks(db, 3)
+    first = client.get('/api/tasks')
+    etag = first.headers['ETag']
+    
+    assert client.get('/api/tasks', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/tasks?status=open', headers={'If-None-Match': etag}).status_code == 200
+    
+    db.update_task(task_ids[0], title='Cambiada')
+    assert client.get('/api/tasks', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_gzip_and_jsonl_stream(db, client):
+    """Test que las respuestas grandes van comprimidas y el modo jsonl devuelve una tarea por línea"""
+    task_ids = _create_tasks(db, 60)
+    
+    response = client.get('/api/tasks?limit=1000', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.data))['tasks']) == 60
+    
+    response = client.get('/api/tasks?format=jsonl&fields=title', headers={'Accept-Encoding': 'gzip'})
+    assert response.is_streamed
+    lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+    assert [json.loads(line)['id'] for line in lines] == task_ids
+
+
+def test_calendar_week_returns_only_that_week(db, client):
+    """Test que /api/calendar/week devuelve por día solo las tareas visibles de la semana pedida"""
+    from datetime import date, timedelta
+    monday = date.today() - timedelta(days=date.today().weekday()) + timedelta(weeks=1)
+    user_id = db.create_web_user('tecnico', 'hash', 'Técnico')
+    db.set_user_categories(user_id, ['visitas'])
+    visit = db.create_task(1, 'Ana', 'Visita', task_date=f'{monday + timedelta(days=2)}T10:00:00', category='visitas')
+    db.create_task(1, 'Ana', 'Llamada', task_date=f'{monday + timedelta(days=2)}T11:00:00', category='llamar')
+    db.create_task(1, 'Ana', 'Otra semana', task_date=f'{monday + timedelta(days=7)}T10:00:00')
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    
+    data = client.get('/api/calendar/week?week_offset=1').get_json()
+    
+    assert data['week_start'] == monday.isoformat()
+    assert [day['date'] for day in data['days']] == [(monday + timedelta(days=i)).isoformat() for i in range(7)]
+    assert [[task['id'] for task in day['tasks']] for day in data['days']] == [[], [], [visit], [], [], [], []]
+    assert data['categories']['visitas']['display_name'] == 'Visitas'
+    assert client.get('/api/calendar/week?week_offset=1&search=nada').get_json()['days'][2]['tasks'] == []
+
+
+def test_calendar_week_includes_archive_on_request(db, client):
+    """Test que la semana aplica los mismos filtros que la lista, incluido archive=1"""
+    from datetime import date, timedelta
+    monday = date.today() - timedelta(days=date.today().weekday()) + timedelta(weeks=1)
+    archived = db.create_task(1, 'Ana', 'Revisión anual', task_date=f'{monday}T09:00:00')
+    db.update_task(archived, status='completed')
+    conn = db.get_connection()
+    conn.execute("UPDATE tasks SET updated_at = datetime('now', '-100 days') WHERE id = ?", (archived,))
+    conn.commit()
+    conn.close()
+    assert db.archive_tasks(90) == 1
+    with client.session_transaction() as session:
+        session['user_id'] = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    
+    week = '/api/calendar/week?week_offset=1&status=completed'
+    assert client.get(week).get_json()['days'][0]['tasks'] == []
+    assert [task['id'] for task in client.get(f'{week}&archive=1').get_json()['days'][0]['tasks']] == [archived]
+    assert client.get(f'{week}&archive=1&priority=urgente').get_json()['days'][0]['tasks'] == []
+
+
+def test_tasks_page_renders_first_page_and_fragments(db, client, monkeypatch):
+    """Test que /admin/tasks pinta solo la primera página y /admin/tasks/page trae el resto por cursor"""
+    import config
+    monkeypatch.setattr(config, 'TASKS_PAGE_SIZE', 4)
+    dated = [db.create_task(1, 'Ana', f'Con fecha {i}', task_date=f'2026-03-{i + 1:02d}T10:00:00') for i in range(10)]
+    undated = [db.create_task(1, 'Ana', f'Sin fecha {i}') for i in range(6)]
+    db.add_ampliacion_history(dated[-1], 'Primera', 'Ana', 1)
+    db.add_ampliacion_history(dated[-1], 'Segunda', 'Ana', 1)
+    user_id = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    
+    html = client.get('/admin/tasks').get_data(as_text=True)
+    
+    assert html.count('class="task-card"') == 8
+    assert 'Con fecha 9' in html and 'Con fecha 5' not in html
+    assert 'Segunda' in html and 'Primera' not in html
+    
+    seen = []
+    cursor = None
+    while True:
+        query = {'section': 'dated', **({'cursor': cursor} if cursor else {})}
+        response = client.get('/admin/tasks/page', query_string=query)
+        seen.extend(int(task_id) for task_id in re.findall(r'class="task-card-id">#(\d+)<', response.get_data(as_text=True)))
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert seen == list(reversed(dated))
+    
+    fragment = client.get('/admin/tasks/page?section=undated&search=SIN FECHA 0').get_data(as_text=True)
+    assert fragment.count('class="task-card-slide"') == 1 and f'data-task-id="{undated[0]}"' in fragment
+    assert client.get('/admin/tasks/page?section=otra').status_code == 400
@@ -0,0 +1,237 @@
+"""Tests para la sincronización incremental con Google Calendar contra un servidor local que imita la API"""
+import email.parser
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+import calendar_sync
+
+CALENDAR_ID = 'tareas@example.com'
+EVENTS_PATH = re.compile(r'^/calendar/v3/calendars/([^/]+)/events(?:/([^/?]+))?$')
+
+
+class FakeCalendar:
+    """Eventos de un calendario con el comportamiento de la API v3 que usa la sincronización"""
+    
+    def __init__(self):
+        self.events = {}
+        self.version = 0  # Cada cambio sube la versión; el syncToken es la versión leída
+        self.http_calls = 0
+        self.expired_tokens = set()
+        self.lock = threading.Lock()
+    
+    def _touch(self, event):
+        self.version += 1
+        event['etag'] = f'"{self.version}"'
+        event['_version'] = self.version
+    
+    def edit_remote(self, event_id, **fields):
+        """Simula un cambio hecho por un usuario en Google Calendar"""
+        with self.lock:
+            self.events[event_id].update(fields)
+            self._touch(self.events[event_id])
+    
+    def handle(self, method, path, body):
+        parsed = urllib.parse.urlparse(path)
+        match = EVENTS_PATH.match(parsed.path)
+        if not match:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        event_id = match.group(2)
+        with self.lock:
+            if method == 'POST' and event_id is None:
+                event_id = f'evt{len(self.events) + 1}'
+                event = {**json.loads(body), 'id': event_id, 'status': 'confirmed',
+                         'htmlLink': f'https://calendar.example.com/event?eid={event_id}'}
+                self.events[event_id] = event
+                self._touch(event)
+                return 200, self._public(event)
+            if method == 'GET' and event_id is None:
+                return self._list(urllib.parse.parse_qs(parsed.query))
+            event = self.events.get(event_id)
+            if event is None or event['status'] == 'cancelled':
+                return 410 if event else 404, {'error': {'code': 410 if event else 404, 'message': 'Gone'}}
+            if method == 'PATCH':
+                event.update(json.loads(body))
+                self._touch(event)
+                return 200, self._public(event)
+            if method == 'DELETE':
+                event['status'] = 'cancelled'
+                self._touch(event)
+                return 204, None
+        return 405, {'error': {'code': 405, 'message': 'Method Not Allowed'}}
+    
+    def _list(self, query):
+        token = query.get('syncToken', [None])[0]
+        if token in self.expired_tokens:
+            return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid'}}
+        since = int(token) if token else 0
+        items = [self._public(e) for e in self.events.values() if e['_version'] > since]
+        return 200, {'items': items, 'nextSyncToken': str(self.version)}
+    
+    @staticmethod
+    def _public(event):
+        return {k: v for k, v in event.items() if not k.startswith('_')}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+    
+    def _respond(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _handle(self):
+        calendar = self.server.calendar
+        calendar.http_calls += 1
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.startswith('/batch/'):
+            return self._batch(calendar, body)
+        status, payload = calendar.handle(self.command, self.path, body)
+        self._respond(status, 'application/json', json.dumps(payload or {}).encode('utf-8'))
+    
+    def _batch(self, calendar, body):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+        )
+        boundary = 'batch_response'
+        parts = []
+        for part in message.get_payload():
+            head, _, part_body = part.get_payload().partition('\n\n')
+            method, path, _ = head.splitlines()[0].split(' ')
+            status, payload = calendar.handle(method, path, part_body.strip().encode('utf-8'))
+            content = json.dumps(payload) if payload is not None else ''
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{content}\r\n"
+            )
+        response = ''.join(parts) + f"--{boundary}--\r\n"
+        self._respond(200, f'multipart/mixed; boundary={boundary}', response.encode('utf-8'))
+    
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+
+@pytest.fixture
+def calendar():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.calendar = FakeCalendar()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.calendar.url = f'http://127.0.0.1:{server.server_port}/calendar/v3/'
+    yield server.calendar
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine(calendar, db):
+    service = build('calendar', 'v3', http=httplib2.Http(), static_discovery=True,
+                    client_options={'api_endpoint': calendar.url})
+    return calendar_sync.CalendarSyncEngine(service, CALENDAR_ID, db)
+
+
+def _synced_task(db, engine, title='Revisar caldera', task_date='2026-03-02T10:00:00'):
+    task_id = db.create_task(1, 'Ana', title, task_date=task_date)
+    engine.track(task_id)
+    return task_id
+
+
+def test_track_creates_event(db, engine, calendar):
+    """Test que una tarea seguida crea su evento y guarda el enlace"""
+    task_id = _synced_task(db, engine)
+    
+    result = engine.sync()
+    
+    assert result['inserted'] == 1
+    task = db.get_task_by_id(task_id)
+    event = calendar.events[task['google_event_id']]
+    assert event['summary'] == 'Revisar caldera'
+    assert event['start']['dateTime'] == '2026-03-02T10:00:00'
+    assert task['google_event_link'] == event['htmlLink']
+
+
+def test_bulk_reschedule_uses_few_http_calls(db, engine, calendar):
+    """Test que reprogramar 500 tareas cuesta un puñado de llamadas HTTP"""
+    task_ids = [_synced_task(db, engine, f'Tarea {i}') for i in range(500)]
+    engine.sync()
+    
+    for task_id in task_ids:
+        db.update_task(task_id, task_date='2026-03-09T10:00:00')
+    calendar.http_calls = 0
+    result = engine.sync()
+    
+    assert result['patched'] == 500 and result['errors'] == 0
+    assert calendar.http_calls <= 12
+    assert all(e['start']['dateTime'] == '2026-03-09T10:00:00' for e in calendar.events.values())
+
+
+def test_unchanged_tasks_are_not_sent(db, engine, calendar):
+    """Test que los cambios que no afectan al evento no generan peticiones"""
+    task_id = _synced_task(db, engine)
+    engine.sync()
+    db.update_task(task_id, priority='urgent')
+    
+    result = engine.sync()
+    
+    assert result['patched'] == 0 and result['inserted'] == 0
+    assert result['http_calls'] == 1  # Solo la lectura incremental
+
+
+def test_deleted_and_cancelled_tasks_remove_event(db, engine, calendar):
+    """Test que borrar o cancelar la tarea borra su evento"""
+    deleted = _synced_task(db, engine, 'Borrada')
+    cancelled = _synced_task(db, engine, 'Cancelada')
+    engine.sync()
+    deleted_event = db.get_task_by_id(deleted)['google_event_id']
+    cancelled_event = db.get_task_by_id(cancelled)['google_event_id']
+    
+    db.delete_task(deleted)
+    db.update_task(cancelled, status='cancelled')
+    result = engine.sync()
+    
+    assert result['deleted'] == 2
+    assert calendar.events[deleted_event]['status'] == 'cancelled'
+    assert calendar.events[cancelled_event]['status'] == 'cancelled'
+    assert db.get_task_by_id(cancelled)['google_event_id'] is None
+    assert db.get_calendar_sync_states() == []
+
+
+def test_remote_changes_update_task(db, engine, calendar):
+    """Test que un cambio hecho en el calendario llega a la tarea y no rebota"""
+    task_id = _synced_task(db, engine)
+    engine.sync()
+    event_id = db.get_task_by_id(task_id)['google_event_id']
+    
+    calendar.edit_remote(event_id, summary='Revisar caldera (urgente)',
+                         start={'dateTime': '2026-03-03T08:30:00Z', 'timeZone': 'Europe/Madrid'})
+    result = engine.sync()
+    
+    task = db.get_task_by_id(task_id)
+    assert result['pulled'] == 1
+    assert task['title'] == 'Revisar caldera (urgente)'
+    assert task['task_date'] == '2026-03-03T09:30:00'
+    
+    result = engine.sync()
+    assert result['patched'] == 0 and result['pulled'] == 0
+
+
+def test_remote_delete_and_expired_token(db, engine, calendar):
+    """Test que un evento borrado en el calendario deja la tarea sin evento, también tras un syncToken caducado"""
+    task_id = _synced_task(db, engine)
+    engine.sync()
+    event_id = db.get_task_by_id(task_id)['google_event_id']
+    
+    calendar.expired_tokens.add(db.get_calendar_sync_token(CALENDAR_ID))
+    calendar.edit_remote(event_id, status='cancelled')
+    engine.sync()
+    
+    assert db.get_task_by_id(task_id)['google_event_id'] is None
+    assert db.get_calendar_sync_states([task_id]) == []
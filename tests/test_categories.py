@@ -0,0 +1,55 @@
+"""Tests para el registro de categorías en memoria"""
+import database
+
+
+def test_category_lookups(db):
+    """Test que las categorías se buscan por nombre y por nombre de visualización"""
+    assert db.get_category('visitas')['display_name'] == 'Visitas'
+    assert db.get_category_by_display_name(' administración ')['name'] == 'administracion'
+    assert db.get_category('inexistente') is None
+    assert db.get_category_names() == [c['name'] for c in db.get_all_categories()]
+
+
+def test_registry_loaded_once_and_invalidated(db, monkeypatch):
+    """Test que el registro se lee una vez y se relee tras update_category"""
+    opened = []
+    get_connection = db.get_connection
+    monkeypatch.setattr(db, 'get_connection', lambda: opened.append(1) or get_connection())
+    
+    db.get_all_categories()[0]['icon'] = 'modificado'
+    db.get_category('visitas')
+    db.get_category_by_display_name('Ideas')
+    assert opened == [1]
+    assert db.get_all_categories()[0]['icon'] != 'modificado'
+    
+    version = db.categories_version
+    category_id = db.get_category('visitas')['id']
+    assert db.update_category(category_id, display_name='Visitas técnicas')
+    
+    assert db.categories_version != version
+    assert db.get_category('visitas')['display_name'] == 'Visitas técnicas'
+    assert db.get_category_by_display_name('visitas técnicas')['name'] == 'visitas'
+    assert db.get_category_by_display_name('Visitas') is None
+
+
+def test_registry_sees_changes_from_other_process(db, monkeypatch):
+    """Test que el registro relee las categorías cambiadas desde otra conexión (otro proceso)"""
+    import config
+    other = database.Database(db.db_path)
+    version = db.categories_version
+    assert db.get_category('visitas')['display_name'] == 'Visitas'
+    
+    category_id = other.get_category('visitas')['id']
+    assert other.update_category(category_id, display_name='Visitas técnicas')
+    
+    # Dentro del intervalo de comprobación se sigue usando lo cacheado
+    assert db.get_category('visitas')['display_name'] == 'Visitas'
+    
+    monkeypatch.setattr(config, 'CATEGORIES_CHECK_SECONDS', 0)
+    assert db.get_category('visitas')['display_name'] == 'Visitas técnicas'
+    assert db.categories_version != version
+    
+    # Sin cambios en la BD no se vuelve a leer la tabla
+    version = db.categories_version
+    assert db.get_category('visitas')['display_name'] == 'Visitas técnicas'
+    assert db.categories_version == version
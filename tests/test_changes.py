@@ -0,0 +1,77 @@
+"""Tests para el registro de cambios (outbox) alimentado por triggers"""
+import pytest
+import database
+
+
+def _ops(changes):
+    return [(c['table_name'], c['row_id'], c['op'], c['task_id']) for c in changes]
+
+
+def test_changes_recorded_in_order(db):
+    """Test que altas, modificaciones y borrados quedan registrados con seq creciente"""
+    start = db.latest_change_seq()
+    client_id = db.create_client('Cliente A')
+    task_id = db.create_task(1, 'Ana', 'Revisar caldera', client_id=client_id)
+    image_id = db.add_image_to_task(task_id, 'file-1', '/images/tasks/1.jpg')
+    db.update_task(task_id, title='Revisar caldera nueva')
+    db.delete_task(task_id)
+    
+    changes = db.changes_since(start)
+    
+    assert _ops(changes) == [
+        ('clients', client_id, 'insert', None),
+        ('tasks', task_id, 'insert', task_id),
+        ('task_images', image_id, 'insert', task_id),
+        ('tasks', task_id, 'update', task_id),
+        ('tasks', task_id, 'delete', task_id),
+    ]
+    seqs = [c['seq'] for c in changes]
+    assert seqs == sorted(seqs) and seqs[0] > start
+    assert db.latest_change_seq() == seqs[-1]
+    assert _ops(db.changes_since(start, tables=['clients'])) == [('clients', client_id, 'insert', None)]
+    assert len(db.changes_since(start, limit=2)) == 2
+
+
+def test_archive_recorded_as_archive(db):
+    """Test que las tareas archivadas aparecen como 'archive', no como borradas"""
+    task_id = db.create_task(1, 'Ana', 'Terminada')
+    db.add_ampliacion_history(task_id, 'Cambiado el filtro', 'Ana', 1)
+    db.update_task(task_id, status='completed')
+    conn = db.get_connection()
+    conn.execute("UPDATE tasks SET updated_at = datetime('now', '-120 days') WHERE id = ?", (task_id,))
+    conn.commit()
+    conn.close()
+    start = db.latest_change_seq()
+    
+    assert db.archive_tasks(90) == 1
+    
+    assert {(c['table_name'], c['op']) for c in db.changes_since(start)} == {
+        ('task_ampliaciones_history', 'archive'),
+        ('tasks', 'archive'),
+    }
+
+
+def test_compaction_respects_consumers(db):
+    """Test que la compactación solo borra lo procesado por todos los consumidores"""
+    first = db.create_task(1, 'Ana', 'Primera')
+    second = db.create_task(1, 'Ana', 'Segunda')
+    seqs = [c['seq'] for c in db.changes_since(0, tables=['tasks'])]
+    
+    db.ack_changes('calendario', seqs[-1])
+    db.ack_changes('busqueda', seqs[0])
+    db.ack_changes('busqueda', 0)  # Un ack atrasado no hace retroceder el cursor
+    assert db.get_change_cursor('busqueda') == seqs[0]
+    assert db.get_change_cursor('desconocido') is None
+    
+    db.compact_changes(retention_days=7)
+    
+    assert [c['row_id'] for c in db.changes_since(seqs[0], tables=['tasks'])] == [second]
+    with pytest.raises(database.ChangesCompactedError):
+        db.changes_since(0)
+    
+    db.ack_changes('busqueda', seqs[-1])
+    db.compact_changes(retention_days=7)
+    # El último cambio se conserva para saber hasta dónde se ha compactado
+    assert [c['seq'] for c in db.changes_since(seqs[0])] == [seqs[-1]]
+    assert db.changes_since(seqs[-1]) == []
+    assert db.latest_change_seq() == seqs[-1]
@@ -0,0 +1,102 @@
+"""Tests para la exportación de tareas y clientes a CSV y XLSX"""
+import csv
+import io
+import zipfile
+from xml.etree import ElementTree
+import pytest
+import data_export
+
+SHEET_NS = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture
+def db(db):
+    """Base de datos temporal con una visita (con cliente y ampliación) y una llamada completada"""
+    client_id = db.create_client('Comunidad Las Rosas')
+    db.visit_id = db.create_task(1, 'Ana', 'Revisar caldera', client_id=client_id, category='visitas')
+    db.add_ampliacion_history(db.visit_id, 'Falta la pieza', 'Ana', 1)
+    db.call_id = db.create_task(2, 'Luis', 'Llamar al proveedor', category='llamar')
+    db.update_task(db.call_id, status='completed', solution='Pedido hecho')
+    return db
+
+
+def _csv_rows(chunks):
+    text = b''.join(chunks).decode('utf-8-sig')
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def _xlsx_rows(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+    return [[''.join(cell.itertext()) for cell in row] for row in sheet.iterfind('.//s:row', SHEET_NS)]
+
+
+def test_tasks_csv_joins_names_and_filters(db):
+    """Test que el CSV trae cliente, categoría, ampliaciones y solución, y aplica los filtros"""
+    rows = _csv_rows(data_export.iter_export('tasks', 'csv'))
+    
+    assert [int(r['ID']) for r in rows] == [db.visit_id, db.call_id]
+    assert rows[0]['Cliente'] == 'Comunidad Las Rosas'
+    assert rows[0]['Nombre de categoría'] == 'Visitas'
+    assert rows[0]['Historial de ampliaciones'].endswith('Ana: Falta la pieza')
+    assert rows[1]['Solución'] == 'Pedido hecho'
+    
+    assert [r['Título'] for r in _csv_rows(data_export.iter_export('tasks', 'csv', status='completed'))] == ['Llamar al proveedor']
+    assert [r['Título'] for r in _csv_rows(data_export.iter_export('tasks', 'csv', search='CALDERA'))] == ['Revisar caldera']
+    assert _csv_rows(data_export.iter_export('tasks', 'csv', allowed_categories=['llamar']))[0]['Título'] == 'Llamar al proveedor'
+
+
+def test_csv_is_streamed_in_chunks(db):
+    """Test que el CSV se entrega por bloques según se leen las filas"""
+    for i in range(data_export.ROWS_PER_CHUNK * 3):
+        db.create_task(1, 'Ana', f'Tarea {i}')
+    
+    chunks = list(data_export.iter_export('tasks', 'csv'))
+    
+    assert len(chunks) >= 3
+    assert len(_csv_rows(chunks)) == data_export.ROWS_PER_CHUNK * 3 + 2
+
+
+def test_csv_neutralises_formulas(db):
+    """Test que los textos que Excel ejecutaría como fórmula se exportan precedidos de '"""
+    titles = ['=HYPERLINK("http://x","y")', '+34 600 000 000', '-1+2', '@SUM(A1)', '\tTabulado', '\rRetorno']
+    for title in titles:
+        db.create_task(1, 'Ana', title, description='=1+1')
+    
+    rows = _csv_rows(data_export.iter_export('tasks', 'csv'))[2:]
+    
+    assert [r['Título'] for r in rows] == ["'" + title for title in titles]
+    assert all(r['Descripción'] == "'=1+1" for r in rows)
+    assert all(r['ID'].isdigit() for r in rows)
+
+def test_xlsx_is_valid_workbook(db):
+    """Test que el XLSX es un libro válido con la cabecera y las filas"""
+    db.update_task(db.call_id, description='Texto con <etiquetas> & control\x07')
+    
+    rows = _xlsx_rows(b''.join(data_export.iter_export('tasks', 'xlsx')))
+    
+    assert rows[0][:3] == ['ID', 'Creada', 'Modificada']
+    assert rows[1][0] == str(db.visit_id)
+    assert 'Texto con <etiquetas> & control' in rows[2]
+    assert _xlsx_rows(b''.join(data_export.iter_export('clients', 'xlsx')))[1][1] == 'Comunidad Las Rosas'
+
+
+def test_export_route_respects_user_categories(db):
+    """Test que la descarga desde el panel aplica las categorías del usuario"""
+    import app
+    user_id = db.create_web_user('tecnico', 'hash', 'Técnico')
+    db.set_user_categories(user_id, ['llamar'])
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    
+    response = client.get('/admin/export/tasks.csv?status=all')
+    
+    assert response.status_code == 200
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert [r['Título'] for r in _csv_rows([response.data])] == ['Llamar al proveedor']
+    assert client.get('/admin/export/tasks.pdf').status_code == 404
@@ -0,0 +1,205 @@
+"""Tests para los snapshots de la base de datos"""
+import gzip
+import io
+import os
+import sqlite3
+import pytest
+import calendar_sync
+import config
+import database
+import db_backup
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture(autouse=True)
+def backup_paths(db, tmp_path, monkeypatch):
+    """Directorio de backups propio y la base de datos temporal como base de datos de la app"""
+    monkeypatch.setattr(config, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(config, 'SQLITE_PATH', db.db_path)
+
+
+@pytest.fixture
+def upload(tmp_path):
+    """Base de datos de otra instalación, comprimida como la genera /descargar_db"""
+    other = database.Database(str(tmp_path / 'other.db'))
+    other.create_task(2, 'Luis', 'Importada')
+    other.create_client('Cliente importado')
+    snapshot = db_backup.create_snapshot(source_path=other.db_path)
+    return io.BytesIO(b''.join(db_backup.iter_compressed(snapshot, 'gzip', delete=True)))
+
+
+def test_snapshot_includes_uncheckpointed_wal(db, tmp_path):
+    """Test que el snapshot incluye escrituras que aún están solo en el WAL"""
+    writer = db.get_connection()
+    writer.execute('PRAGMA wal_autocheckpoint=0')
+    for i in range(50):
+        writer.execute("INSERT INTO tasks (user_id, title) VALUES (1, ?)", (f'Tarea {i}',))
+    writer.commit()
+    
+    snapshot = db_backup.create_snapshot(source_path=db.db_path, pages=5)
+    writer.close()
+    
+    conn = sqlite3.connect(snapshot)
+    assert conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] == 50
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+
+
+def test_iter_compressed_gzip_roundtrip(db, tmp_path):
+    """Test que la descarga comprimida es un gzip válido del snapshot y lo borra al terminar"""
+    snapshot = db_backup.create_snapshot(source_path=db.db_path)
+    with open(snapshot, 'rb') as f:
+        original = f.read()
+    
+    compressed = b''.join(db_backup.iter_compressed(snapshot, 'gzip', delete=True))
+    
+    assert gzip.decompress(compressed) == original
+    assert not os.path.exists(snapshot)
+
+
+def test_download_removes_snapshot_when_body_not_read(db):
+    """Test que /descargar_db borra el snapshot al cerrar la respuesta aunque no se lea el cuerpo"""
+    import app
+    client = app.app.test_client()
+    user_id = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    
+    response = client.get('/descargar_db', buffered=False)
+    assert response.status_code == 200
+    assert list(os.scandir(config.BACKUP_DIR))
+    response.close()
+    
+    assert not list(os.scandir(config.BACKUP_DIR))
+
+
+def test_rotating_snapshots_keep_latest(db, tmp_path, monkeypatch):
+    """Test que los snapshots rotativos conservan solo los BACKUP_KEEP más recientes"""
+    monkeypatch.setattr(config, 'SQLITE_PATH', db.db_path)
+    monkeypatch.setattr(config, 'BACKUP_KEEP', 2)
+    backups = tmp_path / 'backups'
+    backups.mkdir(exist_ok=True)
+    for name in ('app_db_20260101_000000.db.gz', 'app_db_20260102_000000.db.gz'):
+        (backups / name).write_bytes(b'')
+    
+    latest = db_backup.take_rotating_snapshot()
+    
+    assert db_backup.list_snapshots() == [latest, backups / 'app_db_20260102_000000.db.gz']
+    restored = tmp_path / 'restored.db'
+    restored.write_bytes(gzip.decompress(latest.read_bytes()))
+    conn = sqlite3.connect(restored)
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+
+
+def test_import_replace_keeps_job_queue(db, upload):
+    """Test que importar reemplaza los datos en una transacción sin tocar la cola de trabajos"""
+    db.create_task(1, 'Ana', 'Local')
+    job_id = db.enqueue_job('test.pending', {})
+    
+    path = db_backup.save_upload(upload, 'app_db_20260101_000000.db.gz')
+    result = db_backup.import_database(path, 'replace')
+    
+    assert [t['title'] for t in db.get_tasks()] == ['Importada']
+    assert db.get_job(job_id)['status'] == 'pending'
+    assert result['rows']['tasks'] == 1
+    assert os.path.exists(result['backup_path'])
+    assert not os.path.exists(path)
+
+
+def test_import_replace_resets_calendar_sync(db, tmp_path):
+    """Test que reemplazar los datos rehace el estado de Google Calendar desde los eventos importados"""
+    local_task = db.create_task(1, 'Ana', 'Local')
+    db.save_calendar_sync_states([{'task_id': local_task, 'event_id': 'evento-local', 'etag': '"1"',
+                                   'event_hash': 'abc', 'status': 'synced'}])
+    db.set_calendar_sync_token('calendario', 'token-local')
+    db.ack_changes(calendar_sync.CHANGES_CONSUMER, db.latest_change_seq())
+    
+    other = database.Database(str(tmp_path / 'other.db'))
+    other.create_task(2, 'Luis', 'Sin evento')
+    imported = other.create_task(2, 'Luis', 'Con evento')
+    other.update_task(imported, google_event_id='evento-importado')
+    with open(db_backup.create_snapshot(source_path=other.db_path), 'rb') as f:
+        db_backup.import_database(db_backup.save_upload(io.BytesIO(f.read()), 'app_db.db'), 'replace')
+    
+    states = db.get_calendar_sync_states()
+    assert [(s['task_id'], s['event_id'], s['status']) for s in states] == [(imported, 'evento-importado', 'pending')]
+    assert db.get_calendar_sync_token('calendario') is None
+    assert db.get_change_cursor(calendar_sync.CHANGES_CONSUMER) is None
+
+
+def test_import_merge_adds_missing_rows(db, upload):
+    """Test que el modo merge conserva las filas existentes y añade las que faltan con ids nuevos"""
+    db.create_task(1, 'Ana', 'Local')
+    db.create_task(1, 'Ana', 'Local 2')
+    
+    path = db_backup.save_upload(upload, 'app_db.db.gz')
+    db_backup.import_database(path, 'merge')
+    
+    # La tarea importada tiene id 1, que ya existe: se añade con otro id
+    assert sorted(t['title'] for t in db.get_tasks()) == ['Importada', 'Local', 'Local 2']
+    assert db.get_client_by_name('Cliente importado') is not None
+
+
+def test_import_merge_remaps_child_rows(db, tmp_path):
+    """Test que en merge las imágenes, el historial, el archivo y las categorías de usuario siguen a su fila importada"""
+    local_task = db.create_task(1, 'Ana', 'Local')
+    db.add_image_to_task(local_task, 'local-file', '/local.jpg')
+    db.create_web_user('ana', 'hash', 'Ana')
+    
+    other = database.Database(str(tmp_path / 'other.db'))
+    other.create_web_user('luis', 'hash', 'Luis')
+    other.set_user_categories(other.get_web_user_by_username('luis')['id'], ['visitas'])
+    client_id = other.create_client('Cliente importado')
+    imported_task = other.create_task(2, 'Luis', 'Importada', client_id=client_id)
+    other.add_image_to_task(imported_task, 'imported-file', '/imported.jpg')
+    other.add_ampliacion_history(imported_task, 'Falta pieza', 'Luis', 2)
+    archived_task = other.create_task(2, 'Luis', 'Archivada')
+    other.add_ampliacion_history(archived_task, 'Hecho', 'Luis', 2)
+    other.update_task(archived_task, status='completed')
+    conn = other.get_connection()
+    conn.execute("UPDATE tasks SET updated_at = datetime('now', '-400 days')")
+    conn.commit()
+    conn.close()
+    other.archive_tasks(older_than_days=30)
+    snapshot = db_backup.create_snapshot(source_path=other.db_path)
+    
+    for _ in range(2):
+        with open(snapshot, 'rb') as f:
+            db_backup.import_database(db_backup.save_upload(io.BytesIO(f.read()), 'app_db.db'), 'merge')
+    
+    assert [image['file_id'] for image in db.get_task_images(local_task)] == ['local-file']
+    assert db.get_task_ampliaciones_history(local_task) == []
+    task = next(t for t in db.get_tasks() if t['title'] == 'Importada')
+    assert task['client_id'] == db.get_client_by_name('Cliente importado')['id']
+    assert [image['file_id'] for image in db.get_task_images(task['id'])] == ['imported-file']
+    assert [h['ampliacion_text'] for h in db.get_task_ampliaciones_history(task['id'])] == ['Falta pieza']
+    
+    archived = [t for t in db.get_tasks(include_archive=True) if t['title'] == 'Archivada']
+    assert len(archived) == 1 and archived[0]['id'] not in (local_task, task['id'])
+    history = db.get_task_ampliaciones_history(archived[0]['id'], include_archive=True)
+    assert [h['ampliacion_text'] for h in history] == ['Hecho']
+    assert db.get_users_with_categories(db.get_web_user_by_username('luis')['id'])[0]['categories'] == ['visitas']
+    assert db.get_users_with_categories(db.get_web_user_by_username('ana')['id'])[0]['categories'] == []
+    # Importar dos veces la misma base de datos no duplica nada
+    assert len(db.get_tasks()) == 2
+
+
+def test_import_rejects_invalid_database(db, tmp_path):
+    """Test que una base de datos dañada o de una versión más nueva no se importa"""
+    db.create_task(1, 'Ana', 'Local')
+    
+    with pytest.raises(db_backup.ImportValidationError):
+        db_backup.import_database(db_backup.save_upload(io.BytesIO(b'esto no es sqlite' * 100), 'x.db'))
+    
+    newer = tmp_path / 'newer.db'
+    conn = sqlite3.connect(newer)
+    conn.execute(f'PRAGMA user_version = {database.SCHEMA_VERSION + 1}')
+    conn.close()
+    with pytest.raises(db_backup.ImportValidationError, match='versión más nueva'):
+        db_backup.import_database(db_backup.save_upload(io.BytesIO(newer.read_bytes()), 'newer.db'))
+    
+    assert [t['title'] for t in db.get_tasks()] == ['Local']
+    assert not list((tmp_path / 'backups').glob('import_*'))
@@ -0,0 +1,126 @@
+"""Tests para la réplica incremental de la base de datos y la restauración a un punto en el tiempo"""
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+import pytest
+import config
+import db_replication
+
+
+class LocalSFTP:
+    """Servidor SFTP sobre un directorio local, con los métodos de paramiko.SFTPClient que se usan"""
+    
+    def __init__(self, root):
+        self.root = root
+        self.uploaded = []
+    
+    def _path(self, remote):
+        return os.path.join(self.root, remote.lstrip('/'))
+    
+    def mkdir(self, remote):
+        os.mkdir(self._path(remote))
+    
+    def listdir(self, remote):
+        return os.listdir(self._path(remote))
+    
+    def stat(self, remote):
+        return os.stat(self._path(remote))
+    
+    def open(self, remote, mode='r'):
+        return open(self._path(remote), mode)
+    
+    def put(self, local, remote):
+        self.uploaded.append((remote, os.path.getsize(local)))
+        shutil.copyfile(local, self._path(remote))
+    
+    def get(self, remote, local):
+        shutil.copyfile(self._path(remote), local)
+    
+    def posix_rename(self, old, new):
+        os.replace(self._path(old), self._path(new))
+    
+    def remove(self, remote):
+        os.remove(self._path(remote))
+    
+    def rmdir(self, remote):
+        os.rmdir(self._path(remote))
+
+
+@pytest.fixture
+def db(db, tmp_path, monkeypatch):
+    """Base de datos temporal con 300 tareas como base de datos de la app, y directorio de backups propio"""
+    monkeypatch.setattr(config, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(config, 'SQLITE_PATH', db.db_path)
+    db.task_ids = [db.create_task(1, 'Ana', f'Tarea {i} ' + 'x' * 200) for i in range(300)]
+    return db
+
+
+@pytest.fixture
+def sftp(tmp_path):
+    (tmp_path / 'remote').mkdir()
+    return LocalSFTP(str(tmp_path / 'remote'))
+
+
+def _titles(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute('SELECT title FROM tasks ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def test_delta_uploads_only_changed_chunks(db, sftp):
+    """Test que tras la base completa solo se suben los bloques cambiados"""
+    base = db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 0))
+    db.update_task(db.task_ids[4], title='Cambiada')
+    delta = db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 15))
+    
+    assert base['seq'] == 0
+    assert delta['generation'] == base['generation'] and delta['seq'] == 1
+    assert 0 < delta['changed'] < base['changed'] / 4
+    assert delta['bytes'] < base['bytes']
+
+
+def test_no_changes_uploads_nothing(db, sftp):
+    """Test que sin cambios no se sube nada"""
+    db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 0))
+    uploads = len(sftp.uploaded)
+    
+    result = db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 15))
+    
+    assert result['changed'] == 0
+    assert len(sftp.uploaded) == uploads
+
+
+def test_restore_point_in_time(db, sftp, tmp_path):
+    """Test que se restaura el estado del último punto anterior a la fecha pedida"""
+    db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 0))
+    db.update_task(db.task_ids[4], title='Primer cambio')
+    db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 15))
+    db.update_task(db.task_ids[4], title='Segundo cambio')
+    db.create_task(1, 'Ana', 'Nueva')
+    db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 30))
+    
+    output = str(tmp_path / 'restaurada.db')
+    point = db_replication.restore(sftp, '/backups/db', output, at=datetime(2026, 3, 2, 9, 20))
+    assert point['seq'] == 1
+    assert _titles(output)[4] == 'Primer cambio'
+    assert len(_titles(output)) == 300
+    
+    db_replication.restore(sftp, '/backups/db', output)
+    assert _titles(output) == _titles(db.db_path)
+    
+    with pytest.raises(ValueError):
+        db_replication.restore(sftp, '/backups/db', output, at=datetime(2026, 3, 1))
+
+
+def test_lost_generation_starts_new_base(db, sftp):
+    """Test que si el servidor pierde la generación en curso se sube otra base completa"""
+    first = db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 0))
+    shutil.rmtree(os.path.join(sftp.root, 'backups', 'db', first['generation']))
+    db.update_task(db.task_ids[4], title='Cambiada')
+    
+    result = db_replication.replicate(sftp, '/backups/db', now=datetime(2026, 3, 2, 9, 15))
+    
+    assert result['seq'] == 0 and result['generation'] != first['generation']
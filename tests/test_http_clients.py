@@ -0,0 +1,144 @@
+"""Tests del registro de clientes HTTP compartidos"""
+import pytest
+import config
+import http_clients
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    """Cada test parte de un registro vacío"""
+    http_clients.close_all()
+    yield
+    http_clients.close_all()
+
+
+def test_requests_session_compartida():
+    """La sesión se crea una vez y se reutiliza"""
+    session = http_clients.get_requests_session()
+    assert http_clients.get_requests_session() is session
+    
+    adapter = session.get_adapter('https://api.telegram.org')
+    assert adapter.max_retries.total == config.HTTP_MAX_RETRIES
+    assert 429 in adapter.max_retries.status_forcelist
+
+
+def test_requests_session_timeout_por_defecto(monkeypatch):
+    """Sin timeout explícito se aplica el configurado"""
+    import requests
+    captured = {}
+    
+    def fake_request(self, method, url, **kwargs):
+        captured.update(kwargs)
+    
+    monkeypatch.setattr(requests.Session, 'request', fake_request)
+    session = http_clients.get_requests_session()
+    session.get('https://example.com')
+    assert captured['timeout'] == (config.HTTP_CONNECT_TIMEOUT_SECONDS, config.HTTP_TIMEOUT_SECONDS)
+    
+    session.get('https://example.com', timeout=3)
+    assert captured['timeout'] == 3
+
+
+def test_openai_client_compartido(monkeypatch):
+    """El cliente de OpenAI se reutiliza entre llamadas"""
+    monkeypatch.setattr(config, 'OPENAI_ENABLED', True)
+    monkeypatch.setattr(config, 'OPENAI_API_KEY', 'sk-test')
+    client = http_clients.get_openai_client()
+    assert http_clients.get_openai_client() is client
+    assert client.max_retries == config.HTTP_MAX_RETRIES
+
+
+def test_async_openai_client_por_loop(monkeypatch):
+    """Dentro de un mismo event loop se reutiliza el cliente asíncrono"""
+    import asyncio
+    monkeypatch.setattr(config, 'OPENAI_ENABLED', True)
+    monkeypatch.setattr(config, 'OPENAI_API_KEY', 'sk-test')
+    
+    async def get_twice():
+        return http_clients.get_async_openai_client(), http_clients.get_async_openai_client()
+    
+    first, second = asyncio.run(get_twice())
+    assert first is second
+
+
+@pytest.fixture
+def token_endpoint(monkeypatch):
+    """Sustituye la petición del token a Google: cada refresco da un token nuevo válido una hora"""
+    import time
+    from datetime import datetime, timedelta, timezone
+    from google.oauth2.credentials import Credentials
+    calls = []
+    
+    def fake_refresh(self, request):
+        time.sleep(0.05)
+        calls.append(request)
+        self.token = f'token-{len(calls)}'
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+    
+    monkeypatch.setattr(Credentials, 'refresh', fake_refresh)
+    yield calls
+    # Que ningún refresco en segundo plano sobreviva al test
+    credentials = http_clients._calendar_credentials
+    if credentials is not None and credentials._refresh_thread is not None:
+        credentials._refresh_thread.join()
+
+
+def test_calendar_service_sin_red(monkeypatch, token_endpoint):
+    """El servicio se construye sin descargar el discovery y se reutiliza"""
+    import httplib2
+    
+    def no_network(*args, **kwargs):
+        raise AssertionError('petición HTTP al construir el servicio')
+    
+    monkeypatch.setattr(httplib2.Http, 'request', no_network)
+    service = http_clients.get_calendar_service()
+    assert http_clients.get_calendar_service() is service
+    assert service.events() is not None
+
+
+def test_calendar_token_un_solo_refresco(token_endpoint):
+    """Varios threads con el token caducado provocan un único refresco"""
+    import threading
+    credentials = http_clients.get_calendar_credentials()
+    headers = [{} for _ in range(8)]
+    threads = [
+        threading.Thread(target=credentials.before_request, args=(None, 'GET', 'https://example.com', h))
+        for h in headers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(token_endpoint) == 1
+    assert all(h['authorization'] == 'Bearer token-1' for h in headers)
+
+
+def test_calendar_token_refresco_anticipado(token_endpoint):
+    """Cerca de caducar, la petición usa el token actual y el nuevo se pide en segundo plano"""
+    from datetime import datetime, timedelta, timezone
+    credentials = http_clients.get_calendar_credentials()
+    credentials.token = 'token-viejo'
+    credentials.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=8)
+    
+    headers = {}
+    credentials.before_request(None, 'GET', 'https://example.com', headers)
+    assert headers['authorization'] == 'Bearer token-viejo'
+    
+    credentials._refresh_thread.join()
+    assert len(token_endpoint) == 1
+    assert credentials.token == 'token-1'
+
+
+def test_calendar_http_por_thread(token_endpoint):
+    """Cada thread ejecuta las peticiones del servicio con su propio cliente httplib2"""
+    import threading
+    service = http_clients.get_calendar_service()
+    request = service.events().list(calendarId='primary')
+    other = {}
+    thread = threading.Thread(target=lambda: other.update(http=service.events().list(calendarId='primary').http))
+    thread.start()
+    thread.join()
+    
+    assert service.events().get(calendarId='primary', eventId='x').http is request.http
+    assert other['http'] is not request.http
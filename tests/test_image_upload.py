@@ -0,0 +1,49 @@
+"""Tests para la subida de imágenes en segundo plano"""
+import pytest
+import job_queue
+import sftp_storage
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture
+def pending_image(db, tmp_path):
+    """Imagen guardada localmente con la subida a SFTP pendiente"""
+    local_path = tmp_path / '1_abc.jpg'
+    local_path.write_bytes(b'jpeg')
+    task_id = db.create_task(user_id=1, user_name='Ana', title='Revisar caldera')
+    image_id = db.add_image_to_task(task_id, 'file1', str(local_path), 'pending')
+    payload = {'image_id': image_id, 'local_path': str(local_path), 'remote_filename': '1_abc.jpg'}
+    return image_id, local_path, payload
+
+
+def test_upload_marks_image_remote(db, pending_image, monkeypatch):
+    """Test que al terminar la subida la imagen pasa a la ruta remota y se borra la copia local"""
+    image_id, local_path, payload = pending_image
+    monkeypatch.setattr(sftp_storage.sftp_storage, 'enabled', True)
+    monkeypatch.setattr(sftp_storage.sftp_storage, 'upload_image',
+                        lambda local, remote: f'/images/tasks/{remote}')
+    
+    result = sftp_storage.upload_image_job(payload)
+    
+    image = db.get_task_image(image_id)
+    assert result['remote_path'] == '/images/tasks/1_abc.jpg'
+    assert image['file_path'] == '/images/tasks/1_abc.jpg'
+    assert image['upload_state'] == 'remote'
+    assert not local_path.exists()
+
+
+def test_failed_upload_keeps_local_copy(db, pending_image, monkeypatch):
+    """Test que si la subida falla definitivamente la imagen queda como local"""
+    image_id, local_path, payload = pending_image
+    monkeypatch.setattr(sftp_storage.sftp_storage, 'enabled', False)
+    
+    job_id = job_queue.enqueue('images.upload', payload, idempotency_key=f'image:{image_id}')
+    assert job_queue.run_job(db.claim_job('uploads', 'w1', 60)) == 'failed'
+    
+    image = db.get_task_image(image_id)
+    assert db.get_job(job_id)['status'] == 'failed'
+    assert image['upload_state'] == 'local'
+    assert image['file_path'] == str(local_path)
+    assert local_path.exists()
@@ -0,0 +1,146 @@
+"""Tests para la cola de trabajos persistente"""
+import asyncio
+import threading
+import pytest
+import job_queue
+from job_queue import job_handler, PermanentJobError
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@job_handler('test.ok', queue='default', max_attempts=3)
+def _ok_job(payload):
+    return {'value': payload['value'] * 2, 'message': 'hecho'}
+
+
+@job_handler('test.flaky', queue='default', max_attempts=2)
+def _flaky_job(payload):
+    raise RuntimeError('fallo temporal')
+
+
+@job_handler('test.permanent', queue='default', max_attempts=5)
+def _permanent_job(payload):
+    raise PermanentJobError('no reintentar')
+
+
+def test_enqueue_idempotency_key(db):
+    """Test que la misma idempotency_key no crea trabajos duplicados"""
+    first = job_queue.enqueue('test.ok', {'value': 1}, idempotency_key='k1')
+    second = job_queue.enqueue('test.ok', {'value': 1}, idempotency_key='k1')
+    assert first == second
+    assert len(db.get_jobs()) == 1
+
+
+def test_claim_respects_priority(db):
+    """Test que se reserva primero el trabajo con mayor prioridad (número menor)"""
+    low = job_queue.enqueue('test.ok', {'value': 1}, priority=200)
+    high = job_queue.enqueue('test.ok', {'value': 2}, priority=10)
+    
+    job = db.claim_job('default', 'w1', 60)
+    assert job['id'] == high
+    assert job['status'] == 'running'
+    assert job['attempts'] == 1
+    assert db.claim_job('default', 'w1', 60)['id'] == low
+    assert db.claim_job('default', 'w1', 60) is None
+
+
+def test_run_job_success_notifies(db, monkeypatch):
+    """Test que un trabajo correcto guarda el resultado y envía el mensaje de seguimiento"""
+    sent = []
+    monkeypatch.setattr(job_queue, '_notifier', lambda chat_id, text, message_id: sent.append((chat_id, text, message_id)))
+    
+    job_id = job_queue.enqueue('test.ok', {'value': 21, 'notify': {'chat_id': 5, 'message_id': 9}})
+    assert job_queue.run_job(db.claim_job('default', 'w1', 60)) == 'done'
+    
+    job = db.get_job(job_id)
+    assert job['status'] == 'done'
+    assert job['result']['value'] == 42
+    assert sent == [(5, 'hecho', 9)]
+
+
+def test_retry_with_backoff_then_failed(db):
+    """Test que un fallo temporal se reprograma y agota los intentos"""
+    job_id = job_queue.enqueue('test.flaky', {})
+    
+    assert job_queue.run_job(db.claim_job('default', 'w1', 60)) == 'pending'
+    job = db.get_job(job_id)
+    assert job['status'] == 'pending'
+    assert job['last_error'] == 'fallo temporal'
+    # Reprogramado en el futuro: no se puede reservar todavía
+    assert db.claim_job('default', 'w1', 60) is None
+    
+    conn = db.get_connection()
+    conn.execute("UPDATE jobs SET run_at = datetime('now', '-1 seconds')")
+    conn.commit()
+    conn.close()
+    
+    assert job_queue.run_job(db.claim_job('default', 'w1', 60)) == 'failed'
+    assert db.get_job(job_id)['status'] == 'failed'
+    
+    # Volver a encolar con la misma clave reintenta el trabajo fallido
+    assert db.retry_job(job_id)
+    assert db.get_job(job_id)['status'] == 'pending'
+
+
+def test_permanent_error_not_retried(db):
+    """Test que un PermanentJobError marca el trabajo como fallido sin reintentos"""
+    job_id = job_queue.enqueue('test.permanent', {})
+    assert job_queue.run_job(db.claim_job('default', 'w1', 60)) == 'failed'
+    job = db.get_job(job_id)
+    assert job['attempts'] == 1
+    assert job['last_error'] == 'no reintentar'
+
+
+def test_visibility_timeout_reclaims_abandoned_job(db):
+    """Test que un trabajo 'running' con el bloqueo vencido vuelve a estar disponible"""
+    job_id = job_queue.enqueue('test.ok', {'value': 1})
+    assert db.claim_job('default', 'w1', 60)['id'] == job_id
+    assert db.claim_job('default', 'w2', 60) is None
+    
+    conn = db.get_connection()
+    conn.execute("UPDATE jobs SET locked_until = datetime('now', '-1 seconds')")
+    conn.commit()
+    conn.close()
+    
+    job = db.claim_job('default', 'w2', 60)
+    assert job['id'] == job_id
+    assert job['locked_by'] == 'w2'
+    assert job['attempts'] == 2
+
+
+def test_wait_for_job_wakes_up_when_worker_finishes(db):
+    """Test que wait_for_job termina cuando un worker completa el trabajo"""
+    job_id = job_queue.enqueue('test.ok', {'value': 3})
+    
+    async def wait_and_run():
+        waiter = asyncio.ensure_future(job_queue.wait_for_job(job_id, timeout=5))
+        await asyncio.sleep(0.05)
+        worker = threading.Thread(target=lambda: job_queue.run_job(db.claim_job('default', 'w1', 60)))
+        worker.start()
+        job = await waiter
+        worker.join()
+        return job
+    
+    job = asyncio.run(wait_and_run())
+    assert job['status'] == 'done'
+    assert job['result']['value'] == 6
+
+
+def test_job_admin_routes_require_master(db):
+    """Test que solo un usuario maestro puede ver la cola de trabajos y reintentar trabajos"""
+    import app
+    job_id = job_queue.enqueue('test.permanent', {'chat_id': 1234})
+    job_queue.run_job(db.claim_job('default', 'w1', 60))
+    
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = db.create_web_user('tecnico', 'hash', 'Técnico')
+    assert client.get('/admin/jobs').status_code == 302
+    assert client.post(f'/admin/jobs/{job_id}/retry').status_code == 302
+    assert db.get_job(job_id)['status'] == 'failed'
+    
+    with client.session_transaction() as session:
+        session['user_id'] = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    assert client.get('/admin/jobs').get_json()['jobs'][0]['id'] == job_id
+    assert client.post(f'/admin/jobs/{job_id}/retry').get_json() == {'success': True}
@@ -0,0 +1,162 @@
+"""Tests para los cambios de tareas en directo (SSE)"""
+import json
+import pytest
+import live_events
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture
+def broadcaster(db):
+    producer = live_events.ChangeBroadcaster(db, poll_interval=0.05, buffer_size=5)
+    yield producer
+    producer.stop()
+
+
+def _read_events(stream, count):
+    """Los 'count' primeros eventos del stream como (id, tipo, datos), saltando retry y pings"""
+    events = []
+    for message in stream:
+        fields = dict(line.split(': ', 1) for line in message.strip().split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+            if len(events) == count:
+                return events
+    return events
+
+
+def test_changes_become_task_events(db, broadcaster):
+    """Test que altas, ampliaciones, completadas y borrados llegan como un evento por tarea"""
+    broadcaster.last_seq  # Los suscriptores empiezan desde ahora
+    created = db.create_task(1, 'Ana', 'Revisar caldera')
+    completed = db.create_task(1, 'Ana', 'Cambiar grifo')
+    broadcaster.poll()
+    db.add_ampliacion_history(created, 'Falta pieza', 'Ana', 1)
+    db.update_task(completed, status='completed')
+    db.delete_task(created)
+    
+    assert broadcaster.poll() == 2
+    events = [(event['type'], event['data']['id']) for event in broadcaster.events_after(0)]
+    assert events == [
+        ('task.created', created), ('task.created', completed),
+        ('task.completed', completed), ('task.deleted', created),
+    ]
+
+
+def test_stream_resumes_from_last_event_id(db, broadcaster):
+    """Test que al reconectar con Last-Event-ID se recibe lo perdido, filtrado por categorías"""
+    first_seq = broadcaster.last_seq
+    visit = db.create_task(1, 'Ana', 'Visita', category='visitas')
+    db.create_task(1, 'Ana', 'Llamada', category='llamar')
+    sin_categoria = db.create_task(1, 'Ana', 'Sin categoría')
+    broadcaster.poll()
+    
+    stream = broadcaster.stream(after=first_seq, allowed_categories=['visitas'], heartbeat=0.05, max_seconds=2)
+    events = _read_events(stream, 2)
+    stream.close()
+    
+    assert [(event_type, data['id']) for _, event_type, data in events] == [
+        ('task.created', visit), ('task.created', sin_categoria),
+    ]
+    
+    # Un cambio posterior llega al stream reanudado desde el último id recibido
+    stream = broadcaster.stream(after=events[-1][0], heartbeat=0.05, max_seconds=2)
+    db.update_task(visit, title='Visita (urgente)')
+    events = _read_events(stream, 1)
+    stream.close()
+    assert events[0][1] == 'task.updated' and events[0][2]['title'] == 'Visita (urgente)'
+
+
+def test_stream_replays_from_log_or_resets(db, broadcaster):
+    """Test que lo que ya no está en el buffer se relee del registro, o se envía 'reset' si se ha compactado"""
+    first_seq = broadcaster.last_seq
+    task_ids = [db.create_task(1, 'Ana', f'Tarea {i}') for i in range(8)]
+    broadcaster.poll()
+    
+    events = _read_events(broadcaster.stream(after=first_seq, heartbeat=0.05, max_seconds=1), 8)
+    assert [data['id'] for _, _, data in events] == task_ids
+    
+    conn = db.get_connection()
+    conn.execute('DELETE FROM changes WHERE seq < (SELECT MAX(seq) FROM changes)')
+    conn.commit()
+    conn.close()
+    events = _read_events(broadcaster.stream(after=first_seq, heartbeat=0.05, max_seconds=1), 1)
+    assert events[0][1] == 'reset'
+
+
+def test_events_endpoint_and_card(db, monkeypatch):
+    """Test que /admin/events envía los cambios como text/event-stream y la tarjeta se puede pedir sola"""
+    import app
+    monkeypatch.setattr(live_events, 'broadcaster', live_events.ChangeBroadcaster(db, poll_interval=0.05))
+    monkeypatch.setattr(live_events.config, 'LIVE_EVENTS_MAX_SECONDS', 1)
+    client = app.app.test_client()
+    user_id = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    after = db.latest_change_seq()
+    task_id = db.create_task(1, 'Ana', 'Revisar caldera')
+    
+    response = client.get('/admin/events', headers={'Last-Event-ID': str(after)})
+    body = response.get_data(as_text=True)
+    live_events.broadcaster.stop()
+    
+    assert response.mimetype == 'text/event-stream'
+    assert 'event: task.created' in body and '"Revisar caldera"' in body
+    card = client.get(f'/admin/tasks/{task_id}/card').get_data(as_text=True)
+    assert f'data-task-id="{task_id}"' in card and 'task-card-slide' in card
+    assert client.get('/admin/tasks/9999/card').status_code == 404
+
+
+def test_producer_stops_without_subscribers(db, broadcaster):
+    """Test que el hilo productor se para cuando se cierra el último stream"""
+    stream = broadcaster.stream(heartbeat=0.05, max_seconds=5)
+    next(stream)
+    thread = broadcaster._thread
+    assert thread is not None and thread.is_alive()
+    
+    stream.close()
+    thread.join(timeout=2)
+    assert not thread.is_alive()
+    assert broadcaster._thread is None
+    
+    # Un suscriptor nuevo lo vuelve a arrancar
+    stream = broadcaster.stream(heartbeat=0.05, max_seconds=5)
+    next(stream)
+    assert broadcaster._thread is not None and broadcaster._thread.is_alive()
+    stream.close()
+
+
+def test_stream_cap_leaves_threads_for_other_requests(db, monkeypatch):
+    """Test que por encima de LIVE_EVENTS_MAX_STREAMS se responde 503 y quedan hilos libres para el resto"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import app
+    monkeypatch.setattr(live_events, 'broadcaster', live_events.ChangeBroadcaster(db, poll_interval=0.05, max_streams=2))
+    monkeypatch.setattr(live_events.config, 'LIVE_EVENTS_MAX_SECONDS', 2)
+    user_id = db.create_web_user('admin', 'hash', 'Admin', is_master=True)
+    task_id = db.create_task(1, 'Ana', 'Revisar caldera')
+    
+    def get(path):
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        started = time.monotonic()
+        response = client.get(path)
+        response.get_data()
+        return response, time.monotonic() - started
+    
+    # Tres hilos, como un worker gthread pequeño: dos streams, uno de más y una petición normal
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        streams = [pool.submit(get, '/admin/events') for _ in range(2)]
+        time.sleep(0.3)
+        rejected, _ = pool.submit(get, '/admin/events').result(timeout=1)
+        card, elapsed = pool.submit(get, f'/admin/tasks/{task_id}/card').result(timeout=1)
+        assert [future.result()[0].status_code for future in streams] == [200, 200]
+    live_events.broadcaster.stop()
+    
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == str(live_events.config.LIVE_EVENTS_BUSY_RETRY_SECONDS)
+    assert card.status_code == 200 and elapsed < 1
+    # Al cerrarse los streams se liberan las plazas
+    assert live_events.broadcaster._subscribers == 0
@@ -0,0 +1,71 @@
+"""Tests de regresión de índices: las consultas frecuentes no deben recorrer tablas ni ordenar en memoria"""
+import pytest
+
+
+@pytest.fixture
+def db(db):
+    """Base de datos temporal que registra las sentencias ejecutadas"""
+    db.statements = []
+    get_connection = db.get_connection
+
+    def traced_connection():
+        conn = get_connection()
+        conn.set_trace_callback(db.statements.append)
+        return conn
+
+    db.get_connection = traced_connection
+    return db
+
+
+# Consultas frecuentes del bot, del panel web y de los workers, tal como las ejecuta Database
+HOT_QUERIES = {
+    'bot: tareas de un usuario por estado': lambda db: db.get_tasks(user_id=1, status='open'),
+    'bot: últimas tareas abiertas': lambda db: db.get_tasks(user_id=1, status='open', limit=10),
+    'bot: página de tareas': lambda db: db.get_tasks_page(1, statuses=('open', 'pending_approval', 'cancelled')),
+    'bot: página siguiente': lambda db: db.get_tasks_page(1, after=('2026-03-02T09:30:00', 7)),
+    'bot: agenda por días': lambda db: db.get_tasks_by_day_range('2026-03-02', '2026-03-08', user_id=1, status='open'),
+    'web: todas las tareas': lambda db: db.get_tasks(),
+    'web: tareas por estado': lambda db: db.get_tasks(status='pending_approval'),
+    'web: tareas por estado y categoría': lambda db: db.get_tasks(status='open', category='Instalación'),
+    'web: tareas de un usuario': lambda db: db.get_tasks(user_id=1),
+    'web: calendario semanal': lambda db: db.get_tasks_by_day_range('2026-03-02', '2026-03-08'),
+    'api: tareas de un cliente': lambda db: db.get_tasks(status='open', client_id=3),
+    'api: página de tareas': lambda db: db.get_tasks_after(('2026-03-02 09:30:00', 7), status='open'),
+    'api: página de tareas de un usuario': lambda db: db.get_tasks_after(('2026-03-02 09:30:00', 7), user_id=1),
+    'web: página de tareas con fecha': lambda db: db.get_tasks_list_page(
+        dated=True, after=('2026-03-02T09:30:00', 7), status='open', allowed_categories=['visitas']),
+    'web: página de tareas sin fecha': lambda db: db.get_tasks_list_page(
+        dated=False, after=('2026-03-02 09:30:00', 7), status='open', search='caldera'),
+    'web: página de todas las tareas con fecha': lambda db: db.get_tasks_list_page(dated=True),
+    'web: página de todas las tareas sin fecha': lambda db: db.get_tasks_list_page(dated=False),
+    'listado: imágenes de una página': lambda db: db.get_task_images_for_tasks([1, 2, 3]),
+    'listado: últimas ampliaciones de una página': lambda db: db.get_last_ampliaciones([1, 2, 3]),
+    'detalle: imágenes de una tarea': lambda db: db.get_task_images(1),
+    'detalle: historial de ampliaciones': lambda db: db.get_task_ampliaciones_history(1),
+    'listado: última ampliación': lambda db: db.get_last_ampliacion(1),
+    'workers: reservar trabajo': lambda db: db.claim_job('audio', 'worker-1', 60),
+    'consumidores: cambios desde un seq': lambda db: db.changes_since(0, tables=['tasks']),
+}
+
+
+def _query_plan(db, sql):
+    conn = db.get_connection()
+    try:
+        return [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('name', list(HOT_QUERIES))
+def test_hot_query_uses_index(db, name):
+    """Test que la consulta usa un índice para filtrar y ordenar"""
+    HOT_QUERIES[name](db)
+    selects = [sql for sql in db.statements if sql.lstrip().upper().startswith('SELECT')]
+    assert selects, f"{name}: no se ejecutó ninguna consulta"
+
+    for sql in selects:
+        plan = _query_plan(db, sql)
+        for detail in plan:
+            # 'SCAN tabla' sin índice es un recorrido completo de la tabla
+            assert not (detail.startswith('SCAN ') and ' INDEX ' not in detail), f"{name}: {plan}"
+            assert 'TEMP B-TREE' not in detail, f"{name}: {plan}"
@@ -0,0 +1,69 @@
+"""Tests para el almacén de estado de conversación"""
+import time
+from datetime import datetime
+import pytest
+import state_store
+
+
+def test_roundtrip_preserves_parser_dates():
+    """Test que la serialización compacta conserva las fechas del parser"""
+    state = {'action': 'waiting_category', 'parsed': {'entities': {'date': datetime(2026, 3, 1, 10, 30)}}}
+    data = state_store.encode_state(state)
+    assert state_store.decode_state(data) == state
+    
+    big = {'parsed': {'text': 'x' * 2000}}
+    assert state_store.encode_state(big)[:1] == b'z'
+    assert state_store.decode_state(state_store.encode_state(big)) == big
+
+
+def test_sqlite_store_shared_between_instances(db):
+    """Test que dos instancias (como dos workers) ven el mismo estado"""
+    store_a = state_store.SQLiteStateStore(db, ttl_seconds=60)
+    store_b = state_store.SQLiteStateStore(db, ttl_seconds=60)
+    
+    store_a[42] = {'action': 'waiting_image_action', 'photo_file_id': 'abc'}
+    assert 42 in store_b
+    store_b.update(42, action='waiting_task_for_image')
+    assert store_a[42]['action'] == 'waiting_task_for_image'
+    assert store_a[42]['photo_file_id'] == 'abc'
+    
+    del store_b[42]
+    assert store_a.get(42) is None
+
+
+def test_sqlite_store_expires(db):
+    """Test que los estados expirados no se devuelven y se purgan"""
+    store = state_store.SQLiteStateStore(db, ttl_seconds=-1)
+    store[1] = {'action': 'ampliar_task'}
+    assert 1 not in store
+    assert db.purge_expired_conversation_states() == 1
+
+
+def test_memory_store_lru_and_ttl():
+    """Test que el backend en memoria respeta el límite de entradas y el TTL"""
+    store = state_store.MemoryStateStore(ttl_seconds=60, max_entries=2)
+    store[1] = {'n': 1}
+    store[2] = {'n': 2}
+    store.get(1)
+    store[3] = {'n': 3}
+    assert 2 not in store
+    assert store[1] == {'n': 1}
+    assert len(store) == 2
+    
+    store.ttl_seconds = 0
+    store[4] = {'n': 4}
+    time.sleep(0.01)
+    assert store.get(4) is None
+
+
+def test_state_store_is_abstract():
+    """Test que StateStore no se puede instanciar ni heredar sin implementar get/set/delete"""
+    with pytest.raises(TypeError):
+        state_store.StateStore()
+    
+    class Incomplete(state_store.StateStore):
+        def get(self, key, default=None):
+            return default
+    
+    with pytest.raises(TypeError):
+        Incomplete()
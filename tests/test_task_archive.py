@@ -0,0 +1,78 @@
+"""Tests para el archivo de tareas terminadas"""
+import pytest
+import database
+import job_queue
+import task_archive
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+def _age_task(db, task_id, days):
+    conn = db.get_connection()
+    conn.execute("UPDATE tasks SET updated_at = datetime('now', ?) WHERE id = ?", (f'-{days} days', task_id))
+    conn.commit()
+    conn.close()
+
+
+def test_archive_moves_old_finished_tasks(db):
+    """Test que se archivan las tareas terminadas antiguas con sus imágenes y ampliaciones"""
+    old_done = db.create_task(1, 'Ana', 'Antigua completada')
+    old_open = db.create_task(1, 'Ana', 'Antigua abierta')
+    recent_done = db.create_task(1, 'Ana', 'Reciente completada')
+    db.add_image_to_task(old_done, 'file-1', '/images/tasks/1.jpg')
+    db.add_ampliacion_history(old_done, 'Cambiado el filtro', 'Ana', 1)
+    db.update_task(old_done, status='completed')
+    db.update_task(recent_done, status='completed')
+    _age_task(db, old_done, 120)
+    _age_task(db, old_open, 120)
+    
+    assert db.archive_tasks(90, batch_size=1) == 1
+    
+    assert db.get_task_by_id(old_done) is None
+    assert {t['id'] for t in db.get_tasks()} == {old_open, recent_done}
+    assert db.get_task_images(old_done) == []
+    
+    archived = db.get_task_by_id(old_done, include_archive=True)
+    assert archived['title'] == 'Antigua completada'
+    assert archived['archived'] == 1
+    assert [i['file_id'] for i in db.get_task_images(old_done, include_archive=True)] == ['file-1']
+    assert db.get_last_ampliacion(old_done, include_archive=True)['ampliacion_text'] == 'Cambiado el filtro'
+    assert len(db.get_tasks(status='completed', include_archive=True)) == 2
+    assert db.get_archive_stats() == {'active': 2, 'archived': 1}
+
+
+def test_archive_keeps_new_columns_in_sync(db):
+    """Test que una columna nueva en tasks aparece también en el archivo y en la vista"""
+    conn = db.get_connection()
+    conn.execute('ALTER TABLE tasks ADD COLUMN extra TEXT')
+    conn.commit()
+    conn.close()
+    
+    database.Database(db.db_path)
+    
+    task_id = db.create_task(1, 'Ana', 'Con columna nueva')
+    db.update_task(task_id, status='cancelled')
+    _age_task(db, task_id, 120)
+    assert db.archive_tasks(90) == 1
+    assert 'extra' in db.get_task_by_id(task_id, include_archive=True)
+
+
+def test_archive_job_schedules_next_run(db, monkeypatch):
+    """Test que el trabajo periódico archiva y deja programada la siguiente franja"""
+    monkeypatch.setattr(task_archive.config, 'ARCHIVE_AFTER_DAYS', 90)
+    task_id = db.create_task(1, 'Ana', 'Antigua')
+    db.update_task(task_id, status='completed')
+    _age_task(db, task_id, 120)
+    
+    job_queue.schedule_periodic('tasks.archive')
+    assert job_queue.schedule_periodic('tasks.archive') == db.get_jobs()[0]['id']
+    
+    assert job_queue.run_job(db.claim_job('default', 'w1', 60)) == 'done'
+    assert db.get_task_by_id(task_id) is None
+    
+    jobs = db.get_jobs()
+    assert len(jobs) == 2
+    assert jobs[0]['status'] == 'pending'
+    assert jobs[0]['idempotency_key'] == f"tasks.archive@{jobs[1]['payload']['slot'] + 1}"
+    assert db.claim_job('default', 'w1', 60) is None
@@ -0,0 +1,68 @@
+"""Tests para el formato canónico de task_date y las consultas por rango de días"""
+from datetime import datetime, timezone
+import database
+from utils import normalize_task_date
+
+
+def test_normalize_task_date_formats():
+    """Test que todas las variantes de fecha se guardan igual"""
+    expected = '2026-03-02T09:30:00'
+    assert normalize_task_date('2026-03-02T09:30:00Z') == expected
+    assert normalize_task_date('2026-03-02T09:30:00+02:00') == expected
+    assert normalize_task_date('2026-03-02 09:30:00') == expected
+    assert normalize_task_date(datetime(2026, 3, 2, 9, 30, 0, 123456, tzinfo=timezone.utc)) == expected
+    assert normalize_task_date('2026-03-02') == '2026-03-02T00:00:00'
+    assert normalize_task_date('mañana') is None
+    assert normalize_task_date(None) is None
+
+
+def test_migration_normalizes_legacy_dates(db):
+    """Test que al iniciar se normalizan las fechas antiguas y se rellena task_day"""
+    conn = db.get_connection()
+    for task_date in ('2026-03-02T09:30:00Z', '2026-03-03', '2026-03-04 18:00:00'):
+        conn.execute("INSERT INTO tasks (user_id, title, task_date) VALUES (1, 'Antigua', ?)", (task_date,))
+    conn.commit()
+    conn.close()
+    
+    database.Database(db.db_path)
+    
+    tasks = db.get_tasks_by_day_range('2026-03-01', '2026-03-31')
+    assert [(t['task_date'], t['task_day']) for t in tasks] == [
+        ('2026-03-02T09:30:00', '2026-03-02'),
+        ('2026-03-03T00:00:00', '2026-03-03'),
+        ('2026-03-04T18:00:00', '2026-03-04'),
+    ]
+
+
+
+def test_migration_marks_unrecognized_dates_once(db, caplog):
+    """Test que una fecha no reconocida se conserva y solo se avisa de ella la primera vez"""
+    conn = db.get_connection()
+    cursor = conn.execute("INSERT INTO tasks (user_id, title, task_date) VALUES (1, 'Antigua', 'mañana')")
+    task_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    
+    with caplog.at_level('WARNING', logger='database'):
+        database.Database(db.db_path)
+        database.Database(db.db_path)
+    
+    assert len([r for r in caplog.records if 'fecha no reconocida' in r.getMessage()]) == 1
+    task = db.get_task_by_id(task_id)
+    assert task['task_date'] == 'mañana'
+    assert task['task_day'] == database.UNRECOGNIZED_TASK_DAY
+
+def test_day_range_is_inclusive_and_filtered(db):
+    """Test que el rango de días incluye ambos extremos y respeta usuario y estado"""
+    first = db.create_task(user_id=1, user_name='Ana', title='Lunes', task_date=datetime(2026, 3, 2, 23, 59))
+    db.create_task(user_id=1, user_name='Ana', title='Domingo', task_date=datetime(2026, 3, 8, 8, 0))
+    db.create_task(user_id=1, user_name='Ana', title='Fuera', task_date=datetime(2026, 3, 9, 0, 0))
+    db.create_task(user_id=2, user_name='Luis', title='Otro usuario', task_date=datetime(2026, 3, 3))
+    
+    tasks = db.get_tasks_by_day_range('2026-03-02', '2026-03-08', user_id=1, status='open')
+    assert [t['title'] for t in tasks] == ['Lunes', 'Domingo']
+    
+    db.update_task(first, task_date='2026-03-10')
+    assert db.get_task_by_id(first)['task_day'] == '2026-03-10'
+    db.update_task(first, task_date=None)
+    assert db.get_task_by_id(first)['task_day'] is None
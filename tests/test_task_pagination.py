@@ -0,0 +1,70 @@
+"""Tests para los listados paginados de tareas del bot"""
+from datetime import datetime, timedelta
+import pytest
+from telegram_bot import TelegramBotHandler, CALLBACK_DATA_MAX_BYTES
+
+
+pytestmark = pytest.mark.usefixtures('global_db')
+
+
+@pytest.fixture
+def handler(db):
+    return TelegramBotHandler()
+
+
+def _create_tasks(db, count=23):
+    base = datetime(2026, 3, 2, 9, 0)
+    for i in range(count):
+        # Una de cada cuatro sin fecha; varias tareas comparten la misma fecha
+        task_date = None if i % 4 == 0 else base + timedelta(days=i // 3)
+        db.create_task(user_id=1, user_name='Ana', title=f'Tarea {i}', task_date=task_date)
+    db.create_task(user_id=2, user_name='Luis', title='De otro usuario')
+
+
+def test_keyset_pages_cover_all_tasks_once(db):
+    """Test que recorrer las páginas devuelve todas las tareas una sola vez y en orden"""
+    _create_tasks(db)
+    seen = []
+    cursor = None
+    while True:
+        tasks, cursor = db.get_tasks_page(1, after=cursor, limit=5)
+        seen.extend(tasks)
+        if cursor is None:
+            break
+    
+    assert len(seen) == 23
+    assert len({t['id'] for t in seen}) == 23
+    keys = [(t['task_date'] or '', t['id']) for t in seen]
+    assert keys == sorted(keys)
+
+
+def test_page_query_uses_index(db):
+    """Test que la consulta de una página usa el índice y no ordena en memoria"""
+    conn = db.get_connection()
+    plan = ' '.join(row['detail'] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM tasks WHERE user_id = ? AND status IN (?) "
+        "AND (task_date, id) > (?, ?) ORDER BY task_date, id LIMIT ?",
+        (1, 'open', '2026-03-02', 5, 11)
+    ))
+    conn.close()
+    assert 'idx_tasks_user_status_date' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_callback_data_fits_telegram_limit(db, handler):
+    """Test que los botones de paginación caben en 64 bytes y se decodifican igual"""
+    _create_tasks(db)
+    tasks, text, markup = handler._build_task_page(1, 'v', 'a')
+    assert len(tasks) == 10
+    
+    next_button = markup.inline_keyboard[-1][-1]
+    assert len(next_button.callback_data.encode('utf-8')) <= CALLBACK_DATA_MAX_BYTES
+    list_code, filter_code, page, cursor = handler._parse_task_page_callback(next_button.callback_data)
+    assert (list_code, filter_code, page) == ('v', 'a', 2)
+    assert cursor == (tasks[-1]['task_date'], tasks[-1]['id'])
+    
+    longest = handler._task_page_callback('a', 'w', 9999, ('2026-03-02T09:00:00.123456+00:00', 2 ** 31))
+    assert len(longest.encode('utf-8')) <= CALLBACK_DATA_MAX_BYTES
+    
+    second, _, _ = handler._build_task_page(1, 'v', 'a', page, cursor)
+    assert not {t['id'] for t in second} & {t['id'] for t in tasks}
@@ -0,0 +1,99 @@
+"""Tests para el runtime de Telegram compartido entre workers"""
+import time
+import pytest
+import telegram_runtime
+
+
+class FakeApplication:
+    """Application mínimo que registra los updates procesados"""
+    
+    def __init__(self):
+        self.bot = None
+        self.updater = None
+        self.running = False
+        self.initialize_calls = 0
+        self.processed = []
+    
+    async def initialize(self):
+        self.initialize_calls += 1
+    
+    async def process_update(self, update):
+        self.processed.append(update.update_id)
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {'lock_path': str(tmp_path / 'rt.lock'), 'socket_path': str(tmp_path / 'rt.sock')}
+
+
+def test_single_leader_and_forwarding(paths):
+    """Test que solo un proceso es líder y los demás le reenvían los updates"""
+    leader_app, follower_app = FakeApplication(), FakeApplication()
+    started = []
+    leader = telegram_runtime.TelegramRuntime(leader_app, on_leader=lambda: started.append('leader'), **paths)
+    follower = telegram_runtime.TelegramRuntime(follower_app, on_leader=lambda: started.append('follower'), **paths)
+    try:
+        assert leader.start() is True
+        assert leader.initialized
+        assert follower.start() is False
+        assert started == ['leader']
+        
+        assert follower.submit_update({'update_id': 1}) == 'forwarded'
+        assert leader.submit_update({'update_id': 2}) == 'local'
+        assert _wait_for(lambda: sorted(leader_app.processed) == [1, 2])
+        assert follower_app.initialize_calls == 0
+        assert follower_app.processed == []
+    finally:
+        follower.stop()
+        leader.stop()
+
+
+def test_follower_takes_over_when_leader_stops(paths):
+    """Test que si el líder desaparece, el siguiente update convierte al worker en líder"""
+    old_app, new_app = FakeApplication(), FakeApplication()
+    old_leader = telegram_runtime.TelegramRuntime(old_app, **paths)
+    follower = telegram_runtime.TelegramRuntime(new_app, **paths)
+    try:
+        assert old_leader.start() is True
+        assert follower.start() is False
+        old_leader.stop()
+        
+        assert follower.submit_update({'update_id': 7}) == 'local'
+        assert follower.is_leader
+        assert _wait_for(lambda: new_app.processed == [7])
+    finally:
+        follower.stop()
+        old_leader.stop()
+
+
+def test_leader_retries_failed_initialization(paths, monkeypatch):
+    """Test que si la inicialización falla, el líder la reintenta y acaba procesando updates"""
+    monkeypatch.setattr(telegram_runtime, 'STARTUP_RETRY_SECONDS', 0.01)
+    app = FakeApplication()
+    initialize = app.initialize
+    
+    async def flaky_initialize():
+        if app.initialize_calls < 2:
+            app.initialize_calls += 1
+            raise ConnectionError('Telegram no responde')
+        await initialize()
+    
+    app.initialize = flaky_initialize
+    runtime = telegram_runtime.TelegramRuntime(app, **paths)
+    try:
+        assert runtime.start() is True
+        assert _wait_for(lambda: runtime.initialized)
+        assert app.initialize_calls == 3
+        assert runtime.submit_update({'update_id': 3}) == 'local'
+        assert _wait_for(lambda: app.processed == [3])
+    finally:
+        runtime.stop()
@@ -0,0 +1,71 @@
+"""Tests para el planificador de envíos a Telegram"""
+import asyncio
+from telegram.error import RetryAfter
+from telegram_sender import OutboundRateLimiter
+
+
+def _limiter(**kwargs):
+    options = {'global_rate': 1000, 'chat_rate': 20, 'chat_burst': 1, 'group_rate': 1, 'max_retries': 2}
+    options.update(kwargs)
+    return OutboundRateLimiter(**options)
+
+
+def test_consecutive_edits_are_coalesced():
+    """Test que de varias ediciones en cola del mismo mensaje solo se envía la última"""
+    limiter = _limiter()
+    sent = []
+    
+    async def edit(text):
+        sent.append(text)
+        return text
+    
+    async def run():
+        data = lambda text: {'chat_id': 1, 'message_id': 10, 'text': text}
+        return await asyncio.gather(*[
+            limiter.process_request(edit, (text,), {}, 'editMessageText', data(text), None)
+            for text in ('uno', 'dos', 'tres')
+        ])
+    
+    results = asyncio.run(run())
+    assert sent == ['uno', 'tres']
+    assert results == ['uno', 'tres', 'tres']
+    assert limiter.stats()['coalesced'] == 1
+
+
+def test_redundant_chat_action_dropped():
+    """Test que una acción de chat repetida mientras sigue visible no se envía"""
+    limiter = _limiter(chat_burst=5)
+    calls = []
+    
+    async def action():
+        calls.append('typing')
+        return True
+    
+    async def run():
+        data = {'chat_id': 1, 'action': 'typing'}
+        for _ in range(3):
+            assert await limiter.process_request(action, (), {}, 'sendChatAction', data, None) is True
+    
+    asyncio.run(run())
+    assert calls == ['typing']
+    assert limiter.stats()['dropped_chat_actions'] == 2
+
+
+def test_retry_after_is_retried():
+    """Test que un 429 se reintenta tras el tiempo indicado por Telegram"""
+    limiter = _limiter(chat_burst=5)
+    attempts = []
+    
+    async def send():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        return 'ok'
+    
+    result = asyncio.run(limiter.process_request(send, (), {}, 'sendMessage', {'chat_id': 1, 'text': 'hola'}, None))
+    assert result == 'ok'
+    stats = limiter.stats()
+    assert stats['retried'] == 1
+    assert stats['sent'] == 1
+    assert stats['queue_depth'] == 0
+    assert stats['latency_ms']['max'] >= 0
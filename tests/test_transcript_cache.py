@@ -0,0 +1,54 @@
+"""Tests para la caché de transcripciones"""
+import config
+
+
+def test_cache_miss_then_hit(db):
+    """Test que una transcripción guardada se recupera con la misma clave"""
+    key = ('uniq1', 'openai', 'whisper-1', 'es')
+    assert db.get_cached_transcript(*key) is None
+    
+    db.save_cached_transcript(*key, 'llamar al cliente mañana')
+    assert db.get_cached_transcript(*key) == 'llamar al cliente mañana'
+    
+    stats = db.get_transcript_cache_stats()
+    assert stats['entries'] == 1
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_cache_key_includes_model_and_language(db):
+    """Test que cambiar modelo o idioma no reutiliza la transcripción"""
+    db.save_cached_transcript('uniq1', 'openai', 'whisper-1', 'es', 'texto')
+    assert db.get_cached_transcript('uniq1', 'openai', 'otro-modelo', 'es') is None
+    assert db.get_cached_transcript('uniq1', 'openai', 'whisper-1', 'en') is None
+
+
+def test_cache_ttl_expiration(db):
+    """Test que las entradas expiradas no se devuelven"""
+    db.save_cached_transcript('uniq1', 'openai', 'whisper-1', 'es', 'texto')
+    conn = db.get_connection()
+    conn.execute("UPDATE transcript_cache SET created_at = datetime('now', '-400 days')")
+    conn.commit()
+    conn.close()
+    
+    assert db.get_cached_transcript('uniq1', 'openai', 'whisper-1', 'es') is None
+
+
+def test_cache_lru_eviction(db, monkeypatch):
+    """Test que se expulsan las entradas menos usadas al superar el máximo"""
+    monkeypatch.setattr(config, 'TRANSCRIPT_CACHE_MAX_ENTRIES', 2)
+    db.save_cached_transcript('a', 'openai', 'whisper-1', 'es', 'A')
+    db.save_cached_transcript('b', 'openai', 'whisper-1', 'es', 'B')
+    
+    # 'a' se usa más recientemente que 'b'
+    conn = db.get_connection()
+    conn.execute("UPDATE transcript_cache SET last_used_at = datetime('now', '-1 hour') WHERE file_unique_id = 'b'")
+    conn.commit()
+    conn.close()
+    
+    db.save_cached_transcript('c', 'openai', 'whisper-1', 'es', 'C')
+    
+    assert db.get_cached_transcript('b', 'openai', 'whisper-1', 'es') is None
+    assert db.get_cached_transcript('a', 'openai', 'whisper-1', 'es') == 'A'
+    assert db.get_cached_transcript('c', 'openai', 'whisper-1', 'es') == 'C'
@@ -0,0 +1,66 @@
+"""Tests para la caché de identidad de los usuarios web"""
+import pytest
+
+
+@pytest.fixture
+def connections(db, monkeypatch):
+    """Cuenta las conexiones abiertas por la base de datos"""
+    opened = []
+    get_connection = db.get_connection
+    
+    def counting_get_connection():
+        opened.append(1)
+        return get_connection()
+    
+    monkeypatch.setattr(db, 'get_connection', counting_get_connection)
+    return opened
+
+
+def test_identity_includes_categories(db):
+    """Test que la identidad trae el usuario y sus categorías"""
+    user_id = db.create_web_user('ana', 'hash', 'Ana')
+    db.set_user_categories(user_id, ['Fontanería', 'Electricidad'])
+    
+    user = db.get_web_user_identity(user_id)
+    
+    assert user['username'] == 'ana'
+    assert sorted(user['categories']) == ['Electricidad', 'Fontanería']
+    assert db.get_web_user_identity(9999) is None
+
+
+def test_identity_cached_until_invalidated(db, connections):
+    """Test que la identidad se lee una vez y se vuelve a leer tras cambiar usuario o categorías"""
+    user_id = db.create_web_user('ana', 'hash', 'Ana')
+    connections.clear()
+    
+    db.get_web_user_identity(user_id)
+    db.get_web_user_identity(user_id)['categories'].append('Modificada')
+    assert db.user_has_category_access(user_id, 'Modificada') is False
+    assert len(connections) == 1
+    
+    db.set_user_categories(user_id, ['Fontanería'])
+    assert db.get_web_user_identity(user_id)['categories'] == ['Fontanería']
+    
+    db.update_web_user(user_id, full_name='Ana García')
+    assert db.get_web_user_identity(user_id)['full_name'] == 'Ana García'
+    
+    db.delete_web_user(user_id)
+    assert db.get_web_user_identity(user_id) is None
+
+
+def test_users_with_categories_single_query(db, connections):
+    """Test que el listado de usuarios con categorías se hace en una consulta"""
+    user_ids = [db.create_web_user(f'tecnico{i}', 'hash', f'Técnico {i}') for i in range(50)]
+    for user_id in user_ids[:10]:
+        db.set_user_categories(user_id, ['visitas', 'llamar'])
+    connections.clear()
+    
+    users = db.get_users_with_categories(include_master=False)
+    
+    assert len(connections) == 1
+    assert len(users) == 50
+    by_id = {u['id']: u['categories'] for u in users}
+    assert by_id[user_ids[0]] == ['llamar', 'visitas']
+    assert by_id[user_ids[-1]] == []
+    assert db.get_users_with_categories(user_id=user_ids[0])[0]['username'] == 'tecnico0'
+    assert db.get_users_with_categories(user_id=9999) == []
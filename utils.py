@@ -2,7 +2,7 @@
 import re
 import unicodedata
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, date, time
 
 
 def normalize_text(text: str) -> str:
@@ -54,16 +54,44 @@ def clean_temp_files(filepath: str) -> None:
         print(f"Warning: No se pudo eliminar archivo temporal {filepath}: {e}")
 
 
+def parse_task_date(value) -> Optional[datetime]:
+    """
+    Convierte una fecha de tarea (datetime, date o cadena ISO con 'T' o espacio,
+    con 'Z'/zona horaria o solo fecha) a datetime sin zona horaria.
+    
+    Se conserva la hora tal como se escribió (la zona se descarta, no se convierte),
+    que es como se han interpretado siempre las fechas de las tareas.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, date):
+        dt = datetime.combine(value, time())
+    else:
+        text = str(value).strip().replace('Z', '+00:00')
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            try:
+                dt = datetime.strptime(text[:10], '%Y-%m-%d')
+            except ValueError:
+                return None
+    return dt.replace(tzinfo=None, microsecond=0)
+
+
+def normalize_task_date(value) -> Optional[str]:
+    """Representación canónica de task_date ('YYYY-MM-DDTHH:MM:SS'), ordenable como texto"""
+    dt = parse_task_date(value)
+    return dt.isoformat() if dt else None
+
+
 def format_date(date_value: Optional[str | datetime]) -> str:
     """Formatea una fecha a 'dd/mm/aaaa'."""
     if not date_value:
         return ''
-    if isinstance(date_value, datetime):
-        return date_value.strftime('%d/%m/%Y')
-    try:
-        # Intentar parsear como ISO con o sin hora
-        dt = datetime.fromisoformat(date_value.replace('Z', '+00:00'))
+    dt = parse_task_date(date_value)
+    if dt:
         return dt.strftime('%d/%m/%Y')
-    except ValueError:
-        # Fallback para otros formatos si es necesario, o simplemente devolver el original
-        return date_value.split('T')[0] if 'T' in date_value else date_value
+    # Formato desconocido: devolver el original
+    return date_value.split('T')[0] if 'T' in date_value else date_value
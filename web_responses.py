@@ -0,0 +1,121 @@
+"""Utilidades para las respuestas del panel web y la API: ETags y compresión gzip/br"""
+import hashlib
+import zlib
+from typing import Iterable, Iterator, Optional
+from flask import Response
+import config
+
+try:
+    import brotli
+except ImportError:
+    # brotli es opcional: sin él solo se comprime con gzip
+    brotli = None
+
+
+def make_etag(version, *parts) -> str:
+    """
+    ETag fuerte a partir de la versión de los datos y de lo que define la respuesta.
+    
+    Args:
+        version: versión de las tablas (p. ej. Database.latest_change_seq())
+        parts: lo demás que cambia el contenido (query string, usuario...)
+    """
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+    return f'v{version}-{digest}'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Si el If-None-Match del cliente incluye el ETag (en cualquiera de sus codificaciones)"""
+    return any(if_none_match.contains(tag) for tag in (etag, f'{etag}-gzip', f'{etag}-br'))
+
+
+def not_modified(etag: str) -> Response:
+    """Respuesta 304 para un ETag que el cliente ya tiene"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def choose_encoding(accept_encodings) -> Optional[str]:
+    """Codificación a usar según Accept-Encoding: 'br' (si hay brotli), 'gzip' o None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class _Compressor:
+    """Compresor incremental con la misma interfaz para gzip y brotli"""
+    
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=config.HTTP_COMPRESSION_LEVEL)
+        else:
+            # wbits=31: flujo con cabecera y CRC de gzip
+            self._zlib = zlib.compressobj(config.HTTP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+    
+    def flush(self) -> bytes:
+        """Vacía lo pendiente sin cerrar el flujo (para que el cliente reciba cada bloque)"""
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def iter_encoded(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    """Comprime un flujo de bloques según se genera; cada bloque se envía en cuanto se comprime"""
+    if encoding is None:
+        yield from chunks
+        return
+    compressor = _Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response: Response, accept_encodings, etag: str = None) -> Response:
+    """
+    Comprime una respuesta ya generada si el cliente lo acepta y merece la pena.
+    
+    Las respuestas en streaming se comprimen al generarlas (iter_encoded). Con
+    etag, el ETag lleva la codificación como sufijo para no confundir variantes.
+    """
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if (encoding and not response.is_streamed and 'Content-Encoding' not in response.headers
+            and response.content_length and response.content_length >= config.HTTP_COMPRESSION_MIN_BYTES):
+        compressor = _Compressor(encoding)
+        response.set_data(compressor.compress(response.get_data()) + compressor.finish())
+        response.headers['Content-Encoding'] = encoding
+    else:
+        encoding = None
+    if etag:
+        response.set_etag(f'{etag}-{encoding}' if encoding else etag)
+    return response
+
+
+def streamed_response(chunks: Iterable[bytes], mimetype: str, accept_encodings,
+                      etag: str = None, headers: dict = None) -> Response:
+    """Respuesta en streaming comprimida al vuelo según Accept-Encoding"""
+    encoding = choose_encoding(accept_encodings)
+    response = Response(iter_encoded(chunks, encoding), mimetype=mimetype, headers=headers)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f'{etag}-{encoding}' if encoding else etag)
+    return response